@@ -1,6 +1,6 @@
 import os
 from urllib.parse import quote_plus
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -42,6 +42,41 @@ engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Pool riêng (nhỏ) cho SQL do chatbot LLM sinh ra - tách khỏi pool chính để một
+# truy vấn nặng không chiếm hết kết nối của các API nghiệp vụ.
+CHATBOT_SQL_POOL_SIZE = int(os.getenv("CHATBOT_SQL_POOL_SIZE", "2"))
+CHATBOT_SQL_MAX_EXECUTION_MS = int(os.getenv("CHATBOT_SQL_MAX_EXECUTION_MS", "2000"))
+
+chatbot_engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=CHATBOT_SQL_POOL_SIZE,
+    max_overflow=0,
+    pool_timeout=5,
+)
+
+
+@event.listens_for(chatbot_engine, "connect")
+def _set_chatbot_statement_timeout(dbapi_connection, connection_record):
+    """Giới hạn thời gian chạy mỗi câu lệnh và chỉ cho đọc trên pool chatbot (MySQL / MariaDB)."""
+    cursor = dbapi_connection.cursor()
+    try:
+        # MySQL 5.7.8+: mili giây, chỉ áp dụng cho SELECT
+        cursor.execute(f"SET SESSION max_execution_time = {CHATBOT_SQL_MAX_EXECUTION_MS}")
+    except Exception:
+        try:
+            # MariaDB 10.1+: giây
+            cursor.execute(f"SET SESSION max_statement_time = {CHATBOT_SQL_MAX_EXECUTION_MS / 1000.0}")
+        except Exception:
+            pass
+    try:
+        # Mọi transaction trên pool này là READ ONLY: DB từ chối mọi câu ghi
+        cursor.execute("SET SESSION TRANSACTION READ ONLY")
+    except Exception:
+        pass
+    finally:
+        cursor.close()
+
 
 # Dependency để dùng trong các route
 def get_db():
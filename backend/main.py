@@ -22,6 +22,7 @@ from sqlalchemy.orm import Session
 from backend.database import SessionLocal
 from backend.routes.deps import get_current_user
 from backend.models import SystemLog
+from backend.utils.compression import CompressionMiddleware
 
 # Database & Models
 from backend.database import engine
@@ -53,6 +54,11 @@ from backend.routes import (
 )
 
 from backend.routes.chatbot import load_chatbot_knowledge
+from backend.utils.order_totals import start_order_total_verifier
+from backend.utils.outbox import start_outbox_dispatcher, stop_outbox_dispatcher
+from backend.utils.order_archive import start_order_archiver
+from backend.utils.stock_ledger import start_stock_snapshotter
+from backend.utils.low_stock import start_low_stock_tracker, stop_low_stock_tracker
 
 # =====================================================
 # 🚀 1. Khởi tạo ứng dụng FastAPI (sử dụng lifespan thay cho on_event startup)
@@ -65,7 +71,25 @@ async def lifespan(app: FastAPI):
     # Tự động tạo các bảng trong CSDL nếu chưa tồn tại.
     models.Base.metadata.create_all(bind=engine)
     logging.info("✅ Database tables checked/created successfully (lifespan).")
+    # Kiểm tra định kỳ TongTien của các đơn vừa sửa chi tiết (phát hiện lệch)
+    verifier_stop = start_order_total_verifier()
+    # Xử lý nền các tác vụ phụ của đơn hàng (transactional outbox)
+    outbox_stop = start_outbox_dispatcher()
+    # Lưu trữ định kỳ đơn hàng đã đóng (tắt khi ORDER_ARCHIVE_INTERVAL_HOURS=0)
+    archiver_stop = start_order_archiver()
+    # Snapshot định kỳ tồn kho từ StockLedger (tắt khi STOCK_SNAPSHOT_INTERVAL_HOURS=0)
+    snapshot_stop = start_stock_snapshotter()
+    # Theo dõi sản phẩm sắp hết hàng trong bộ nhớ, đẩy thay đổi qua SSE
+    low_stock_stop = start_low_stock_tracker()
     yield
+    stop_low_stock_tracker(low_stock_stop)
+    if snapshot_stop is not None:
+        snapshot_stop.set()
+    if archiver_stop is not None:
+        archiver_stop.set()
+    if verifier_stop is not None:
+        verifier_stop.set()
+    stop_outbox_dispatcher(outbox_stop)
 
 
 app = FastAPI(
@@ -90,6 +114,14 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# =====================================================
+# 🗜️ 2.5 Nén response (gzip / brotli)
+# =====================================================
+# Ngưỡng, loại nội dung và mức nén cấu hình qua biến môi trường COMPRESSION_*
+# (xem backend/utils/compression.py). Response có ETag (danh mục / sản phẩm)
+# được cache bản đã nén để không nén lại payload giống hệt.
+app.add_middleware(CompressionMiddleware)
+
 # Exception handlers to ensure CORS headers are added to error responses
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request: Request, exc: StarletteHTTPException):
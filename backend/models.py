@@ -9,6 +9,7 @@ from sqlalchemy import (
     CHAR,
     Text,
     Boolean,
+    Index,
     Enum as SAEnum,
 )
 from sqlalchemy.dialects.mysql import INTEGER as MySQLInteger
@@ -72,6 +73,36 @@ class SanPham(Base):
         "DonHang_SanPham", back_populates="sanpham")
 
 
+# Indexed side table for SanPham.MoTa JSON attributes (one row per scalar attribute).
+# Kept in sync by backend/utils/product_attributes.sync_product_attributes().
+class SanPham_ThuocTinh(Base):
+    __tablename__ = "SanPham_ThuocTinh"
+    MaSP = Column(Integer, ForeignKey(
+        "SanPham.MaSP", onupdate="CASCADE", ondelete="CASCADE"), primary_key=True)
+    TenThuocTinh = Column(String(50), primary_key=True)  # Normalized key (e.g. "brand", "capacity")
+    GiaTri = Column(String(255))  # Attribute value as text
+    __table_args__ = (
+        Index("idx_thuoctinh_giatri", "TenThuocTinh", "GiaTri", "MaSP"),
+    )
+
+
+# Persistent server-side cart (one row per customer + product).
+# GiuHangDen = soft reservation expiry: until then SoLuong is held for this
+# customer and not available to other carts / new orders.
+# Managed by backend/utils/cart_reservations.py.
+class GioHang(Base):
+    __tablename__ = "GioHang"
+    MaKH = Column(Integer, ForeignKey(
+        "KhachHang.MaKH", onupdate="CASCADE", ondelete="CASCADE"), primary_key=True)
+    MaSP = Column(Integer, ForeignKey(
+        "SanPham.MaSP", onupdate="CASCADE", ondelete="CASCADE"), primary_key=True)
+    SoLuong = Column(Integer, nullable=False)
+    GiuHangDen = Column(DateTime, nullable=True)  # Reservation expiry (UTC)
+    NgayCapNhat = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    __table_args__ = (
+        Index("idx_giohang_giuhang", "MaSP", "GiuHangDen"),
+    )
+
 # =====================================================
 # 📋 ORDER PROCESSING FLOW - DATABASE MODELS
 # =====================================================
@@ -102,6 +133,10 @@ class DonHang(Base):
         "DonHang_SanPham", back_populates="donhang")  # Link to order items
     thanhtoans = relationship("ThanhToan", back_populates="donhang")  # Link to payments
     shipper = relationship("Shipper", back_populates="donhangs")  # Link to shipper
+    __table_args__ = (
+        # Customer order history: keyset pagination of /api/donhang/my-orders
+        Index("idx_donhang_makh_ngaydat", "MaKH", "NgayDat", "MaDonHang"),
+    )
 
 
 # ORDER FLOW MODEL: DonHang_SanPham (Order Item)
@@ -215,6 +250,28 @@ class ActivityLog(Base):
     CreatedAt = Column(DateTime, default=datetime.utcnow)
 
 
+class OutboxEvent(Base):
+    """
+    Transactional outbox: side effects of an order change (activity log,
+    cache refresh...) written in the same transaction as the change and
+    processed later by backend/utils/outbox.py.
+    """
+    __tablename__ = "OutboxEvent"
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    EventType = Column(String(50), nullable=False)
+    Entity = Column(String(100), nullable=True)
+    EntityId = Column(String(100), nullable=True)
+    Payload = Column(Text, nullable=True)  # JSON
+    Status = Column(String(20), default="PENDING")  # PENDING, DONE, FAILED
+    Attempts = Column(Integer, default=0)
+    LastError = Column(Text, nullable=True)
+    CreatedAt = Column(DateTime, default=datetime.utcnow)
+    ProcessedAt = Column(DateTime, nullable=True)
+    __table_args__ = (
+        Index("idx_outbox_status", "Status", "Id"),
+    )
+
+
 class SystemConfig(Base):
     __tablename__ = "SystemConfig"
     Id = Column(Integer, primary_key=True, autoincrement=True)
@@ -252,3 +309,87 @@ class PaymentTransaction(Base):
     donhang = relationship("DonHang")  # Link to order
 
 
+
+
+# =====================================================
+# 🗄️ Order archive (closed orders moved out of the hot tables)
+# =====================================================
+# Same columns as the live tables plus NgayLuuTru, without foreign keys so
+# archived rows survive changes to customers/products. Filled and read by
+# backend/utils/order_archive.py.
+class DonHang_Archive(Base):
+    __tablename__ = "DonHang_Archive"
+    MaDonHang = Column(Integer, primary_key=True, autoincrement=False)
+    NgayDat = Column(Date)
+    TongTien = Column(Numeric(10, 2))
+    TrangThai = Column(String(50))
+    MaKH = Column(Integer, nullable=True)
+    MaNV = Column(Integer, nullable=True)
+    KhuyenMai = Column(String(50), nullable=True)
+    PhiShip = Column(Numeric(10, 2), nullable=True)
+    MaShipper = Column(Integer, nullable=True)
+    NgayLuuTru = Column(DateTime, default=datetime.utcnow)  # Archived at
+    __table_args__ = (
+        Index("idx_donhang_archive_ngaydat", "NgayDat"),
+        Index("idx_donhang_archive_makh_ngaydat", "MaKH", "NgayDat", "MaDonHang"),
+    )
+
+
+class DonHang_SanPham_Archive(Base):
+    __tablename__ = "DonHang_SanPham_Archive"
+    MaDonHang = Column(Integer, primary_key=True, autoincrement=False)
+    MaSP = Column(Integer, primary_key=True, autoincrement=False)
+    SoLuong = Column(Integer)
+    DonGia = Column(Numeric(10, 2))
+    GiamGia = Column(Numeric(10, 2))
+    __table_args__ = (
+        Index("idx_donhang_sanpham_archive_masp", "MaSP"),
+    )
+
+
+class ThanhToan_Archive(Base):
+    __tablename__ = "ThanhToan_Archive"
+    MaThanhToan = Column(Integer, primary_key=True, autoincrement=False)
+    PhuongThuc = Column(String(50))
+    NgayThanhToan = Column(Date)
+    SoTien = Column(Numeric(10, 2))
+    MaDonHang = Column(Integer, index=True)
+
+
+class PaymentTransaction_Archive(Base):
+    __tablename__ = "PaymentTransaction_Archive"
+    TransactionId = Column(String(50), primary_key=True)
+    MaDonHang = Column(MySQLInteger(unsigned=True), index=True)
+    Amount = Column(Numeric(12, 2), nullable=False)
+    Status = Column(String(20))
+    Signature = Column(String(255), nullable=True)
+    CreatedAt = Column(DateTime)
+    UpdatedAt = Column(DateTime)
+
+
+class StockLedger(Base):
+    """
+    Append-only stock movements (backend/utils/stock_ledger.py). The sum of
+    Delta per product equals SanPham.SoLuongTonKho; rows are never updated.
+    """
+    __tablename__ = "StockLedger"
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    MaSP = Column(Integer, nullable=False)
+    Delta = Column(Integer, nullable=False)
+    Reason = Column(String(20), nullable=False)  # opening, confirm, reserve, release, cancel, adjust, import
+    RefType = Column(String(30), nullable=True)  # DonHang, SanPham, ...
+    RefId = Column(String(50), nullable=True)
+    UserId = Column(Integer, nullable=True)
+    CreatedAt = Column(DateTime, default=datetime.utcnow, nullable=False)
+    __table_args__ = (
+        Index("idx_stockledger_masp_time", "MaSP", "CreatedAt"),
+        Index("idx_stockledger_time", "CreatedAt"),
+    )
+
+
+class StockSnapshot(Base):
+    """Stock of every product at TakenAt, folded from StockLedger (one row per product per run)."""
+    __tablename__ = "StockSnapshot"
+    TakenAt = Column(DateTime, primary_key=True)
+    MaSP = Column(Integer, primary_key=True, autoincrement=False)
+    SoLuong = Column(Integer, nullable=False)
@@ -1,21 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import json
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Dict
 
-from backend.database import get_db
-from backend.models import SanPham, SystemConfig
-from backend.routes.deps import get_current_user
+from backend.database import get_db, SessionLocal
+from backend.routes.deps import (
+    SSE_TOKEN_TTL_SECONDS,
+    create_stream_token,
+    get_current_user,
+    get_current_user_stream,
+)
+from backend.utils.low_stock import SUBSCRIPTION_CLOSED, low_stock_tracker
 
 
 router = APIRouter(prefix="/alerts", tags=["Alerts"])
 
+# Comment line sent when idle so proxies keep the SSE connection open
+LOW_STOCK_SSE_KEEPALIVE_SECONDS = float(os.getenv("LOW_STOCK_SSE_KEEPALIVE_SECONDS", "15"))
 
-def get_low_stock_threshold(db: Session, default_threshold: int = 5) -> int:
-    cfg = db.query(SystemConfig).filter(SystemConfig.ConfigKey == "LOW_STOCK_THRESHOLD").first()
-    try:
-        return int(cfg.ConfigValue) if cfg and cfg.ConfigValue is not None else default_threshold
-    except ValueError:
-        return default_threshold
+
+def _alert_items(items: List[Dict]) -> List[Dict]:
+    return [
+        {
+            "MaSP": item["MaSP"],
+            "TenSP": item["TenSP"],
+            "SoLuongTonKho": item["SoLuongTonKho"],
+            "Threshold": item["Threshold"],
+        }
+        for item in items
+    ]
 
 
 @router.get("/low-stock", response_model=List[Dict], summary="Danh sách sản phẩm sắp hết hàng")
@@ -24,17 +42,71 @@ def get_low_stock_alerts(db: Session = Depends(get_db), current_user: Dict = Dep
     if current_user.get("role") not in ["Admin", "Manager"]:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
 
-    threshold = get_low_stock_threshold(db)
-    products = db.query(SanPham).filter(SanPham.IsDelete == False, SanPham.SoLuongTonKho <= threshold).all()
+    # Threshold (SystemConfig LOW_STOCK_THRESHOLD) and stock are served from memory
+    low_stock_tracker.ensure_fresh(db)
+    return _alert_items(low_stock_tracker.low_stock())
+
+
+def _current_alerts() -> Dict:
+    db = SessionLocal()
+    try:
+        low_stock_tracker.ensure_fresh(db)
+        return {"threshold": low_stock_tracker.threshold, "products": _alert_items(low_stock_tracker.low_stock())}
+    finally:
+        db.close()
+
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
 
-    results: List[Dict] = []
-    for sp in products:
-        results.append({
-            "MaSP": sp.MaSP,
-            "TenSP": sp.TenSP,
-            "SoLuongTonKho": sp.SoLuongTonKho,
-            "Threshold": threshold,
-        })
-    return results
 
+@router.post("/low-stock/stream-token", summary="Token ngắn hạn để mở stream cảnh báo (SSE)")
+def create_low_stock_stream_token(current_user: Dict = Depends(get_current_user)):
+    """
+    EventSource không gửi được header Authorization: client gọi endpoint này
+    (với header như bình thường) rồi mở /low-stock/stream?token=<token>.
+    Token chỉ dùng được cho stream và hết hạn sau SSE_TOKEN_TTL_SECONDS giây.
+    """
+    if current_user.get("role") not in ["Admin", "Manager"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
+    return {"token": create_stream_token(current_user), "expires_in": SSE_TOKEN_TTL_SECONDS}
+
+
+@router.get("/low-stock/stream", summary="Cảnh báo sắp hết hàng theo thời gian thực (SSE)")
+async def stream_low_stock_alerts(request: Request, current_user: Dict = Depends(get_current_user_stream)):
+    """
+    Server-Sent Events cho dashboard admin, thay cho việc poll /alerts/low-stock.
+    - Sự kiện đầu tiên `snapshot`: danh sách hiện tại.
+    - Sau đó `low_stock.entered` / `low_stock.updated` / `low_stock.cleared` mỗi khi
+      tồn kho thay đổi qua ngưỡng (hoặc thay đổi khi đang dưới ngưỡng).
+    - Client đọc quá chậm (đầy hàng đợi) bị ngắt stream; EventSource tự kết nối
+      lại và nhận snapshot mới.
+    EventSource không gửi được header nên truyền token từ POST
+    /alerts/low-stock/stream-token qua ?token= (JWT đăng nhập bị từ chối).
+    """
+    if current_user.get("role") not in ["Admin", "Manager"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
+
+    async def events():
+        # Subscribe before reading the snapshot so no change falls in between
+        queue = low_stock_tracker.subscribe()
+        try:
+            yield _sse("snapshot", await run_in_threadpool(_current_alerts))
+            while not await request.is_disconnected():
+                try:
+                    data = await asyncio.wait_for(queue.get(), LOW_STOCK_SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if data is SUBSCRIPTION_CLOSED:
+                    # Too far behind and dropped: end the stream, EventSource reconnects
+                    break
+                yield _sse(data["type"], data)
+        finally:
+            low_stock_tracker.unsubscribe(queue)
 
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
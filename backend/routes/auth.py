@@ -8,6 +8,7 @@ from passlib.context import CryptContext
 from backend.database import get_db
 from backend.models import NhanVien, TaiKhoan, KhachHang
 from backend.routes.deps import get_current_user
+from backend.utils.order_search import customer_search_index
 from backend.schemas import RegisterRequest, RegisterCustomerRequest, CustomerRegisterRequest, LoginRequest, TokenResponse, UserResponse, ForgotPasswordRequest, ResetPasswordRequest, ChangePasswordRequest
 
 # =====================================================
@@ -155,6 +156,7 @@ def customer_register(request_data: CustomerRegisterRequest, db: Session = Depen
         db.add(new_customer)
         db.commit()
         db.refresh(new_customer)
+        customer_search_index.upsert_customer(new_customer)
 
         # BƯỚC 3: TẠO VÀ LƯU TÀI KHOẢN
         new_account = TaiKhoan(
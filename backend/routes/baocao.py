@@ -4,8 +4,11 @@ from sqlalchemy import func, desc
 from datetime import datetime, timedelta
 from typing import Dict, List
 from backend.database import get_db
-from backend.models import DonHang, DonHang_SanPham, SanPham, KhachHang, DanhMuc
+from backend.models import DonHang, SanPham, KhachHang, DanhMuc
 from backend.routes.deps import get_current_user
+from backend.utils.low_stock import low_stock_tracker
+from backend.utils.order_archive import order_headers, order_lines
+from backend.utils.product_attributes import decode_attributes_cached
 
 router = APIRouter(tags=["BaoCao"])
 
@@ -24,10 +27,9 @@ def revenue_report(
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
     
-    total = db.query(func.sum(DonHang.TongTien)).filter(
-        DonHang.NgayDat >= start_date,
-        DonHang.NgayDat <= end_date
-    ).scalar() or 0
+    # Archived orders are only read when the range starts before the archive cutoff
+    orders = order_headers(db, start_date, end_date)
+    total = db.query(func.sum(orders.c.TongTien)).scalar() or 0
     return {"total_revenue": float(total)}
 
 
@@ -61,10 +63,8 @@ def orders_report(
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
     
-    count = db.query(func.count(DonHang.MaDonHang)).filter(
-        DonHang.NgayDat >= start_date,
-        DonHang.NgayDat <= end_date
-    ).scalar() or 0
+    orders = order_headers(db, start_date, end_date)
+    count = db.query(func.count(orders.c.MaDonHang)).scalar() or 0
     return {"total_orders": count}
 
 # Best-selling products (top N products by quantity sold)
@@ -81,10 +81,12 @@ def best_selling_products(
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
     
+    # All-time ranking: includes archived order lines when there are any
+    lines = order_lines(db)
     results = db.query(
         SanPham.TenSP,
-        func.sum(DonHang_SanPham.SoLuong).label("total_sold")
-    ).join(DonHang_SanPham, SanPham.MaSP == DonHang_SanPham.MaSP)\
+        func.sum(lines.c.SoLuong).label("total_sold")
+    ).join(lines, SanPham.MaSP == lines.c.MaSP)\
      .group_by(SanPham.MaSP, SanPham.TenSP)\
      .order_by(desc("total_sold"))\
      .limit(top).all()
@@ -104,17 +106,15 @@ def low_inventory_products(
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
     
-    products = db.query(SanPham).filter(
-        SanPham.SoLuongTonKho <= threshold,
-        SanPham.IsDelete == 0
-    ).all()
+    # Served from the in-memory low-stock tracker (kept current by stock mutations)
+    low_stock_tracker.ensure_fresh(db)
     return [
         {
-            "MaSP": p.MaSP,
-            "TenSP": p.TenSP,
-            "SoLuongTonKho": p.SoLuongTonKho
+            "MaSP": p["MaSP"],
+            "TenSP": p["TenSP"],
+            "SoLuongTonKho": p["SoLuongTonKho"]
         }
-        for p in products
+        for p in low_stock_tracker.low_stock(threshold)
     ]
 
 # Dashboard Summary (for admin dashboard)
@@ -177,10 +177,8 @@ def get_dashboard_summary(
             month_start = (start_of_month - timedelta(days=30 * i)).replace(day=1)
             month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
             
-            month_revenue = db.query(func.sum(DonHang.TongTien)).filter(
-                DonHang.NgayDat >= month_start,
-                DonHang.NgayDat <= month_end
-            ).scalar() or 0
+            month_orders = order_headers(db, month_start, month_end)
+            month_revenue = db.query(func.sum(month_orders.c.TongTien)).scalar() or 0
             
             monthly_sales.append({
                 "name": f"T{month_start.month}",
@@ -198,8 +196,7 @@ def get_dashboard_summary(
             image = "/placeholder.svg"
             if product.MoTa:
                 try:
-                    import json
-                    attrs = json.loads(product.MoTa)
+                    attrs = decode_attributes_cached(product.MaSP, product.MoTa)
                     image = attrs.get("image") or attrs.get("images", [""])[0] or "/placeholder.svg"
                 except:
                     pass
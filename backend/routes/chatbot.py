@@ -15,11 +15,13 @@ from backend.database import get_db
 from backend.routes.deps import get_current_user
 from backend.routes.chatbot_constants import POLICY_TEMPLATES
 from backend.routes.chatbot_prompts import PARAPHRASE_SYSTEM_PROMPT
+from backend.routes.chatbot_metrics import ChatRequestTimer, get_latency_metrics, reset_latency_metrics
 from backend.routes.chatbot_logic import (
     detect_intent, detect_policy_key, is_internal_data_question, is_policy_question,
     intent_top_products_by_rating, intent_orders_by_email, intent_top_selling_products,
     intent_products_by_keyword_and_price, intent_products_by_keyword,
-    generate_sql_with_llm, is_safe_sql, execute_raw_sql, add_product_urls, generate_chat_with_llm
+    generate_sql_with_llm, validate_sql, execute_raw_sql, add_product_urls, generate_chat_with_llm,
+    SQLGuardError, record_unsafe_sql, get_sql_guard_metrics, get_llm_gateway_stats
 )
 
 router = APIRouter(prefix="/chatbot", tags=["Chatbot"])
@@ -134,15 +136,23 @@ def ask_chatbot(
 
         # Phase 2: LLM SQL
         try:
-            sql = generate_sql_with_llm(req.question)
-            if not is_safe_sql(sql):
+            raw_sql = generate_sql_with_llm(req.question)
+            sql = validate_sql(raw_sql)
+            if sql is None:
+                record_unsafe_sql(raw_sql)
                 return {
                     "mode": "error",
                     "message": "Mình hiểu câu hỏi của bạn rồi, nhưng không thể tìm kiếm thông tin này. Bạn có thể thử hỏi cách khác không ạ?"
                 }
 
-            rows = add_product_urls(execute_raw_sql(db, sql))
+            rows = add_product_urls(execute_raw_sql(sql))
             return {"mode": "llm_sql", "intent": None, "message": "Tìm thấy kết quả.", "sql": sql, "rows": rows}
+        except SQLGuardError as ge:
+            logging.warning(f"⚠️ SQL rejected by sandbox: {ge}")
+            return {
+                "mode": "error",
+                "message": "Câu hỏi này cần tra cứu quá nhiều dữ liệu. Bạn có thể hỏi cụ thể hơn (tên sản phẩm, mức giá...) không ạ?"
+            }
         except HTTPException as he:
             logging.error(f"❌ LLM SQL generation error: {he.detail}")
             return {
@@ -241,32 +251,46 @@ def chat_with_bot(
     1. SQL Queries (truy vấn sản phẩm, đơn hàng)
     2. Policy Questions (chính sách)
     3. General Chat (tư vấn thường)
+
+    Thời gian từng giai đoạn được ghi vào histogram (xem GET /chatbot/metrics).
     """
-    
+    timer = ChatRequestTimer()
+    try:
+        return _handle_chat(req, db, timer)
+    finally:
+        timer.finish()
+
+def _handle_chat(req: ChatRequest, db: Session, timer: ChatRequestTimer):
     # === TIER 1: DATA QUERIES (SQL) ===
     # Phát hiện câu hỏi truy vấn dữ liệu trước
-    if is_data_query(req.question):
+    with timer.stage("classification"):
+        data_query = is_data_query(req.question)
+    if data_query:
         logging.info(f"🔵 [/chat] TIER 1: SQL Query detected - {req.question[:50]}...")
+        timer.tier = "tier_1_sql"
         try:
-            intent_data = detect_intent(req.question)
+            with timer.stage("classification"):
+                intent_data = detect_intent(req.question)
+            timer.intent = intent_data["intent"]
 
             # Phase 1: Rule-based intents
             try:
-                if intent_data["intent"] == "top_products_by_rating":
-                    logging.info("✅ [TIER 1] Rule-based: top_products_by_rating")
-                    return intent_top_products_by_rating(db)
-                elif intent_data["intent"] == "orders_by_customer_email":
-                    logging.info("✅ [TIER 1] Rule-based: orders_by_email")
-                    return intent_orders_by_email(db, email=intent_data["email"])
-                elif intent_data["intent"] == "products_by_keyword_and_price":
-                    logging.info("✅ [TIER 1] Rule-based: products_by_keyword_and_price")
-                    return intent_products_by_keyword_and_price(db, keyword=intent_data["keyword"], min_price=intent_data["min_price"], max_price=intent_data["max_price"])
-                elif intent_data["intent"] == "products_by_keyword":
-                    logging.info("✅ [TIER 1] Rule-based: products_by_keyword")
-                    return intent_products_by_keyword(db, keyword=intent_data["keyword"])
-                elif intent_data["intent"] == "top_selling_products":
-                    logging.info("✅ [TIER 1] Rule-based: top_selling_products")
-                    return intent_top_selling_products(db)
+                with timer.stage("rule_query"):
+                    if intent_data["intent"] == "top_products_by_rating":
+                        logging.info("✅ [TIER 1] Rule-based: top_products_by_rating")
+                        return intent_top_products_by_rating(db)
+                    elif intent_data["intent"] == "orders_by_customer_email":
+                        logging.info("✅ [TIER 1] Rule-based: orders_by_email")
+                        return intent_orders_by_email(db, email=intent_data["email"])
+                    elif intent_data["intent"] == "products_by_keyword_and_price":
+                        logging.info("✅ [TIER 1] Rule-based: products_by_keyword_and_price")
+                        return intent_products_by_keyword_and_price(db, keyword=intent_data["keyword"], min_price=intent_data["min_price"], max_price=intent_data["max_price"])
+                    elif intent_data["intent"] == "products_by_keyword":
+                        logging.info("✅ [TIER 1] Rule-based: products_by_keyword")
+                        return intent_products_by_keyword(db, keyword=intent_data["keyword"])
+                    elif intent_data["intent"] == "top_selling_products":
+                        logging.info("✅ [TIER 1] Rule-based: top_selling_products")
+                        return intent_top_selling_products(db)
             except Exception as e:
                 logging.error(f"❌ [TIER 1] Rule-based error: {e}")
                 # Fallback to LLM SQL
@@ -275,18 +299,30 @@ def chat_with_bot(
             # Phase 2: LLM SQL Generation
             try:
                 logging.info("🤖 [TIER 1] LLM SQL generation...")
-                sql = generate_sql_with_llm(req.question)
-                if not is_safe_sql(sql):
+                with timer.stage("llm_sql"):
+                    raw_sql = generate_sql_with_llm(req.question)
+                    # Parse 1 lần: whitelist + kẹp LIMIT, trả về SQL chuẩn hóa để chạy
+                    sql = validate_sql(raw_sql)
+                if sql is None:
                     logging.warning("⚠️ [TIER 1] Unsafe SQL detected")
+                    record_unsafe_sql(raw_sql)
                     return {
                         "mode": "error",
                         "tier": "tier_1_sql",
                         "message": "Mình hiểu câu hỏi của bạn rồi, nhưng không thể tìm kiếm thông tin này. Bạn có thể thử hỏi cách khác không ạ?"
                     }
 
-                rows = add_product_urls(execute_raw_sql(db, sql))
+                with timer.stage("sql_exec"):
+                    rows = add_product_urls(execute_raw_sql(sql))
                 logging.info(f"✅ [TIER 1] SQL executed successfully, {len(rows)} rows returned")
                 return {"mode": "llm_sql", "tier": "tier_1_sql", "intent": None, "message": "Tìm thấy kết quả.", "sql": sql, "rows": rows}
+            except SQLGuardError as ge:
+                logging.warning(f"⚠️ [TIER 1] SQL rejected by sandbox: {ge}")
+                return {
+                    "mode": "error",
+                    "tier": "tier_1_sql",
+                    "message": "Câu hỏi này cần tra cứu quá nhiều dữ liệu. Bạn có thể hỏi cụ thể hơn (tên sản phẩm, mức giá...) không ạ?"
+                }
             except HTTPException as he:
                 logging.error(f"❌ [TIER 1] LLM SQL generation error: {he.detail}")
                 return {
@@ -307,9 +343,14 @@ def chat_with_bot(
             pass
     
     # === TIER 2: POLICY QUESTIONS ===
-    if is_policy_question(req.question):
+    with timer.stage("classification"):
+        policy_question = is_policy_question(req.question)
+    if policy_question:
         logging.info(f"🟣 [/chat] TIER 2: Policy question detected - {req.question[:50]}...")
-        policy_key = detect_policy_key(req.question)
+        timer.tier = "tier_2_policy"
+        with timer.stage("classification"):
+            policy_key = detect_policy_key(req.question)
+        timer.intent = policy_key or "none"
         if policy_key:
             logging.info(f"✅ [TIER 2] Policy key: {policy_key}")
             policy_text = POLICY_TEMPLATES[policy_key]
@@ -318,7 +359,8 @@ def chat_with_bot(
                 {"role": "user", "content": f"Đoạn văn:\n{policy_text}"},
             ]
             try:
-                paraphrased = generate_chat_with_llm(messages)
+                with timer.stage("paraphrase"):
+                    paraphrased = generate_chat_with_llm(messages)
                 banned = ["chào", "cảm ơn", "xin lỗi", "xin chào", "hi ", "hello", "vâng"]
                 if paraphrased and len(paraphrased) <= len(policy_text) * 1.5 and not any(b in paraphrased.lower() for b in banned):
                     policy_text = paraphrased
@@ -332,8 +374,13 @@ def chat_with_bot(
         return {"mode": "chat", "tier": "tier_2_policy", "source": "policy", "message": "Dạ, hiện tại cửa hàng có các chính sách về Bảo hành, Đổi trả, Vận chuyển và Thanh toán. Bạn đang quan tâm đến phần nào ạ?", "session_id": req.session_id}
 
     # === TIER 3: GENERAL CHAT ===
+    timer.tier = "tier_3_chat"
+    timer.intent = "general"
     # Chặn câu hỏi dữ liệu nội bộ nhạy cảm
-    if is_internal_data_question(req.question):
+    with timer.stage("classification"):
+        internal_question = is_internal_data_question(req.question)
+    if internal_question:
+        timer.intent = "internal_blocked"
         return {"mode": "chat", "message": "Mình chỉ có thể hỗ trợ tư vấn sản phẩm. Bạn có thể hỏi về giá cả hoặc gợi ý sản phẩm nhé.", "session_id": req.session_id}
     
     try:
@@ -366,7 +413,8 @@ VAI TRÒ:
         
         # Generate response
         try:
-            response = generate_chat_with_llm(messages)
+            with timer.stage("chat_generation"):
+                response = generate_chat_with_llm(messages)
             
             # Validate response
             if not response or len(response.strip()) < 5:
@@ -411,3 +459,42 @@ VAI TRÒ:
             "message": "Mình xin lỗi vì sự cố kỹ thuật. Bạn có thể gọi hotline 03122454563 để được tư vấn trực tiếp nhé!",
             "session_id": req.session_id
         }
+
+
+@router.get("/sql-metrics", summary="Thống kê sandbox SQL của chatbot (Admin)")
+def chatbot_sql_metrics(current_user: Dict[str, Any] = Depends(get_current_user)):
+    """Số truy vấn LLM SQL đã chạy / bị từ chối / timeout / chậm."""
+    if current_user.get("role") != "Admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
+    return get_sql_guard_metrics()
+
+
+@router.get("/llm-metrics", summary="Thống kê gọi LLM: coalescing & admission control (Admin)")
+def chatbot_llm_metrics(current_user: Dict[str, Any] = Depends(get_current_user)):
+    """Số lời gọi Ollama thực tế, số request được gộp và số request bị từ chối do quá tải."""
+    if current_user.get("role") != "Admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
+    return get_llm_gateway_stats()
+
+
+@router.get("/metrics", summary="Histogram độ trễ chatbot theo tier / intent / giai đoạn (Admin)")
+def chatbot_latency_metrics(current_user: Dict[str, Any] = Depends(get_current_user)):
+    """
+    Histogram thời gian (ms) của /chat theo tier, intent và giai đoạn:
+    classification, rule_query, llm_sql, sql_exec, paraphrase, chat_generation, total.
+    """
+    if current_user.get("role") != "Admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
+    return {
+        "latency": get_latency_metrics(),
+        "llm_gateway": get_llm_gateway_stats(),
+        "sql_sandbox": get_sql_guard_metrics(),
+    }
+
+
+@router.delete("/metrics", summary="Reset histogram độ trễ chatbot (Admin)")
+def reset_chatbot_latency_metrics(current_user: Dict[str, Any] = Depends(get_current_user)):
+    if current_user.get("role") != "Admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
+    reset_latency_metrics()
+    return {"message": "Đã reset chatbot metrics"}
@@ -20,6 +20,11 @@ SQL_LLM_MODEL = os.getenv("SQL_LLM_MODEL", "qwen2.5-coder:7b")
 CHAT_LLM_URL = os.getenv("CHAT_LLM_URL","http://100.78.4.22:11436")
 CHAT_LLM_MODEL = os.getenv("CHAT_LLM_MODEL","qwen2.5:7b-instruct")
 
+# Admission control: số lời gọi Ollama chạy đồng thời tối đa và thời gian
+# chờ slot (giây) trước khi trả lời fallback ngay
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "4"))
+LLM_ADMISSION_WAIT_SECONDS = float(os.getenv("LLM_ADMISSION_WAIT_SECONDS", "2"))
+
 # ==========================
 # Keyword Mappings
 # ==========================
@@ -167,3 +172,21 @@ WHITELIST_TABLES = {
     "KhieuNai",
 }
 WHITELIST_TABLES_LC = {name.lower() for name in WHITELIST_TABLES}
+
+# LIMIT được chèn / kẹp trực tiếp trên AST của câu SQL
+SQL_DEFAULT_LIMIT = 5
+SQL_MAX_LIMIT = 100
+# OFFSET lớn vẫn phải duyệt hết các dòng bị bỏ qua -> kẹp về giá trị này
+SQL_MAX_OFFSET = 1000
+# Hàm MySQL không được phép xuất hiện trong SQL do LLM sinh
+BANNED_SQL_FUNCTIONS = {"sleep", "benchmark", "load_file", "get_lock", "release_lock"}
+
+# ==========================
+# Sandbox cho SQL do LLM sinh
+# ==========================
+# EXPLAIN precheck: từ chối full scan (type=ALL) trên bảng ước tính > N dòng
+SQL_EXPLAIN_MAX_SCAN_ROWS = int(os.getenv("SQL_EXPLAIN_MAX_SCAN_ROWS", "50000"))
+# Tích số dòng ước tính qua các bảng JOIN (chặn cartesian join)
+SQL_EXPLAIN_MAX_JOIN_ROWS = int(os.getenv("SQL_EXPLAIN_MAX_JOIN_ROWS", "1000000"))
+# Ngưỡng ghi nhận truy vấn chậm (ms)
+SQL_SLOW_QUERY_MS = int(os.getenv("SQL_SLOW_QUERY_MS", "500"))
@@ -1,17 +1,30 @@
 # backend/routes/chatbot_logic.py
 
 import re
+import time
+import logging
+import threading
 import httpx
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+from functools import lru_cache
 from typing import Any, Dict, Optional, List, Tuple
 from sqlalchemy.orm import Session
 from sqlalchemy import text, func
+from sqlalchemy.exc import DBAPIError
 from fastapi import HTTPException, status
-from sqlglot import parse_one, exp
+import sqlglot
+from sqlglot import exp
 
+from backend.database import chatbot_engine, CHATBOT_SQL_MAX_EXECUTION_MS
 from backend.models import SanPham, DanhMuc, DonHang, DonHang_SanPham, KhachHang, DanhGia
 from backend.routes.chatbot_constants import (
     PRODUCT_KEYWORDS, WHITELIST_TABLES_LC, POLICY_SYNONYMS,
-    SQL_LLM_URL, SQL_LLM_MODEL, CHAT_LLM_URL, CHAT_LLM_MODEL
+    SQL_LLM_URL, SQL_LLM_MODEL, CHAT_LLM_URL, CHAT_LLM_MODEL,
+    SQL_EXPLAIN_MAX_SCAN_ROWS, SQL_EXPLAIN_MAX_JOIN_ROWS, SQL_SLOW_QUERY_MS,
+    SQL_DEFAULT_LIMIT, SQL_MAX_LIMIT, SQL_MAX_OFFSET, BANNED_SQL_FUNCTIONS,
+    LLM_MAX_INFLIGHT, LLM_ADMISSION_WAIT_SECONDS
 )
 from backend.routes.chatbot_prompts import TEXT2SQL_PROMPT
 
@@ -246,6 +259,65 @@ def is_policy_question(question: str) -> bool:
     
     return False
 
+# ==========================
+# LLM Gateway: single-flight + admission control
+# ==========================
+# Nhiều người hỏi cùng một câu trong vài giây (mùa khuyến mãi) chỉ tạo MỘT
+# lời gọi Ollama; các request trùng chờ và dùng chung kết quả. Khi tất cả
+# slot đều bận quá LLM_ADMISSION_WAIT_SECONDS thì trả 503 ngay để route
+# trả lời fallback thay vì xếp hàng vô hạn.
+
+_llm_slots = threading.BoundedSemaphore(LLM_MAX_INFLIGHT)
+_inflight_lock = threading.Lock()
+_inflight_calls: Dict[Tuple[str, str], Future] = {}
+LLM_GATEWAY_STATS: Dict[str, int] = {"upstream_calls": 0, "coalesced": 0, "rejected": 0}
+
+def normalize_prompt(text_value: str) -> str:
+    """Chuẩn hóa câu hỏi/prompt làm khóa coalescing (thường hóa, gộp khoảng trắng, bỏ dấu câu cuối)."""
+    return re.sub(r"\s+", " ", text_value.lower()).strip().rstrip("?!. ")
+
+def _run_upstream(call):
+    if not _llm_slots.acquire(timeout=LLM_ADMISSION_WAIT_SECONDS):
+        with _inflight_lock:
+            LLM_GATEWAY_STATS["rejected"] += 1
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="LLM đang quá tải, vui lòng thử lại sau.")
+    try:
+        with _inflight_lock:
+            LLM_GATEWAY_STATS["upstream_calls"] += 1
+        return call()
+    finally:
+        _llm_slots.release()
+
+def coalesced_llm_call(key: Tuple[str, str], call):
+    """
+    Single-flight: request đầu tiên với `key` gọi upstream, các request trùng
+    key trong lúc đó chờ cùng Future (kể cả exception).
+    """
+    with _inflight_lock:
+        future = _inflight_calls.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight_calls[key] = future
+        else:
+            LLM_GATEWAY_STATS["coalesced"] += 1
+
+    if not leader:
+        return future.result()
+
+    try:
+        future.set_result(_run_upstream(call))
+    except BaseException as e:
+        future.set_exception(e)
+    finally:
+        with _inflight_lock:
+            _inflight_calls.pop(key, None)
+    return future.result()
+
+def get_llm_gateway_stats() -> Dict[str, int]:
+    with _inflight_lock:
+        return {**LLM_GATEWAY_STATS, "inflight": len(_inflight_calls), "max_inflight": LLM_MAX_INFLIGHT}
+
 # ==========================
 # SQL & LLM Processing
 # ==========================
@@ -263,6 +335,9 @@ def clean_sql_response(raw: str) -> str:
 def generate_sql_with_llm(question: str) -> str:
     if not SQL_LLM_URL or not SQL_LLM_MODEL:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Chưa cấu hình SQL_LLM_URL hoặc SQL_LLM_MODEL.")
+    return coalesced_llm_call(("sql", normalize_prompt(question)), lambda: _post_sql_llm(question))
+
+def _post_sql_llm(question: str) -> str:
     payload = {"model": SQL_LLM_MODEL, "prompt": TEXT2SQL_PROMPT.format(question=question), "stream": False}
     try:
         timeout = httpx.Timeout(connect=10.0, read=180.0, write=30.0, pool=10.0)
@@ -271,10 +346,8 @@ def generate_sql_with_llm(question: str) -> str:
             resp.raise_for_status()
             data = resp.json()
             raw = data.get("response", "")
-            sql = clean_sql_response(raw)
-            if not re.search(r'\blimit\b', sql.lower()):
-                sql = sql.strip() + " LIMIT 5"
-            return sql
+            # LIMIT được chèn/kẹp trên AST trong validate_sql(), không nối chuỗi ở đây
+            return clean_sql_response(raw)
     except httpx.ConnectError as e:
         raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Không thể kết nối đến SQL LLM server tại {SQL_LLM_URL}. Vui lòng kiểm tra server Ollama.")
     except httpx.TimeoutException as e:
@@ -282,28 +355,178 @@ def generate_sql_with_llm(question: str) -> str:
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Lỗi gọi SQL LLM (Ollama): {e}")
 
-def is_safe_sql(sql: str) -> bool:
-    sql_clean = sql.strip()
-    if ";" in sql_clean: return False
-    low = sql_clean.lower()
-    if any(b in low for b in ["insert", "update", "delete", "alter", "drop", "create", "truncate"]): return False
-    if not low.startswith("select"): return False
+_FORBIDDEN_SQL_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Drop, exp.Create,
+    exp.Alter, exp.TruncateTable, exp.Command, exp.Into,
+    # FOR UPDATE / FOR SHARE / LOCK IN SHARE MODE: khóa dòng của checkout
+    exp.Lock,
+)
+
+def _limit_value(node: exp.Expression) -> Optional[int]:
+    value = node.expression
+    if not isinstance(value, exp.Literal) or value.is_string:
+        return None
+    try:
+        return int(value.this)
+    except (TypeError, ValueError):
+        return None
+
+@lru_cache(maxsize=1024)
+def validate_sql(sql: str) -> Optional[str]:
+    """
+    Pipeline kiểm tra SQL do LLM sinh - parse đúng MỘT lần bằng sqlglot:
+    1. Chỉ 1 câu lệnh, gốc là SELECT (hoặc UNION của SELECT)
+    2. Không có node ghi/DDL, SELECT ... INTO, khóa dòng (FOR UPDATE / FOR SHARE),
+       hàm nguy hiểm (SLEEP, BENCHMARK...)
+    3. Mọi bảng nằm trong whitelist
+    4. Chèn LIMIT mặc định nếu thiếu, kẹp LIMIT về SQL_MAX_LIMIT, OFFSET về SQL_MAX_OFFSET
+    Trả về SQL chuẩn hóa (render lại từ AST) hoặc None nếu không an toàn.
+    Kết quả được memoize theo chuỗi SQL nên câu lặp lại không phải parse lại.
+    """
     try:
-        ast = parse_one(sql_clean, read="mysql")
-    except: return False
-    for tbl in ast.find_all(exp.Table):
-        if not tbl.name or tbl.name.lower() not in WHITELIST_TABLES_LC: return False
-    limit_nodes = list(ast.find_all(exp.Limit))
-    if not limit_nodes: return False
-    for node in limit_nodes:
+        statements = sqlglot.parse(sql, read="mysql")
+    except Exception:
+        return None
+    if len(statements) != 1 or statements[0] is None:
+        return None
+    ast = statements[0]
+    if not isinstance(ast, (exp.Select, exp.SetOperation)):
+        return None
+
+    for node in ast.walk():
+        if isinstance(node, _FORBIDDEN_SQL_NODES):
+            return None
+        if isinstance(node, exp.Anonymous) and str(node.name).lower() in BANNED_SQL_FUNCTIONS:
+            return None
+        if isinstance(node, exp.Table):
+            if not node.name or node.name.lower() not in WHITELIST_TABLES_LC:
+                return None
+        if isinstance(node, exp.Limit) and node is not ast.args.get("limit"):
+            # LIMIT trong subquery: chỉ chấp nhận số nguyên <= SQL_MAX_LIMIT
+            value = _limit_value(node)
+            if value is None or value > SQL_MAX_LIMIT:
+                return None
+        if isinstance(node, exp.Offset):
+            value = _limit_value(node)
+            if value is None:
+                return None
+            if value > SQL_MAX_OFFSET:
+                node.set("expression", exp.Literal.number(SQL_MAX_OFFSET))
+
+    top_limit = ast.args.get("limit")
+    if top_limit is None:
+        ast = ast.limit(SQL_DEFAULT_LIMIT, copy=False)
+    else:
+        value = _limit_value(top_limit)
+        if value is None:
+            return None
+        if value > SQL_MAX_LIMIT:
+            top_limit.set("expression", exp.Literal.number(SQL_MAX_LIMIT))
+
+    return ast.sql(dialect="mysql")
+
+def is_safe_sql(sql: str) -> bool:
+    return validate_sql(sql.strip()) is not None
+
+# ==========================
+# SQL Sandbox (pool riêng + timeout + EXPLAIN precheck)
+# ==========================
+
+class SQLGuardError(Exception):
+    """SQL do LLM sinh bị sandbox từ chối (chi phí quá lớn hoặc vượt thời gian)."""
+    pass
+
+# MySQL 3024 / MariaDB 1969: vượt max_execution_time / max_statement_time
+_SQL_TIMEOUT_ERROR_CODES = {3024, 1969}
+
+_sql_metrics_lock = threading.Lock()
+SQL_GUARD_METRICS: Dict[str, Any] = {
+    "executed": 0,
+    "rejected_unsafe": 0,
+    "rejected_cost": 0,
+    "timeouts": 0,
+    "errors": 0,
+    "slow": 0,
+    "recent_slow": deque(maxlen=20),
+    "recent_rejected": deque(maxlen=20),
+}
+
+def _record_sql_metric(key: str, sql: Optional[str] = None, detail: Optional[str] = None) -> None:
+    with _sql_metrics_lock:
+        SQL_GUARD_METRICS[key] += 1
+        if sql is not None:
+            bucket = "recent_slow" if key == "slow" else "recent_rejected"
+            SQL_GUARD_METRICS[bucket].append({
+                "sql": sql[:500],
+                "reason": key,
+                "detail": detail,
+                "at": datetime.utcnow().isoformat(),
+            })
+
+def record_unsafe_sql(sql: str) -> None:
+    """Ghi nhận SQL bị is_safe_sql từ chối."""
+    _record_sql_metric("rejected_unsafe", sql)
+
+def get_sql_guard_metrics() -> Dict[str, Any]:
+    with _sql_metrics_lock:
+        snapshot = {k: (list(v) if isinstance(v, deque) else v) for k, v in SQL_GUARD_METRICS.items()}
+    snapshot["limits"] = {
+        "max_execution_ms": CHATBOT_SQL_MAX_EXECUTION_MS,
+        "explain_max_scan_rows": SQL_EXPLAIN_MAX_SCAN_ROWS,
+        "explain_max_join_rows": SQL_EXPLAIN_MAX_JOIN_ROWS,
+        "slow_query_ms": SQL_SLOW_QUERY_MS,
+    }
+    return snapshot
+
+def check_sql_cost(conn, sql: str) -> None:
+    """
+    EXPLAIN trước khi chạy: từ chối full scan trên bảng lớn và JOIN có
+    tích số dòng ước tính quá lớn (cartesian join).
+    """
+    plan = [dict(r._mapping) for r in conn.execute(text(f"EXPLAIN {sql}"))]
+    estimated = 1
+    for row in plan:
+        rows = int(row.get("rows") or 0)
+        if row.get("type") == "ALL" and rows > SQL_EXPLAIN_MAX_SCAN_ROWS:
+            raise SQLGuardError(f"Full scan trên bảng {row.get('table')} (~{rows} dòng)")
+        if rows:
+            estimated *= rows
+    if estimated > SQL_EXPLAIN_MAX_JOIN_ROWS:
+        raise SQLGuardError(f"Ước tính {estimated} dòng phải duyệt (JOIN quá lớn)")
+
+def execute_raw_sql(sql: str) -> List[Dict[str, Any]]:
+    """
+    Chạy SQL của chatbot trong sandbox: pool kết nối riêng (chatbot_engine,
+    đã đặt max_execution_time), EXPLAIN precheck và ghi metrics.
+    """
+    with chatbot_engine.connect() as conn:
         try:
-            if int(node.expression.this) > 100: return False
-        except: return False
-    return True
+            check_sql_cost(conn, sql)
+        except SQLGuardError as e:
+            _record_sql_metric("rejected_cost", sql, str(e))
+            logging.warning(f"⚠️ [SQL sandbox] Rejected by EXPLAIN: {e}")
+            raise
 
-def execute_raw_sql(db: Session, sql: str) -> List[Dict[str, Any]]:
-    result = db.execute(text(sql))
-    return [dict(r._mapping) for r in result]
+        start = time.perf_counter()
+        try:
+            result = conn.execute(text(sql))
+            rows = [dict(r._mapping) for r in result]
+        except DBAPIError as e:
+            code = e.orig.args[0] if e.orig is not None and e.orig.args else None
+            if code in _SQL_TIMEOUT_ERROR_CODES:
+                _record_sql_metric("timeouts", sql, f"> {CHATBOT_SQL_MAX_EXECUTION_MS}ms")
+                raise SQLGuardError("Truy vấn vượt quá thời gian cho phép") from e
+            _record_sql_metric("errors")
+            raise
+        finally:
+            conn.rollback()
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    _record_sql_metric("executed")
+    if elapsed_ms >= SQL_SLOW_QUERY_MS:
+        _record_sql_metric("slow", sql, f"{elapsed_ms:.0f}ms")
+        logging.warning(f"🐢 [SQL sandbox] Slow query ({elapsed_ms:.0f}ms): {sql[:200]}")
+    return rows
 
 # ==========================
 # Chat LLM Interaction
@@ -347,6 +570,9 @@ def generate_chat_with_llm(messages: list) -> str:
     prompt_parts.append("Assistant:")
     full_prompt = "\n\n".join(prompt_parts)
     
+    return coalesced_llm_call(("chat", normalize_prompt(full_prompt)), lambda: _post_chat_llm(full_prompt))
+
+def _post_chat_llm(full_prompt: str) -> str:
     # Ollama API format
     payload = {
         "model": CHAT_LLM_MODEL,
@@ -0,0 +1,113 @@
+# backend/routes/chatbot_metrics.py
+
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+# ==========================
+# Latency histograms cho /chatbot/chat
+# ==========================
+# Mỗi request đo thời gian từng giai đoạn (classification, rule_query, llm_sql,
+# sql_exec, paraphrase, chat_generation) và tổng thời gian; kết quả được gom
+# vào histogram theo (tier, intent, stage) để xem p95 nằm ở đâu.
+
+# Cận trên của bucket (ms); bucket cuối là +Inf
+LATENCY_BUCKETS_MS: List[float] = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+
+class LatencyHistogram:
+    """Histogram bucket cố định (giống Prometheus) + count/sum/max."""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, value_ms: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        if value_ms > self.max_ms:
+            self.max_ms = value_ms
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Ước lượng quantile = cận trên của bucket chứa nó."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        labels = [f"le_{int(b)}" for b in LATENCY_BUCKETS_MS] + ["le_inf"]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 1) if self.count else None,
+            "max_ms": round(self.max_ms, 1),
+            "p50_ms": self.quantile(0.50),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+_histograms_lock = threading.Lock()
+_HISTOGRAMS: Dict[Tuple[str, str, str], LatencyHistogram] = {}
+
+
+def observe_latency(tier: str, intent: str, stage: str, value_ms: float) -> None:
+    key = (tier, intent, stage)
+    with _histograms_lock:
+        hist = _HISTOGRAMS.get(key)
+        if hist is None:
+            hist = _HISTOGRAMS[key] = LatencyHistogram()
+        hist.observe(value_ms)
+
+
+def get_latency_metrics() -> List[Dict[str, Any]]:
+    with _histograms_lock:
+        items = sorted(_HISTOGRAMS.items())
+        return [
+            {"tier": tier, "intent": intent, "stage": stage, **hist.to_dict()}
+            for (tier, intent, stage), hist in items
+        ]
+
+
+def reset_latency_metrics() -> None:
+    with _histograms_lock:
+        _HISTOGRAMS.clear()
+
+
+class ChatRequestTimer:
+    """
+    Đo thời gian từng giai đoạn của một request chatbot.
+    Route gán `tier` / `intent` khi đã phân loại xong; finish() ghi toàn bộ
+    stage + "total" vào histogram với nhãn đó.
+    """
+
+    def __init__(self):
+        self.tier = "unknown"
+        self.intent = "none"
+        self.stages: Dict[str, float] = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def finish(self) -> Dict[str, float]:
+        self.stages["total"] = (time.perf_counter() - self._start) * 1000
+        for name, value_ms in self.stages.items():
+            observe_latency(self.tier, self.intent, name, value_ms)
+        return self.stages
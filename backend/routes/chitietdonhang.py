@@ -3,6 +3,12 @@ from sqlalchemy.orm import Session
 from backend.database import get_db
 from backend.models import DonHang_SanPham, DonHang, SanPham
 from backend.routes.deps import get_current_user
+from backend.utils.order_totals import (
+    ORDER_TOTAL_VERIFY_REPAIR,
+    apply_total_delta,
+    line_total,
+    verify_order_totals,
+)
 
 router = APIRouter(tags=["ChiTietDonHang"])
 
@@ -30,41 +36,37 @@ def add_product_to_order(data: dict, db: Session = Depends(get_db), current_user
         raise HTTPException(
             status_code=404, detail="Đơn hàng hoặc sản phẩm không tồn tại")
 
-    # Add or update product in order
+    # Add or update product in order; TongTien changes by the line delta in the same transaction.
+    # The line is read FOR UPDATE so concurrent edits of it cannot lose an update.
     chitiet = db.query(DonHang_SanPham).filter(
         DonHang_SanPham.MaDonHang == madonhang,
         DonHang_SanPham.MaSP == masp
-    ).first()
-    if chitiet:
-        chitiet.SoLuong += soluong
-        chitiet.DonGia = dongia
-        chitiet.GiamGia = giamgia
-    else:
-        chitiet = DonHang_SanPham(
-            MaDonHang=madonhang,
-            MaSP=masp,
-            SoLuong=soluong,
-            DonGia=dongia,
-            GiamGia=giamgia
-        )
-        db.add(chitiet)
-    db.commit()
-    update_total_price(madonhang, db)
-    return {"message": "Đã thêm sản phẩm vào đơn hàng"}
-
-# Update total price of order
-
-
-def update_total_price(madonhang: int, db: Session):
-    chitiets = db.query(DonHang_SanPham).filter(
-        DonHang_SanPham.MaDonHang == madonhang).all()
-    tongtien = 0
-    for ct in chitiets:
-        tongtien += (ct.DonGia - ct.GiamGia) * ct.SoLuong
-    donhang = db.query(DonHang).filter(DonHang.MaDonHang == madonhang).first()
-    if donhang:
-        donhang.TongTien = tongtien
+    ).with_for_update().first()
+    try:
+        if chitiet:
+            old_total = line_total(chitiet.DonGia, chitiet.GiamGia, chitiet.SoLuong)
+            chitiet.SoLuong += soluong
+            chitiet.DonGia = dongia
+            chitiet.GiamGia = giamgia
+        else:
+            old_total = 0
+            chitiet = DonHang_SanPham(
+                MaDonHang=madonhang,
+                MaSP=masp,
+                SoLuong=soluong,
+                DonGia=dongia,
+                GiamGia=giamgia
+            )
+            db.add(chitiet)
+        db.flush()
+        apply_total_delta(db, madonhang, line_total(dongia, giamgia, chitiet.SoLuong) - old_total)
         db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi thêm sản phẩm vào đơn hàng: {str(e)}")
+    return {"message": "Đã thêm sản phẩm vào đơn hàng"}
 
 # Optionally: update product in order
 
@@ -83,16 +85,52 @@ def update_product_in_order(data: dict, db: Session = Depends(get_db), current_u
     dongia = data.get("DonGia")
     giamgia = data.get("GiamGia", 0)
 
+    # Locked until commit: old_total below must be the value this write replaces
     chitiet = db.query(DonHang_SanPham).filter(
         DonHang_SanPham.MaDonHang == madonhang,
         DonHang_SanPham.MaSP == masp
-    ).first()
+    ).with_for_update().first()
     if not chitiet:
         raise HTTPException(
             status_code=404, detail="Chi tiết đơn hàng không tồn tại")
-    chitiet.SoLuong = soluong
-    chitiet.DonGia = dongia
-    chitiet.GiamGia = giamgia
-    db.commit()
-    update_total_price(madonhang, db)
+    try:
+        old_total = line_total(chitiet.DonGia, chitiet.GiamGia, chitiet.SoLuong)
+        chitiet.SoLuong = soluong
+        chitiet.DonGia = dongia
+        chitiet.GiamGia = giamgia
+        db.flush()
+        apply_total_delta(db, madonhang, line_total(dongia, giamgia, soluong) - old_total)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi cập nhật sản phẩm trong đơn hàng: {str(e)}")
     return {"message": "Đã cập nhật sản phẩm trong đơn hàng"}
+
+# Verify order totals against their lines (drift check)
+
+
+@router.post("/verify-totals", response_model=dict)
+def verify_totals(data: dict = None, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    """
+    Run the TongTien drift check now. Body (optional):
+    {"MaDonHang": [1, 2], "repair": true}; without MaDonHang it checks the
+    orders edited since the last periodic run.
+    """
+    if current_user.get("role") not in ["Admin", "Manager"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
+
+    data = data or {}
+    order_ids = data.get("MaDonHang")
+    if order_ids is not None and not isinstance(order_ids, list):
+        order_ids = [order_ids]
+    try:
+        drifted = verify_order_totals(db, order_ids, repair=bool(data.get("repair", ORDER_TOTAL_VERIFY_REPAIR)))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi kiểm tra tổng tiền đơn hàng: {str(e)}")
+    return {"drifted": drifted, "count": len(drifted)}
@@ -8,6 +8,7 @@ from backend.database import get_db
 from backend.models import SystemConfig
 from backend.routes.deps import get_current_user
 from backend.utils.activity_logger import log_activity
+from backend.utils.low_stock import LOW_STOCK_THRESHOLD_KEY, low_stock_tracker
 
 
 router = APIRouter(prefix="/config", tags=["Config"])
@@ -44,6 +45,8 @@ def update_config(key: str, req: ConfigUpdateRequest, db: Session = Depends(get_
         
         db.commit()
         db.refresh(item)
+        if key == LOW_STOCK_THRESHOLD_KEY:
+            low_stock_tracker.invalidate()
         
         # Log activity
         try:
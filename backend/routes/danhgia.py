@@ -3,8 +3,9 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_
 from backend.database import get_db
-from backend.models import DanhGia, SanPham, KhachHang, DonHang, DonHang_SanPham
+from backend.models import DanhGia, SanPham, KhachHang, DonHang, DonHang_SanPham, DonHang_Archive, DonHang_SanPham_Archive
 from backend.routes.deps import get_current_user
+from backend.utils.order_archive import ARCHIVED_PURCHASE_STATUSES, needs_archive
 from backend.schemas import ReviewCreateRequest, ReviewResponse, ReviewListResponse
 from datetime import datetime
 from typing import List, Optional
@@ -68,6 +69,15 @@ def create_review(
                 DonHang.TrangThai.in_(["Delivered", "Confirmed", "Processing", "Shipped"])
             )
         ).first()
+        if not has_purchased and needs_archive(db):
+            # Older purchases may have been moved to the order archive
+            has_purchased = db.query(DonHang_SanPham_Archive).join(
+                DonHang_Archive, DonHang_Archive.MaDonHang == DonHang_SanPham_Archive.MaDonHang
+            ).filter(
+                DonHang_SanPham_Archive.MaSP == review_data.MaSP,
+                DonHang_Archive.MaKH == customer_id,
+                DonHang_Archive.TrangThai.in_(ARCHIVED_PURCHASE_STATUSES)
+            ).first()
         
         if not has_purchased:
             raise HTTPException(
@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from sqlalchemy.orm import Session
 from typing import Optional
 from backend.database import get_db
 from backend.models import DanhMuc
 from backend.routes.deps import get_current_user, get_current_user_optional
+from backend.utils.http_cache import conditional_get
 
 router = APIRouter(tags=["DanhMuc"])
 
@@ -32,13 +33,20 @@ def create_danhmuc(danhmuc: dict, db: Session = Depends(get_db), current_user: d
 
 @router.get("/")
 def get_all_danhmuc(
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db), 
     current_user: Optional[dict] = Depends(get_current_user_optional)
 ):
     """
     Lấy danh sách danh mục.
     Public access - không yêu cầu đăng nhập.
+    Hỗ trợ ETag / If-None-Match (304 khi DanhMuc chưa thay đổi).
     """
+    not_modified = conditional_get(request, response, "danhmuc_list", ("DanhMuc",))
+    if not_modified is not None:
+        return not_modified
+
     try:
         dms = db.query(DanhMuc).filter(DanhMuc.IsDelete == 0).all()
         # Properly serialize SQLAlchemy objects to dictionaries
@@ -1,3 +1,5 @@
+import os
+from datetime import datetime, timedelta
 from functools import wraps
 from typing import Dict, Optional, List
 
@@ -12,6 +14,10 @@ from sqlalchemy.orm import Session
 SECRET_KEY = "67PM3"  # ⚠️ Nên lưu trong biến môi trường .env khi deploy
 ALGORITHM = "HS256"
 
+# Short-lived token for Server-Sent Events (?token=), see create_stream_token()
+STREAM_TOKEN_TYPE = "sse"
+SSE_TOKEN_TTL_SECONDS = int(os.getenv("SSE_TOKEN_TTL_SECONDS", "60"))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 
@@ -63,6 +69,10 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict:
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    if payload.get("type") == STREAM_TOKEN_TYPE:
+        # Stream tokens only open SSE connections
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
     return payload
 
 
@@ -85,6 +95,8 @@ async def get_current_user_optional(
         
         try:
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            if payload.get("type") == STREAM_TOKEN_TYPE:
+                return None
             return payload
         except (ExpiredSignatureError, JWTError):
             # Token is invalid or expired, but we don't raise error for optional auth
@@ -94,6 +106,51 @@ async def get_current_user_optional(
         return None
 
 
+def create_stream_token(current_user: Dict) -> str:
+    """
+    Token for ?token= on SSE endpoints (EventSource cannot set headers).
+    Query strings end up in access logs and browser history, so this carries
+    only the user claims, expires after SSE_TOKEN_TTL_SECONDS and is refused
+    everywhere except get_current_user_stream().
+    """
+    payload = {
+        key: current_user[key]
+        for key in ("user_id", "username", "role", "account_id")
+        if key in current_user
+    }
+    payload["type"] = STREAM_TOKEN_TYPE
+    payload["exp"] = datetime.utcnow() + timedelta(seconds=SSE_TOKEN_TTL_SECONDS)
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+async def get_current_user_stream(request: Request) -> Dict:
+    """
+    get_current_user for Server-Sent Events endpoints: the Authorization header
+    as usual, or ?token=<stream token> from create_stream_token(). A login JWT
+    in the query string is rejected.
+    """
+    auth_header = request.headers.get("Authorization")
+    if auth_header and auth_header.startswith("Bearer "):
+        return await get_current_user(auth_header.split(" ", 1)[1])
+
+    token = request.query_params.get("token")
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Token is missing")
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except ExpiredSignatureError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has expired")
+    except JWTError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    if payload.get("type") != STREAM_TOKEN_TYPE:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    return payload
+
+
 def jwt_required(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -121,6 +178,9 @@ def jwt_required(func):
         except JWTError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        if payload.get("type") == STREAM_TOKEN_TYPE:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
         request.state.current_user = payload
         return func(*args, **kwargs)
@@ -11,17 +11,36 @@
 # 5. update_delivery() - Updates shipping info and shipper assignment
 # =====================================================
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Response, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, bindparam, func, or_
 from sqlalchemy.orm import Session
 from backend.database import get_db
-from backend.models import DonHang, Shipper
+from backend.models import DonHang, DonHang_Archive, DonHang_SanPham, DonHang_SanPham_Archive, KhachHang, Shipper
 from backend.routes.deps import get_current_user
 # Removed VoucherData import - using direct discount percentage instead
 from backend.utils.inventory_manager import InventoryManager, InventoryError
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from backend.utils.activity_logger import log_activity
+from backend.utils.cart_reservations import find_reservation_conflicts, remove_cart_items
+from backend.utils.catalog_snapshot import catalog_snapshot
+from backend.utils.dispatch_planner import plan_assignments
+from backend.utils.order_archive import ORDER_ARCHIVE_MONTHS, archive_closed_orders, get_archive_cutoff
+from backend.utils.order_export import SUPPORTED_FORMATS as EXPORT_SUPPORTED_FORMATS, stream_order_export
+from backend.utils.order_search import customer_search_index, is_phone_query, parse_order_code
+from backend.utils.order_totals import line_total, order_total
+from backend.utils.stock_ledger import movement, record_movements
+from backend.utils.idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER, run_idempotent
+from backend.utils.outbox import (
+    EVENT_ORDER_DELIVERY_UPDATED,
+    EVENT_ORDER_STATUS_CHANGED,
+    actor_payload,
+    enqueue_event,
+    notify_dispatcher,
+)
 from datetime import datetime, date
+from decimal import Decimal
 
 router = APIRouter(tags=["DonHang"])
 
@@ -33,6 +52,16 @@ class StatusUpdateRequest(BaseModel):
     new_status: str
     old_status: Optional[str] = None
 
+VALID_ORDER_STATUSES = ["Pending", "Confirmed", "Processing", "Shipped", "Delivered", "Cancelled", "Returned"]
+BULK_STATUS_MAX_ORDERS = 1000
+# Orders per transaction in PUT /status/bulk
+BULK_STATUS_CHUNK_SIZE = 200
+
+
+class BulkStatusUpdateRequest(BaseModel):
+    order_ids: List[int] = Field(..., min_length=1, max_length=BULK_STATUS_MAX_ORDERS)
+    new_status: str
+
 class StatusUpdateResponse(BaseModel):
     success: bool
     message: str
@@ -65,8 +94,26 @@ class DeliveryUpdateResponse(BaseModel):
 # ORDER FLOW STEP 4.1: Create new order
 # Called from checkout page via POST /api/donhang/
 # This is the main order creation endpoint
+# Retries carrying the same Idempotency-Key header replay the stored result
+# instead of creating a duplicate order (backend/utils/idempotency.py)
 @router.post("/", response_model=dict)
-def create_donhang(donhang: dict, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+def create_donhang(
+    donhang: dict,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    result, replayed = run_idempotent(
+        "donhang.create", idempotency_key, current_user, donhang,
+        lambda: _create_donhang(donhang, db, current_user),
+    )
+    if replayed:
+        response.headers[REPLAYED_HEADER] = "true"
+    return result
+
+
+def _create_donhang(donhang: dict, db: Session, current_user: dict) -> dict:
     # ORDER FLOW STEP 4.1.1: Validate user permissions
     # Admin, Manager, Employee can create any orders
     # KhachHang can only create orders for themselves
@@ -85,11 +132,9 @@ def create_donhang(donhang: dict, db: Session = Depends(get_db), current_user: d
         # Override MaKH to prevent customers from creating orders for others
         donhang["MaKH"] = customer_id_from_token
     
-    # ORDER FLOW STEP 4.1.3: Process discount
-    # Extract discount percentage from payload and calculate final amount
+    # ORDER FLOW STEP 4.1.3: Validate discount
+    # The amounts are computed from the locked product prices in STEP 4.1.6
     discount_percentage = donhang.get("discount_percentage")
-    original_amount = donhang.get("TongTien", 0)
-    final_amount = original_amount
     applied_discount = None
     
     # Process discount percentage if provided
@@ -102,11 +147,7 @@ def create_donhang(donhang: dict, db: Session = Depends(get_db), current_user: d
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Phần trăm giảm giá phải từ 0 đến 100"
                 )
-            
-            # Calculate discount amount from percentage
             if discount_percentage > 0:
-                discount_amount = (original_amount * discount_percentage) / 100
-                final_amount = original_amount - discount_amount
                 applied_discount = discount_percentage
         except (ValueError, TypeError):
             raise HTTPException(
@@ -134,83 +175,157 @@ def create_donhang(donhang: dict, db: Session = Depends(get_db), current_user: d
     else:
         ngay_dat = date.today()
     
-    # ORDER FLOW STEP 4.1.5: Calculate shipping fee
-    # Get shipping fee from request (if provided)
-    phi_ship = donhang.get("PhiShip")
-    if phi_ship is None:
-        # Calculate shipping based on subtotal if not provided
-        # Free shipping if order >= 10,000,000 VND
-        phi_ship = 0 if original_amount >= 10000000 else 100000
-    
-    # ORDER FLOW STEP 4.1.6: Create DonHang record
-    # Store discount percentage as string in KhuyenMai field for backward compatibility
+    # ORDER FLOW STEP 4.1.5: Normalize order items
+    # Duplicate MaSP lines are merged (DonHang_SanPham key is MaDonHang + MaSP)
+    order_lines = {}
+    for item in donhang.get("items", []):
+        ma_sp = item.get("MaSP")
+        if not ma_sp:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"MaSP is required for order item. Received item: {item}"
+            )
+        try:
+            so_luong = int(item.get("SoLuong", 1))
+            giam_gia = float(item.get("GiamGia") or 0)
+        except (ValueError, TypeError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Số lượng / giảm giá không hợp lệ cho sản phẩm {ma_sp}"
+            )
+        if so_luong < 1 or giam_gia < 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Số lượng / giảm giá không hợp lệ cho sản phẩm {ma_sp}"
+            )
+        line = order_lines.setdefault(ma_sp, {"MaSP": ma_sp, "SoLuong": 0, "GiamGia": giam_gia})
+        line["SoLuong"] += so_luong
+
+    # ORDER FLOW STEP 4.1.6: Create order in ONE transaction
+    # Header, items, stock reservation, cart cleanup and activity log are
+    # committed together - a failing item never leaves an orphaned header.
     discount_info = f"{applied_discount}%" if applied_discount else None
-    
-    new_dh = DonHang(
-        NgayDat=ngay_dat,
-        TongTien=final_amount,  # Final amount after discount applied
-        TrangThai=donhang.get("TrangThai"),  # Initial status (usually "Chờ thanh toán")
-        MaKH=donhang.get("MaKH"),  # Customer ID
-        MaNV=donhang.get("MaNV"),  # Employee ID (if order created by employee)
-        KhuyenMai=discount_info,  # Store discount percentage as "X%"
-        PhiShip=phi_ship  # Store shipping fee
+    initial_status = donhang.get("TrangThai")  # Initial status (usually "Chờ thanh toán")
+    stock_action = InventoryManager._determine_inventory_action(
+        None, InventoryManager._normalize_status(initial_status)
     )
-    db.add(new_dh)
-    db.commit()
-    db.refresh(new_dh)
-
-    # ORDER FLOW STEP 4.1.7: Create order items (DonHang_SanPham records)
-    # Each item stores price snapshot (DonGia) at order time
-    # This preserves historical pricing even if product price changes later
-    items = donhang.get("items", [])
-    if items:
-        from backend.models import DonHang_SanPham
-        for item in items:
-            # Validate required fields
-            ma_sp = item.get("MaSP")
-            if not ma_sp:
+    deducted = {}
+
+    try:
+        # One SELECT ... FOR UPDATE for all products (validates + locks stock)
+        products = InventoryManager.lock_products(db, list(order_lines))
+        for ma_sp in order_lines:
+            sp = products.get(ma_sp)
+            if sp is None or sp.IsDelete:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"MaSP is required for order item. Received item: {item}"
+                    detail=f"Sản phẩm {ma_sp} không tồn tại hoặc đã ngừng kinh doanh"
+                )
+
+        # Stock held in other customers' carts (GioHang.GiuHangDen chưa hết hạn)
+        # is not available to this order - prevents overselling hot items.
+        conflicts = find_reservation_conflicts(db, donhang.get("MaKH"), list(order_lines.values()), products)
+        if conflicts:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Không đủ hàng cho: " + ", ".join(
+                    f"{c['TenSP']} (còn {c['Available']}, cần {c['Required']})" for c in conflicts
                 )
-            
-            # Create order item record with price snapshot
-            order_item = DonHang_SanPham(
-                MaDonHang=new_dh.MaDonHang,
-                MaSP=ma_sp,
-                SoLuong=item.get("SoLuong", 1),
-                DonGia=item.get("DonGia", 0),  # Price snapshot at order time (critical for historical accuracy)
-                GiamGia=item.get("GiamGia", 0)  # Item-level discount
             )
-            db.add(order_item)
-        db.commit()
 
-    # Activity log
-    try:
+        # Amounts + shipping fee from the server-side price snapshot
+        # TongTien = SUM((GiaSP - GiamGia) * SoLuong) less the discount; the
+        # client-supplied TongTien is ignored
+        original_amount = sum(
+            (line_total(products[ma_sp].GiaSP, line["GiamGia"], line["SoLuong"]) for ma_sp, line in order_lines.items()),
+            Decimal(0),
+        )
+        # Same rule the TongTien verifier checks (backend/utils/order_totals.py)
+        final_amount = order_total(original_amount, discount_info)
+
+        # Shipping fee from request (if provided); free from 10,000,000 VND subtotal
+        phi_ship = donhang.get("PhiShip")
+        if phi_ship is None:
+            phi_ship = 0 if original_amount >= 10000000 else 100000
+
+        new_dh = DonHang(
+            NgayDat=ngay_dat,
+            TongTien=final_amount,  # Final amount after discount applied
+            TrangThai=initial_status,
+            MaKH=donhang.get("MaKH"),  # Customer ID
+            MaNV=donhang.get("MaNV"),  # Employee ID (if order created by employee)
+            KhuyenMai=discount_info,  # Store discount percentage as "X%"
+            PhiShip=phi_ship  # Store shipping fee
+        )
+        db.add(new_dh)
+        db.flush()  # Get MaDonHang without committing
+
+        # Items inserted in bulk; DonGia is the server-side price snapshot
+        # (SanPham.GiaSP at order time), never the client-supplied value
+        db.bulk_insert_mappings(DonHang_SanPham, [
+            {
+                "MaDonHang": new_dh.MaDonHang,
+                "MaSP": ma_sp,
+                "SoLuong": line["SoLuong"],
+                "DonGia": products[ma_sp].GiaSP or 0,
+                "GiamGia": line["GiamGia"],
+            }
+            for ma_sp, line in order_lines.items()
+        ])
+
+        # Orders created directly as Confirmed deduct stock now (same rule as
+        # InventoryManager.handle_inventory_change); pending orders do not
+        if stock_action == "confirm":
+            for ma_sp, line in order_lines.items():
+                sp = products[ma_sp]
+                sp.SoLuongTonKho -= line["SoLuong"]
+                deducted[ma_sp] = sp.SoLuongTonKho
+            record_movements(db, [
+                movement(ma_sp, -line["SoLuong"], stock_action, "DonHang", new_dh.MaDonHang)
+                for ma_sp, line in order_lines.items()
+            ])
+
+        # Ordered products leave the customer's cart (releases their reservation)
+        if donhang.get("MaKH") and order_lines:
+            remove_cart_items(db, donhang.get("MaKH"), list(order_lines))
+
         log_activity(
             db,
             current_user,
             action="CREATE",
             entity="DonHang",
             entity_id=new_dh.MaDonHang,
-            details=f"Created order with final amount {float(new_dh.TongTien)}",
+            details=f"Created order with final amount {float(final_amount)} ({len(order_lines)} items)",
+            commit=False,
         )
-    except Exception:
-        pass
-    
+        order_id = new_dh.MaDonHang
+        db.commit()
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi tạo đơn hàng: {str(e)}"
+        )
+
+    for ma_sp, stock in deducted.items():
+        catalog_snapshot.update_stock(ma_sp, stock)
+
     # Return order info with discount details
     response = {
-        "MaDonHang": new_dh.MaDonHang,
-        "TongTien": float(new_dh.TongTien),
-        "KhuyenMai": new_dh.KhuyenMai
+        "MaDonHang": order_id,
+        "TongTien": float(final_amount),
+        "KhuyenMai": discount_info
     }
     
     # Add discount information if discount was applied
     if applied_discount is not None:
         discount_amount = original_amount - final_amount
         response.update({
-            "original_amount": original_amount,
-            "discount_amount": discount_amount,
+            "original_amount": float(original_amount),
+            "discount_amount": float(discount_amount),
             "discount_percentage": applied_discount,
             "voucher_applied": False  # Keep for backward compatibility
         })
@@ -281,11 +396,181 @@ def get_all_donhang(db: Session = Depends(get_db), current_user: dict = Depends(
             detail=f"Lỗi lấy danh sách đơn hàng: {str(e)}"
         )
 
+
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+@router.get("/export", summary="Export đơn hàng (CSV / NDJSON, streaming)")
+def export_donhang(
+    format: str = Query("csv", description="csv | ndjson"),
+    from_date: Optional[date] = Query(None, description="NgayDat từ (YYYY-MM-DD)"),
+    to_date: Optional[date] = Query(None, description="NgayDat đến (YYYY-MM-DD)"),
+    trang_thai: Optional[List[str]] = Query(None, description="Lọc trạng thái (lặp lại hoặc phân cách bằng dấu phẩy)"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Export đơn hàng kèm chi tiết cho kế toán, dạng stream (server-side cursor,
+    không nạp hết vào RAM). CSV: mỗi dòng một sản phẩm của đơn; NDJSON: mỗi dòng một đơn.
+    Generator tự mở session riêng (chạy sau khi route đã trả về).
+    """
+    if current_user.get("role") not in ["Admin", "Manager"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied"
+        )
+    fmt = format.lower()
+    if fmt not in EXPORT_SUPPORTED_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Định dạng không hỗ trợ: {fmt} (chỉ csv, ndjson)"
+        )
+    if from_date and to_date and from_date > to_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="from_date phải trước hoặc bằng to_date"
+        )
+    statuses = [s.strip() for value in (trang_thai or []) for s in value.split(",") if s.strip()]
+
+    return StreamingResponse(
+        stream_order_export(fmt, from_date, to_date, statuses or None),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="donhang.{fmt}"'},
+    )
+
+
+def _parse_order_cursor(cursor: str):
+    """Cursor "YYYY-MM-DD_MaDonHang" -> (date, int) - vị trí đơn cuối của trang trước."""
+    try:
+        ngay_str, ma_str = cursor.split("_", 1)
+        return date.fromisoformat(ngay_str), int(ma_str)
+    except (ValueError, AttributeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="cursor không hợp lệ"
+        )
+
+
+ORDER_SEARCH_DEFAULT_LIMIT = 20
+ORDER_SEARCH_MAX_LIMIT = 100
+# Customers matched by a phone/name query whose orders are fetched
+ORDER_SEARCH_MAX_CUSTOMERS = 50
+
+
+def _search_order_item(order, archived: bool = False) -> dict:
+    ten_kh, sdt_kh = customer_search_index.customer(order.MaKH)
+    return {
+        "MaDonHang": order.MaDonHang,
+        "code": f"DH{order.MaDonHang:04d}",
+        "NgayDat": order.NgayDat.isoformat() if order.NgayDat else None,
+        "TrangThai": order.TrangThai,
+        "TongTien": float(order.TongTien) if order.TongTien else 0,
+        "MaKH": order.MaKH,
+        "TenKH": ten_kh,
+        "SdtKH": sdt_kh,
+        "archived": archived,
+    }
+
+
+@router.get("/search", response_model=dict, summary="Tìm đơn hàng theo mã, SĐT hoặc tên khách")
+def search_donhang(
+    q: str = Query(..., min_length=2, max_length=100, description='"DH0042", tiền tố SĐT hoặc tên khách (không dấu cũng được)'),
+    limit: int = Query(ORDER_SEARCH_DEFAULT_LIMIT, ge=1, le=ORDER_SEARCH_MAX_LIMIT),
+    include_archived: bool = False,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Tra cứu đơn hàng cho nhân viên:
+    - "DH0042" / "dh42": tra theo mã đơn (khóa chính).
+    - Chuỗi số ("0901 23"): tiền tố SĐT khách hàng; nếu chỉ gồm chữ số thì cũng thử như MaDonHang.
+    - Còn lại: tên khách không phân biệt dấu, mỗi từ khớp tiền tố một từ trong tên
+      ("nguyen an" khớp "Nguyễn Văn An").
+    Khách hàng được tìm qua index trong bộ nhớ (order_search.py), đơn hàng qua
+    idx_donhang_makh_ngaydat; mới nhất trước. include_archived=true tìm cả đơn đã lưu trữ.
+    """
+    if current_user.get("role") not in ["Admin", "Manager", "Employee", "NhanVien"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied"
+        )
+    models = [(DonHang, False)] + ([(DonHang_Archive, True)] if include_archived else [])
+    customer_search_index.ensure_fresh(db)
+
+    order_id = parse_order_code(q)
+    if order_id is None and q.strip().isdigit():
+        order_id = int(q.strip())
+    if is_phone_query(q):
+        match = "phone"
+        customer_ids, truncated = customer_search_index.match_phone(q, ORDER_SEARCH_MAX_CUSTOMERS)
+    elif order_id is not None:
+        match = "code"
+        customer_ids, truncated = [], False
+    else:
+        match = "name"
+        customer_ids, truncated = customer_search_index.match_name(q, ORDER_SEARCH_MAX_CUSTOMERS)
+
+    results = []
+    if order_id is not None:
+        for model, archived in models:
+            order = db.query(model).filter(model.MaDonHang == order_id).first()
+            if order:
+                results.append(_search_order_item(order, archived))
+                break
+    if customer_ids:
+        found = []
+        for model, archived in models:
+            rows = (
+                db.query(model)
+                .filter(model.MaKH.in_(customer_ids))
+                .order_by(model.NgayDat.desc(), model.MaDonHang.desc())
+                .limit(limit)
+                .all()
+            )
+            found.extend((row, archived) for row in rows)
+        found.sort(key=lambda item: (item[0].NgayDat or date.min, item[0].MaDonHang), reverse=True)
+        seen = {item["MaDonHang"] for item in results}
+        results.extend(_search_order_item(row, archived) for row, archived in found if row.MaDonHang not in seen)
+
+    return {
+        "query": q,
+        "match": match,
+        "customers_matched": len(customer_ids),
+        # More customers matched than were searched: refine the query
+        "customers_truncated": truncated,
+        "items": results[:limit],
+    }
+
+
 # Get customer's own orders
-@router.get("/my-orders", response_model=list)
-def get_my_orders(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+MY_ORDERS_DEFAULT_LIMIT = 20
+MY_ORDERS_MAX_LIMIT = 100
+
+
+def _customer_order_page(db: Session, model, customer_id: int, last_key, size: int) -> list:
+    """Keyset page (NgayDat DESC, MaDonHang DESC) of DonHang or DonHang_Archive rows."""
+    query = db.query(model).filter(model.MaKH == customer_id)
+    if last_key:
+        last_date, last_id = last_key
+        query = query.filter(or_(
+            model.NgayDat < last_date,
+            and_(model.NgayDat == last_date, model.MaDonHang < last_id),
+        ))
+    return query.order_by(model.NgayDat.desc(), model.MaDonHang.desc()).limit(size).all()
+
+
+@router.get("/my-orders", response_model=dict)
+def get_my_orders(
+    limit: int = Query(MY_ORDERS_DEFAULT_LIMIT, ge=1, le=MY_ORDERS_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
     """
-    Lấy danh sách đơn hàng của khách hàng hiện tại.
+    Lấy lịch sử đơn hàng của khách hàng hiện tại, phân trang theo cursor, kèm sản phẩm.
+    - Sắp xếp NgayDat DESC, MaDonHang DESC; keyset pagination trên index
+      idx_donhang_makh_ngaydat (MaKH, NgayDat, MaDonHang) nên trang sâu vẫn nhanh như trang đầu.
+    - Gửi lại `next_cursor` của trang trước để lấy trang tiếp theo.
+    - Sản phẩm của cả trang được lấy bằng một truy vấn IN.
     """
     try:
         # Get customer ID from current user
@@ -303,8 +588,52 @@ def get_my_orders(db: Session = Depends(get_db), current_user: dict = Depends(ge
                 detail="Không tìm thấy thông tin khách hàng"
             )
         
-        # Get orders for this customer
-        dhs = db.query(DonHang).filter(DonHang.MaKH == customer_id).order_by(DonHang.NgayDat.desc()).all()
+        # Get one page of orders for this customer (+1 row to know if there is a next page)
+        last_key = _parse_order_cursor(cursor) if cursor else None
+        dhs = _customer_order_page(db, DonHang, customer_id, last_key, limit + 1)
+        # Archived orders are all older than the archive cutoff: only read the
+        # archive when this page reaches back past it
+        cutoff = get_archive_cutoff(db)
+        if cutoff is not None and (len(dhs) <= limit or (dhs[-1].NgayDat or date.min) < cutoff):
+            dhs = sorted(
+                dhs + _customer_order_page(db, DonHang_Archive, customer_id, last_key, limit + 1),
+                key=lambda dh: (dh.NgayDat or date.min, dh.MaDonHang),
+                reverse=True,
+            )[:limit + 1]
+        has_more = len(dhs) > limit
+        dhs = dhs[:limit]
+        
+        # Batched item fetch for the whole page (one query per table the page touches)
+        items_by_order = {dh.MaDonHang: [] for dh in dhs}
+        from backend.models import SanPham
+        for line_model, order_ids in (
+            (DonHang_SanPham, [dh.MaDonHang for dh in dhs if isinstance(dh, DonHang)]),
+            (DonHang_SanPham_Archive, [dh.MaDonHang for dh in dhs if isinstance(dh, DonHang_Archive)]),
+        ):
+            if not order_ids:
+                continue
+            rows = db.query(
+                line_model.MaDonHang,
+                line_model.MaSP,
+                line_model.SoLuong,
+                line_model.DonGia,
+                line_model.GiamGia,
+                SanPham.TenSP,
+                SanPham.HinhAnh,
+            ).outerjoin(
+                SanPham, line_model.MaSP == SanPham.MaSP
+            ).filter(
+                line_model.MaDonHang.in_(order_ids)
+            ).all()
+            for row in rows:
+                items_by_order[row.MaDonHang].append({
+                    "MaSP": row.MaSP,
+                    "TenSP": row.TenSP or f"Sản phẩm #{row.MaSP}",
+                    "SoLuong": row.SoLuong,
+                    "DonGia": float(row.DonGia) if row.DonGia else 0.0,  # Price at order time (snapshot)
+                    "GiamGia": float(row.GiamGia) if row.GiamGia else 0.0,
+                    "image": row.HinhAnh
+                })
         
         # Serialize to dictionaries
         result = []
@@ -319,9 +648,19 @@ def get_my_orders(db: Session = Depends(get_db), current_user: dict = Depends(ge
                 "KhuyenMai": dh.KhuyenMai,
                 "PhiShip": float(dh.PhiShip) if dh.PhiShip else None,
                 "MaShipper": dh.MaShipper,
+                "items": items_by_order[dh.MaDonHang],
             }
             result.append(order_dict)
-        return result
+        
+        next_cursor = None
+        if has_more and dhs and dhs[-1].NgayDat:
+            next_cursor = f"{dhs[-1].NgayDat.isoformat()}_{dhs[-1].MaDonHang}"
+        return {
+            "orders": result,
+            "limit": limit,
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -342,6 +681,11 @@ def get_donhang(madonhang: int, db: Session = Depends(get_db), current_user: dic
         from backend.models import DonHang_SanPham, SanPham
         
         dh = db.query(DonHang).filter(DonHang.MaDonHang == madonhang).first()
+        line_model = DonHang_SanPham
+        if not dh and get_archive_cutoff(db) is not None:
+            # Closed orders older than the archive cutoff live in DonHang_Archive
+            dh = db.query(DonHang_Archive).filter(DonHang_Archive.MaDonHang == madonhang).first()
+            line_model = DonHang_SanPham_Archive
         if not dh:
             raise HTTPException(status_code=404, detail="Đơn hàng không tồn tại")
         
@@ -356,10 +700,10 @@ def get_donhang(madonhang: int, db: Session = Depends(get_db), current_user: dic
                 )
         
         # Get order items with product details
-        order_items = db.query(DonHang_SanPham, SanPham).join(
-            SanPham, DonHang_SanPham.MaSP == SanPham.MaSP
+        order_items = db.query(line_model, SanPham).join(
+            SanPham, line_model.MaSP == SanPham.MaSP
         ).filter(
-            DonHang_SanPham.MaDonHang == madonhang
+            line_model.MaDonHang == madonhang
         ).all()
         
         # Format order items
@@ -385,7 +729,8 @@ def get_donhang(madonhang: int, db: Session = Depends(get_db), current_user: dic
             "KhuyenMai": dh.KhuyenMai,
             "PhiShip": float(dh.PhiShip) if dh.PhiShip else None,
             "MaShipper": dh.MaShipper,
-            "items": items  # Include order items
+            "items": items,  # Include order items
+            "archived": isinstance(dh, DonHang_Archive),
         }
     except HTTPException:
         raise
@@ -395,6 +740,42 @@ def get_donhang(madonhang: int, db: Session = Depends(get_db), current_user: dic
             detail=f"Lỗi lấy thông tin đơn hàng: {str(e)}"
         )
 
+# =====================================================
+# 🗄️ Archive closed orders
+# =====================================================
+# Declared before PUT /{madonhang} so "archive" is not parsed as an order id
+
+
+@router.put("/archive", response_model=dict, summary="Lưu trữ đơn hàng đã đóng")
+def archive_orders(
+    months: int = Query(ORDER_ARCHIVE_MONTHS, ge=1),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Chuyển các đơn Delivered/Cancelled cũ hơn `months` tháng (kèm chi tiết, thanh toán)
+    sang các bảng *_Archive. Báo cáo tự đọc thêm phần lưu trữ khi khoảng ngày cần đến.
+    """
+    if current_user.get("role") != "Admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
+
+    try:
+        result = archive_closed_orders(db, months=months)
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi lưu trữ đơn hàng: {str(e)}"
+        )
+    log_activity(
+        db,
+        current_user,
+        action="ARCHIVE",
+        entity="DonHang",
+        details=f"{result['archived_orders']} orders before {result['cutoff']}",
+    )
+    return result
+
 # Update
 
 
@@ -463,6 +844,27 @@ def delete_donhang(madonhang: int, db: Session = Depends(get_db), current_user:
 # 📦 Status Update with Inventory Management
 # =====================================================
 
+def _status_event_payload(current_user: dict, madonhang: int, old_status: str, new_status: str) -> dict:
+    """Outbox payload for a status change (consumed by backend/utils/outbox.py handlers)."""
+    return {
+        "MaDonHang": madonhang,
+        "old_status": old_status,
+        "new_status": new_status,
+        "inventory_action": InventoryManager._determine_inventory_action(
+            InventoryManager._normalize_status(old_status) if old_status else None,
+            InventoryManager._normalize_status(new_status),
+        ),
+        "user": actor_payload(current_user),
+        "occurred_at": datetime.utcnow().isoformat(),
+        "activity": {
+            "action": "UPDATE_STATUS",
+            "entity": "DonHang",
+            "entity_id": madonhang,
+            "details": f"Status: {old_status} -> {new_status}",
+        },
+    }
+
+
 # ORDER FLOW STEP 4.2: Update order status
 # Called by admin/employee to change order status
 # This is critical: status changes trigger inventory operations
@@ -506,11 +908,10 @@ def update_order_status(
         
         # ORDER FLOW STEP 4.2.3: Validate status transition
         # Only allow valid status values
-        valid_statuses = ["Pending", "Confirmed", "Processing", "Shipped", "Delivered", "Cancelled", "Returned"]
-        if new_status not in valid_statuses:
+        if new_status not in VALID_ORDER_STATUSES:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Trạng thái không hợp lệ. Các trạng thái hợp lệ: {', '.join(valid_statuses)}"
+                detail=f"Trạng thái không hợp lệ. Các trạng thái hợp lệ: {', '.join(VALID_ORDER_STATUSES)}"
             )
         
         # ORDER FLOW STEP 4.2.4: Handle inventory changes
@@ -530,21 +931,18 @@ def update_order_status(
             )
         
         # ORDER FLOW STEP 4.2.5: Update order status in database
+        # Side effects (activity log, catalog stock refresh) go through the outbox
+        # in the same transaction and are processed by the background dispatcher
         order.TrangThai = new_status
+        enqueue_event(
+            db,
+            EVENT_ORDER_STATUS_CHANGED,
+            _status_event_payload(current_user, madonhang, old_status, new_status),
+            entity="DonHang",
+            entity_id=madonhang,
+        )
         db.commit()
-
-        # Activity log
-        try:
-            log_activity(
-                db,
-                current_user,
-                action="UPDATE_STATUS",
-                entity="DonHang",
-                entity_id=order.MaDonHang,
-                details=f"Status: {old_status} -> {new_status}",
-            )
-        except Exception:
-            pass
+        notify_dispatcher()
         
         return StatusUpdateResponse(
             success=True,
@@ -566,6 +964,102 @@ def update_order_status(
             detail=f"Lỗi không mong muốn: {str(e)}"
         )
 
+# ORDER FLOW STEP 4.2b: Bulk status update
+# Warehouse marks many orders (e.g. Shipped) in one call. Each chunk of
+# BULK_STATUS_CHUNK_SIZE orders is one transaction: orders are locked and read
+# with one query, stock moves with InventoryManager.handle_bulk_inventory_change
+# (set-based), statuses change with one UPDATE, and outbox events are added
+# for the side effects. Orders that fail (not found, no stock) are reported
+# individually and do not block the rest.
+@router.put("/status/bulk", response_model=dict, summary="Cập nhật trạng thái hàng loạt")
+def bulk_update_order_status(
+    request: BulkStatusUpdateRequest,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Cập nhật trạng thái cho nhiều đơn hàng cùng lúc; trả về kết quả từng đơn.
+    """
+    from backend.routes.deps import has_role
+    if not has_role(current_user, ["Admin", "Manager", "Employee", "NhanVien"]):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied"
+        )
+
+    new_status = request.new_status
+    if new_status not in VALID_ORDER_STATUSES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Trạng thái không hợp lệ. Các trạng thái hợp lệ: {', '.join(VALID_ORDER_STATUSES)}"
+        )
+
+    order_ids = list(dict.fromkeys(request.order_ids))
+    results = {}
+    for start in range(0, len(order_ids), BULK_STATUS_CHUNK_SIZE):
+        chunk = order_ids[start:start + BULK_STATUS_CHUNK_SIZE]
+        try:
+            old_statuses = dict(
+                db.query(DonHang.MaDonHang, DonHang.TrangThai)
+                .filter(DonHang.MaDonHang.in_(chunk))
+                .order_by(DonHang.MaDonHang)
+                .with_for_update()
+                .all()
+            )
+            inventory_results = InventoryManager.handle_bulk_inventory_change(db, old_statuses, new_status)
+
+            updated_ids = [order_id for order_id, (ok, _, _) in inventory_results.items() if ok]
+            if updated_ids:
+                db.query(DonHang).filter(DonHang.MaDonHang.in_(updated_ids)).update(
+                    {DonHang.TrangThai: new_status}, synchronize_session=False
+                )
+                for order_id in updated_ids:
+                    enqueue_event(
+                        db,
+                        EVENT_ORDER_STATUS_CHANGED,
+                        _status_event_payload(current_user, order_id, old_statuses[order_id], new_status),
+                        entity="DonHang",
+                        entity_id=order_id,
+                    )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            for order_id in chunk:
+                results[order_id] = {
+                    "order_id": order_id,
+                    "success": False,
+                    "message": f"Lỗi không mong muốn: {str(e)}",
+                }
+            continue
+
+        for order_id in chunk:
+            if order_id not in old_statuses:
+                results[order_id] = {"order_id": order_id, "success": False, "message": "Đơn hàng không tồn tại"}
+                continue
+            ok, message, action = inventory_results[order_id]
+            results[order_id] = {
+                "order_id": order_id,
+                "success": ok,
+                "message": (
+                    f"Đã cập nhật trạng thái đơn hàng từ '{old_statuses[order_id]}' thành '{new_status}'"
+                    if ok else f"Lỗi cập nhật tồn kho: {message}"
+                ),
+                "old_status": old_statuses[order_id],
+                "new_status": new_status if ok else old_statuses[order_id],
+                "inventory_action": action,
+            }
+    notify_dispatcher()
+
+    succeeded = sum(1 for result in results.values() if result["success"])
+    return {
+        "new_status": new_status,
+        "total": len(order_ids),
+        "succeeded": succeeded,
+        "failed": len(order_ids) - succeeded,
+        "results": [results[order_id] for order_id in order_ids],
+    }
+
+
 @router.get("/{madonhang}/inventory-check", response_model=dict, summary="Kiểm tra tồn kho cho đơn hàng")
 def check_order_inventory(
     madonhang: int,
@@ -667,8 +1161,7 @@ def update_delivery(
                     IsDelete=False,
                 )
                 db.add(shipper)
-                db.commit()
-                db.refresh(shipper)
+                db.flush()
                 created_shipper = shipper
 
         # Assign shipper to order if any
@@ -681,20 +1174,25 @@ def update_delivery(
         if request.shipping_fee is not None:
             order.PhiShip = request.shipping_fee
 
+        enqueue_event(
+            db,
+            EVENT_ORDER_DELIVERY_UPDATED,
+            {
+                "MaDonHang": order.MaDonHang,
+                "user": actor_payload(current_user),
+                "occurred_at": datetime.utcnow().isoformat(),
+                "activity": {
+                    "action": "UPDATE_DELIVERY",
+                    "entity": "DonHang",
+                    "entity_id": order.MaDonHang,
+                    "details": f"Status={request.delivery_status}; Shipper={order.MaShipper}; Fee={request.shipping_fee}",
+                },
+            },
+            entity="DonHang",
+            entity_id=order.MaDonHang,
+        )
         db.commit()
-
-        # Activity log
-        try:
-            log_activity(
-                db,
-                current_user,
-                action="UPDATE_DELIVERY",
-                entity="DonHang",
-                entity_id=order.MaDonHang,
-                details=f"Status={request.delivery_status}; Shipper={order.MaShipper}; Fee={request.shipping_fee}",
-            )
-        except Exception:
-            pass
+        notify_dispatcher()
 
         return DeliveryUpdateResponse(
             success=True,
@@ -711,3 +1209,139 @@ def update_delivery(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Lỗi cập nhật giao hàng: {str(e)}"
         )
+
+
+# =====================================================
+# 🗺️ Batch shipper assignment (dispatch planner)
+# =====================================================
+# Statuses whose orders count as a shipper's current load
+DISPATCH_LOAD_STATUSES = ["Processing", "Shipped"]
+
+
+def _build_dispatch_plan(db: Session, lock: bool = False) -> dict:
+    """
+    Plan shipper assignments for every unassigned Processing order with three
+    queries (orders + address, active shippers, current load per shipper).
+    """
+    orders_query = (
+        db.query(DonHang.MaDonHang, KhachHang.DiaChiKH)
+        .outerjoin(KhachHang, KhachHang.MaKH == DonHang.MaKH)
+        .filter(DonHang.TrangThai == "Processing", DonHang.MaShipper.is_(None))
+        .order_by(DonHang.MaDonHang)
+    )
+    if lock:
+        orders_query = orders_query.with_for_update(of=DonHang)
+    orders = orders_query.all()
+
+    shippers = (
+        db.query(Shipper.MaShipper, Shipper.TenShipper)
+        .filter(Shipper.TrangThai == "Active", Shipper.IsDelete == False)
+        .order_by(Shipper.MaShipper)
+        .all()
+    )
+    current_load = dict(
+        db.query(DonHang.MaShipper, func.count(DonHang.MaDonHang))
+        .filter(DonHang.TrangThai.in_(DISPATCH_LOAD_STATUSES), DonHang.MaShipper.isnot(None))
+        .group_by(DonHang.MaShipper)
+        .all()
+    )
+
+    plan = plan_assignments(orders, [s.MaShipper for s in shippers], current_load)
+    assignments = []
+    for shipper in shippers:
+        pieces = plan.get(shipper.MaShipper, [])
+        assignments.append({
+            "MaShipper": shipper.MaShipper,
+            "TenShipper": shipper.TenShipper,
+            "current_load": current_load.get(shipper.MaShipper, 0),
+            "assigned": sum(len(order_ids) for _, order_ids in pieces),
+            "districts": [{"district": district, "orders": order_ids} for district, order_ids in pieces],
+        })
+    return {
+        "total_orders": len(orders),
+        "assignments": assignments,
+        "unassigned": [] if shippers else [order.MaDonHang for order in orders],
+    }
+
+
+@router.get("/dispatch/plan", response_model=dict, summary="Đề xuất phân công shipper hàng loạt")
+def get_dispatch_plan(
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Gom các đơn Processing chưa có shipper theo quận/huyện (DiaChiKH) và chia đều
+    cho các shipper đang hoạt động. Chỉ xem trước, không lưu.
+    """
+    from backend.routes.deps import has_role
+    if not has_role(current_user, ["Admin", "Manager", "Employee", "NhanVien"]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
+
+    try:
+        return _build_dispatch_plan(db)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi lập kế hoạch giao hàng: {str(e)}"
+        )
+
+
+@router.put("/dispatch/apply", response_model=dict, summary="Phân công shipper hàng loạt")
+def apply_dispatch_plan(
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Lập kế hoạch như /dispatch/plan rồi gán shipper cho tất cả đơn trong một transaction.
+    """
+    from backend.routes.deps import has_role
+    if not has_role(current_user, ["Admin", "Manager", "Employee", "NhanVien"]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
+
+    try:
+        result = _build_dispatch_plan(db, lock=True)
+        changes = [
+            {"b_madonhang": order_id, "b_mashipper": assignment["MaShipper"]}
+            for assignment in result["assignments"]
+            for piece in assignment["districts"]
+            for order_id in piece["orders"]
+        ]
+        if changes:
+            table = DonHang.__table__
+            db.execute(
+                table.update()
+                .where(table.c.MaDonHang == bindparam("b_madonhang"))
+                .values(MaShipper=bindparam("b_mashipper")),
+                changes,
+            )
+            now = datetime.utcnow().isoformat()
+            actor = actor_payload(current_user)
+            for change in changes:
+                enqueue_event(
+                    db,
+                    EVENT_ORDER_DELIVERY_UPDATED,
+                    {
+                        "MaDonHang": change["b_madonhang"],
+                        "user": actor,
+                        "occurred_at": now,
+                        "activity": {
+                            "action": "ASSIGN_SHIPPER",
+                            "entity": "DonHang",
+                            "entity_id": change["b_madonhang"],
+                            "details": f"Shipper={change['b_mashipper']} (dispatch plan)",
+                        },
+                    },
+                    entity="DonHang",
+                    entity_id=change["b_madonhang"],
+                )
+        db.commit()
+        notify_dispatcher()
+        result["applied"] = len(changes)
+        return result
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi phân công shipper: {str(e)}"
+        )
+
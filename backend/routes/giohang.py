@@ -1,20 +1,33 @@
 """
 Cart/Shopping Cart API Routes
+
+Giỏ hàng lưu trên server (bảng GioHang). Mỗi sản phẩm trong giỏ được giữ hàng
+tạm thời CART_RESERVATION_MINUTES phút; hết hạn thì tự nhả (không cần job dọn).
+Logic nằm ở backend/utils/cart_reservations.py.
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
 from backend.database import get_db
 from backend.routes.deps import get_current_user
-from backend.models import SanPham
+from backend.utils.cart_reservations import (
+    CartError,
+    get_cart as load_cart,
+    remove_cart_items,
+    set_cart_item,
+    validate_cart,
+)
 
 router = APIRouter()
 
 
 class CartItemRequest(BaseModel):
     sanPhamId: int
-    soLuong: int = 1
+    soLuong: int = Field(1, ge=1)
+
+
+class CartItemUpdateRequest(BaseModel):
+    soLuong: int = Field(..., ge=1)
 
 
 class CartItemResponse(BaseModel):
@@ -25,6 +38,22 @@ class CartItemResponse(BaseModel):
     thanhTien: float
 
 
+def _get_customer_id(current_user: dict) -> int:
+    """Giỏ hàng chỉ dành cho khách hàng (MaKH lấy từ token)."""
+    if current_user.get("role") != "KhachHang":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Giỏ hàng chỉ dành cho khách hàng"
+        )
+    customer_id = current_user.get("user_id")
+    if not customer_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Không tìm thấy thông tin khách hàng"
+        )
+    return customer_id
+
+
 @router.post("/giohang/add", tags=["Giỏ hàng"])
 def add_to_cart(
     item: CartItemRequest,
@@ -32,36 +61,25 @@ def add_to_cart(
     current_user: dict = Depends(get_current_user),
 ):
     """
-    Thêm sản phẩm vào giỏ hàng
+    Thêm sản phẩm vào giỏ hàng (cộng dồn số lượng) và giữ hàng tạm thời.
     """
-    # Verify product exists and is not deleted
-    product = db.query(SanPham).filter(
-        SanPham.MaSP == item.sanPhamId,
-        SanPham.IsDelete == False
-    ).first()
-
-    if not product:
-        raise HTTPException(status_code=404, detail="Sản phẩm không tồn tại")
-
-    # Check stock availability
-    if product.SoLuongTonKho < item.soLuong:
+    customer_id = _get_customer_id(current_user)
+    try:
+        cart_item = set_cart_item(db, customer_id, item.sanPhamId, item.soLuong, add=True)
+        db.commit()
+    except CartError as e:
+        db.rollback()
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        db.rollback()
         raise HTTPException(
-            status_code=400,
-            detail=f"Không đủ hàng trong kho. Chỉ còn {product.SoLuongTonKho} sản phẩm"
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi thêm vào giỏ hàng: {str(e)}"
         )
 
-    # Calculate total price
-    thanh_tien = float(product.GiaSP) * item.soLuong
-
     return {
         "message": "Đã thêm sản phẩm vào giỏ hàng",
-        "cartItem": {
-            "sanPhamId": product.MaSP,
-            "tenSP": product.TenSP,
-            "giaSP": float(product.GiaSP),
-            "soLuong": item.soLuong,
-            "thanhTien": thanh_tien,
-        }
+        "cartItem": cart_item
     }
 
 
@@ -71,15 +89,69 @@ def get_cart(
     current_user: dict = Depends(get_current_user),
 ):
     """
-    Lấy danh sách sản phẩm trong giỏ hàng
-    Note: This is a placeholder - actual cart should be stored in session/database
+    Lấy danh sách sản phẩm trong giỏ hàng (kèm hạn giữ hàng của từng món).
     """
+    customer_id = _get_customer_id(current_user)
+    cart = load_cart(db, customer_id)
     return {
         "message": "Giỏ hàng của bạn",
-        "items": []
+        **cart
+    }
+
+
+@router.put("/giohang/{sanPhamId}", tags=["Giỏ hàng"])
+def update_cart_item(
+    sanPhamId: int,
+    item: CartItemUpdateRequest,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Đổi số lượng một sản phẩm trong giỏ (giữ hàng lại theo số lượng mới).
+    """
+    customer_id = _get_customer_id(current_user)
+    try:
+        cart_item = set_cart_item(db, customer_id, sanPhamId, item.soLuong)
+        db.commit()
+    except CartError as e:
+        db.rollback()
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi cập nhật giỏ hàng: {str(e)}"
+        )
+
+    return {
+        "message": "Đã cập nhật giỏ hàng",
+        "cartItem": cart_item
     }
 
 
+@router.post("/giohang/validate", tags=["Giỏ hàng"])
+def validate_cart_for_checkout(
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Kiểm tra toàn bộ giỏ hàng trước khi đặt hàng (một lần gọi):
+    tồn kho trừ phần đang được khách khác giữ, sản phẩm ngừng kinh doanh, giá hiện tại.
+    Món hợp lệ được gia hạn giữ hàng để kịp tạo đơn.
+    """
+    customer_id = _get_customer_id(current_user)
+    try:
+        result = validate_cart(db, customer_id, extend=True)
+        db.commit()
+        return result
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi kiểm tra giỏ hàng: {str(e)}"
+        )
+
+
 @router.delete("/giohang/{sanPhamId}", tags=["Giỏ hàng"])
 def remove_from_cart(
     sanPhamId: int,
@@ -87,9 +159,30 @@ def remove_from_cart(
     current_user: dict = Depends(get_current_user),
 ):
     """
-    Xóa sản phẩm khỏi giỏ hàng
+    Xóa sản phẩm khỏi giỏ hàng (nhả phần hàng đang giữ)
     """
+    customer_id = _get_customer_id(current_user)
+    removed = remove_cart_items(db, customer_id, [sanPhamId])
+    db.commit()
+    if not removed:
+        raise HTTPException(status_code=404, detail="Sản phẩm không có trong giỏ hàng")
     return {
         "message": f"Đã xóa sản phẩm {sanPhamId} khỏi giỏ hàng"
     }
 
+
+@router.delete("/giohang", tags=["Giỏ hàng"])
+def clear_cart(
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Xóa toàn bộ giỏ hàng
+    """
+    customer_id = _get_customer_id(current_user)
+    removed = remove_cart_items(db, customer_id)
+    db.commit()
+    return {
+        "message": "Đã xóa giỏ hàng",
+        "removed": removed
+    }
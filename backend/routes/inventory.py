@@ -1,11 +1,21 @@
 # backend/routes/inventory.py
-from fastapi import APIRouter, Depends, HTTPException, status
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from backend.database import get_db
+from backend.database import get_db, SessionLocal
+from backend.models import StockLedger
 from backend.routes.deps import get_current_user
+from backend.utils.activity_logger import log_activity
+from backend.utils.catalog_snapshot import catalog_snapshot
 from backend.utils.inventory_manager import InventoryManager
+from backend.utils.product_io import SUPPORTED_FORMATS, detect_format
+from backend.utils.stock_ledger import stock_at, take_snapshot
+from backend.utils.stock_take import StockTakeReport, iter_file_rows, iter_json_rows, parse_adjustments
 from pydantic import BaseModel
-from typing import List, Optional
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 router = APIRouter(prefix="/inventory", tags=["Inventory"])
 
@@ -92,7 +102,8 @@ def update_product_stock(
         
         # Update stock
         success, message = InventoryManager.update_product_stock(
-            db, request.product_id, request.quantity_change, request.operation
+            db, request.product_id, request.quantity_change, request.operation,
+            user_id=current_user.get("user_id")
         )
         
         if not success:
@@ -178,3 +189,212 @@ def check_stock_availability(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Lỗi kiểm tra tồn kho: {str(e)}"
         )
+
+
+# =====================================================
+# 📜 Stock ledger (lịch sử biến động tồn kho)
+# =====================================================
+
+@router.get("/stock-at", response_model=dict, summary="Tồn kho tại một thời điểm")
+def get_stock_at(
+    product_ids: str,  # Comma-separated product IDs
+    at: datetime,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Tồn kho của các sản phẩm tại thời điểm `at` (UTC, ISO 8601):
+    snapshot gần nhất trước `at` + tổng biến động trong StockLedger sau snapshot đó.
+    """
+    if current_user.get("role") not in ["Admin", "Manager"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied"
+        )
+    try:
+        ids = [int(x.strip()) for x in product_ids.split(",") if x.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="product_ids phải là các số nguyên cách nhau bởi dấu phẩy"
+        )
+    if not ids or len(ids) > 500:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cần từ 1 đến 500 product_ids"
+        )
+    if at.tzinfo is not None:
+        # Ledger times are naive UTC
+        at = at.replace(tzinfo=None) - at.utcoffset()
+
+    try:
+        stock = stock_at(db, ids, at)
+        return {
+            "at": at.isoformat(),
+            "products": [{"MaSP": masp, "SoLuongTonKho": quantity} for masp, quantity in stock.items()],
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi tính tồn kho theo thời điểm: {str(e)}"
+        )
+
+
+@router.get("/ledger/{masp}", response_model=dict, summary="Lịch sử biến động tồn kho của sản phẩm")
+def get_stock_ledger(
+    masp: int,
+    before_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Biến động tồn kho của một sản phẩm, mới nhất trước.
+    Gửi lại `next_before_id` để lấy trang tiếp theo.
+    """
+    if current_user.get("role") not in ["Admin", "Manager"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied"
+        )
+    query = db.query(StockLedger).filter(StockLedger.MaSP == masp)
+    if before_id is not None:
+        query = query.filter(StockLedger.Id < before_id)
+    rows = query.order_by(StockLedger.Id.desc()).limit(limit).all()
+    return {
+        "MaSP": masp,
+        "items": [
+            {
+                "Id": row.Id,
+                "Delta": row.Delta,
+                "Reason": row.Reason,
+                "RefType": row.RefType,
+                "RefId": row.RefId,
+                "UserId": row.UserId,
+                "CreatedAt": row.CreatedAt.isoformat() if row.CreatedAt else None,
+            }
+            for row in rows
+        ],
+        "next_before_id": rows[-1].Id if len(rows) == limit else None,
+    }
+
+
+@router.put("/snapshot", response_model=dict, summary="Chụp snapshot tồn kho từ ledger")
+def create_stock_snapshot(
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Gộp biến động từ lần snapshot trước (chạy định kỳ theo STOCK_SNAPSHOT_INTERVAL_HOURS). Chỉ Admin."""
+    if current_user.get("role") != "Admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied"
+        )
+    try:
+        return take_snapshot(db)
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi tạo snapshot tồn kho: {str(e)}"
+        )
+
+
+# =====================================================
+# 📦 Kiểm kê: điều chỉnh tồn kho hàng loạt
+# =====================================================
+
+def _apply_stock_take(
+    raw_rows: Iterable[Tuple[int, Any]],
+    reference: str,
+    current_user: dict
+) -> Dict[str, Any]:
+    report = StockTakeReport()
+    adjustments = parse_adjustments(raw_rows, report)
+
+    db = SessionLocal()
+    try:
+        new_stock, report.unchanged, errors = InventoryManager.bulk_adjust_stock(
+            db, adjustments, user_id=current_user.get("user_id"), ref_id=reference
+        )
+        for row_number, masp, message in errors:
+            report.add_error(row_number, message, masp)
+        report.applied = len(new_stock)
+        if new_stock:
+            log_activity(
+                db,
+                current_user,
+                action="STOCK_TAKE",
+                entity="SanPham",
+                entity_id=reference,
+                details=f"Stock-take {reference}: {report.applied} adjusted, "
+                        f"{report.unchanged} unchanged, {report.failed} failed",
+                commit=False,
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    for masp, stock in new_stock.items():
+        catalog_snapshot.update_stock(masp, stock)
+    return {"reference": reference, **report.to_dict()}
+
+
+@router.put("/bulk-adjust", response_model=dict, summary="Điều chỉnh tồn kho hàng loạt (kiểm kê)")
+async def bulk_adjust_stock(
+    request: Request,
+    format: Optional[str] = Query(None, description="csv | ndjson cho body dạng file (mặc định đoán theo Content-Type)"),
+    reference: Optional[str] = Query(None, max_length=50, description="Mã phiếu kiểm kê (ghi vào StockLedger.RefId)"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Điều chỉnh tồn kho nhiều sản phẩm trong một transaction. Mỗi dòng: MaSP và
+    đúng một trong hai giá trị delta (cộng / trừ) hoặc absolute (số lượng đếm được).
+    - application/json: [{"MaSP": 1, "delta": -2}, {"MaSP": 2, "absolute": 40}]
+      hoặc {"items": [...]}
+    - multipart/form-data (field "file") hoặc body text/csv, application/x-ndjson:
+      CSV có header MaSP,delta,absolute hoặc NDJSON
+    - Dòng lỗi (thiếu sản phẩm, tồn kho âm, MaSP trùng) không chặn cả lô;
+      các dòng hợp lệ được ghi bằng một executemany UPDATE + một INSERT vào StockLedger.
+    """
+    if current_user.get("role") not in ["Admin", "Manager"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied"
+        )
+
+    content_type = request.headers.get("content-type", "").lower()
+    try:
+        if content_type.startswith("application/json"):
+            raw_rows = iter_json_rows(json.loads(await request.body()))
+        else:
+            if content_type.startswith("multipart/form-data"):
+                form = await request.form()
+                upload = form.get("file")
+                if upload is None or isinstance(upload, str):
+                    raise ValueError("Thiếu file (field \"file\")")
+                fmt = detect_format(upload.filename, upload.content_type, format)
+                data = await upload.read()
+            else:
+                fmt = detect_format(None, content_type, format)
+                data = await request.body()
+            if fmt not in SUPPORTED_FORMATS:
+                raise ValueError(f"Định dạng không hỗ trợ: {fmt} (chỉ csv, ndjson)")
+            raw_rows = iter_file_rows(data, fmt)
+    except ValueError as e:
+        # json.JSONDecodeError is a ValueError too
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    reference = reference or f"ST-{datetime.utcnow():%Y%m%d%H%M%S}"
+    try:
+        return await run_in_threadpool(_apply_stock_take, raw_rows, reference, current_user)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi điều chỉnh tồn kho hàng loạt: {str(e)}"
+        )
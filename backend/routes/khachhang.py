@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from backend.database import get_db
 from backend.models import KhachHang
 from backend.routes.deps import get_current_user
+from backend.utils.order_search import customer_search_index
 
 router = APIRouter(tags=["KhachHang"])
 
@@ -38,6 +39,7 @@ def create_khachhang(khachhang: dict, db: Session = Depends(get_db),
     db.add(new_kh)
     db.commit()
     db.refresh(new_kh)
+    customer_search_index.upsert_customer(new_kh)
     return {"MaKH": new_kh.MaKH}
 
 # Read all
@@ -94,6 +96,7 @@ def update_my_info(khachhang: dict, db: Session = Depends(get_db),
     
     db.commit()
     db.refresh(kh)
+    customer_search_index.upsert_customer(kh)
     return serialize_khachhang(kh)
 
 # Read one
@@ -124,6 +127,7 @@ def update_khachhang(makh: int, khachhang: dict, db: Session = Depends(get_db),
             setattr(kh, key, value)
     db.commit()
     db.refresh(kh)
+    customer_search_index.upsert_customer(kh)
     return serialize_khachhang(kh)
 
 # Delete (soft delete)
@@ -13,15 +13,17 @@
 # 6. Backend updates order status, redirects to result page
 # =====================================================
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Response
 from sqlalchemy.orm import Session
 from datetime import datetime
+from typing import Optional
 import uuid
 import hashlib
 
 from backend.database import get_db
 from backend.models import DonHang, PaymentTransaction, ThanhToan
 from backend.routes.deps import get_current_user, get_current_user_optional
+from backend.utils.idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER, run_idempotent
 from backend.schemas import (
     CreateTransactionRequest,
     CreateTransactionResponse,
@@ -83,9 +85,25 @@ def generate_transaction_id() -> str:
              summary="Tạo giao dịch thanh toán mới")
 def create_transaction(
     request: CreateTransactionRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
+    """
+    Tạo giao dịch thanh toán. Gửi kèm header Idempotency-Key để các lần thử lại
+    nhận lại đúng giao dịch đã tạo mà không chạy lại handler.
+    """
+    result, replayed = run_idempotent(
+        "payment.create_transaction", idempotency_key, current_user, request.model_dump(),
+        lambda: _create_transaction(request, db),
+    )
+    if replayed:
+        response.headers[REPLAYED_HEADER] = "true"
+    return result
+
+
+def _create_transaction(request: CreateTransactionRequest, db: Session) -> CreateTransactionResponse:
     """
     ORDER FLOW STEP 5.1.1: Create payment transaction for order
     
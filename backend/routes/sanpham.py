@@ -1,17 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query, UploadFile, File
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
 from backend.database import get_db
-from backend.models import SanPham, DanhMuc
+from backend.models import SanPham, DanhMuc, SanPham_ThuocTinh
 from backend.routes.deps import get_current_user, get_current_user_optional
 from backend.schemas import (
     ProductCreateRequest, 
     ProductUpdateRequest, 
     ProductResponse, 
-    ProductListResponse
+    ProductListResponse,
+    ProductBatchRequest
 )
 from backend.utils.activity_logger import log_activity
+from backend.utils.inventory_manager import InventoryManager
+from backend.utils.stock_ledger import REASON_ADJUST, REASON_OPENING, movement, record_movements
+from backend.utils.product_attributes import (
+    decode_attributes_cached,
+    sync_product_attributes,
+    rebuild_attribute_index,
+    parse_attribute_filters,
+)
+from backend.utils.catalog_snapshot import catalog_snapshot
+from backend.utils.low_stock import low_stock_tracker
+from backend.utils.http_cache import conditional_get, bump_table_version
+from backend.utils.product_io import SUPPORTED_FORMATS, detect_format, import_products, stream_export
 import json
-from typing import Optional
+import orjson
+from decimal import Decimal
+from typing import List, Optional
 
 router = APIRouter(tags=["SanPham"])
 
@@ -33,18 +49,6 @@ def encode_attributes_to_mota(attributes: Optional[dict]) -> Optional[str]:
             detail=f"Invalid attributes format: {str(e)}"
         )
 
-def decode_attributes_from_mota(mota: Optional[str]) -> Optional[dict]:
-    """
-    Decode JSON string from MoTa column to attributes dictionary.
-    """
-    if not mota or mota.strip() == "":
-        return None
-    try:
-        return json.loads(mota)
-    except (json.JSONDecodeError, TypeError):
-        # If MoTa is not valid JSON, return it as a simple string
-        return {"description": mota}
-
 def format_product_response(sp: SanPham, include_attributes: bool = True) -> dict:
     """
     Format product response with optional attributes decoding.
@@ -64,14 +68,95 @@ def format_product_response(sp: SanPham, include_attributes: bool = True) -> dic
     if sp.danhmuc:
         response["TenDanhMuc"] = sp.danhmuc.TenDanhMuc
     
-    # Decode attributes if requested
+    # Decode attributes if requested (memoized on MaSP + MoTa hash)
     if include_attributes:
-        response["attributes"] = decode_attributes_from_mota(sp.MoTa)
+        response["attributes"] = decode_attributes_cached(sp.MaSP, sp.MoTa)
     else:
         response["attributes"] = None
     
     return response
 
+def apply_product_filters(
+    db: Session,
+    query,
+    madanhmuc: Optional[int] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    search: Optional[str] = None,
+    attr: Optional[List[str]] = None,
+):
+    """
+    Áp dụng bộ lọc danh mục / giá / tên / thuộc tính lên query có SanPham trong FROM.
+    """
+    # Áp dụng bộ lọc danh mục nếu có
+    if madanhmuc is not None:
+        query = query.filter(SanPham.MaDanhMuc == madanhmuc)
+
+    # Áp dụng bộ lọc giá nếu có
+    if min_price is not None:
+        query = query.filter(SanPham.GiaSP >= min_price)
+    if max_price is not None:
+        query = query.filter(SanPham.GiaSP <= max_price)
+
+    # Áp dụng bộ lọc tìm kiếm theo tên sản phẩm nếu có
+    if search:
+        like_pattern = f"%{search}%"
+        query = query.filter(SanPham.TenSP.ilike(like_pattern))
+
+    # Áp dụng bộ lọc thuộc tính (EXISTS trên index TenThuocTinh, GiaTri)
+    for key, value in parse_attribute_filters(attr):
+        query = query.filter(
+            db.query(SanPham_ThuocTinh.MaSP).filter(
+                SanPham_ThuocTinh.MaSP == SanPham.MaSP,
+                SanPham_ThuocTinh.TenThuocTinh == key,
+                SanPham_ThuocTinh.GiaTri == value,
+            ).exists()
+        )
+    return query
+
+# =====================================================
+# ⚡ Lean listing (card view)
+# =====================================================
+# Chỉ SELECT các cột mà thẻ sản phẩm cần (không có MoTa TEXT), serialize
+# thẳng từ row tuple bằng orjson - bỏ qua ORM object và ProductResponse.
+
+LEAN_PRODUCT_COLUMNS = (
+    SanPham.MaSP,
+    SanPham.TenSP,
+    SanPham.GiaSP,
+    SanPham.SoLuongTonKho,
+    SanPham.HinhAnh,
+    SanPham.MaDanhMuc,
+    DanhMuc.TenDanhMuc,
+)
+LEAN_PRODUCT_FIELDS = tuple(col.key for col in LEAN_PRODUCT_COLUMNS)
+
+# Bảng mà danh sách / chi tiết sản phẩm đọc - dùng để tính ETag
+PRODUCT_LIST_TABLES = ("SanPham", "DanhMuc", "SanPham_ThuocTinh")
+PRODUCT_DETAIL_TABLES = ("SanPham", "DanhMuc")
+
+
+def _orjson_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError
+
+
+def _lean_product_list(db: Session, offset: int, limit: int, madanhmuc, min_price, max_price, search, attr) -> Response:
+    query = (
+        db.query(*LEAN_PRODUCT_COLUMNS)
+        .outerjoin(DanhMuc, DanhMuc.MaDanhMuc == SanPham.MaDanhMuc)
+        .filter(SanPham.IsDelete == False)
+    )
+    query = apply_product_filters(db, query, madanhmuc, min_price, max_price, search, attr)
+    total = query.count()
+    rows = query.offset(offset).limit(limit).all()
+    body = orjson.dumps(
+        {"products": [dict(zip(LEAN_PRODUCT_FIELDS, row)) for row in rows], "total": total},
+        default=_orjson_default,
+    )
+    return Response(content=body, media_type="application/json")
+
 # =====================================================
 # 🧾 Routes
 # =====================================================
@@ -113,8 +198,16 @@ def create_sanpham(
         )
         
         db.add(new_sp)
+        db.flush()
+        # Index scalar attributes in SanPham_ThuocTinh (same transaction)
+        sync_product_attributes(db, new_sp.MaSP, new_sp.MoTa)
+        record_movements(db, [movement(
+            new_sp.MaSP, new_sp.SoLuongTonKho or 0, REASON_OPENING, "SanPham", new_sp.MaSP,
+            current_user.get("user_id"),
+        )])
         db.commit()
         db.refresh(new_sp)
+        catalog_snapshot.upsert_product(new_sp)
 
         # Activity log
         try:
@@ -153,6 +246,11 @@ def get_all_sanpham(
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
     search: Optional[str] = None,
+    attr: Optional[List[str]] = Query(None),
+    facets: bool = False,
+    lean: bool = False,
+    request: Request = None,
+    response: Response = None,
     db: Session = Depends(get_db),
     current_user: Optional[dict] = Depends(get_current_user_optional),
 ):
@@ -164,36 +262,62 @@ def get_all_sanpham(
         * madanhmuc: mã danh mục
         * min_price, max_price: khoảng giá
         * search: tìm kiếm theo tên sản phẩm (TenSP)
+        * attr: lọc theo thuộc tính "key:value", lặp lại được (dùng index SanPham_ThuocTinh)
+    - facets=true: trả thêm số lượng theo danh mục, khoảng giá, thuộc tính chính và
+      tồn kho. Lọc, đếm và phân trang chạy trên snapshot trong bộ nhớ
+      (backend/utils/catalog_snapshot.py); MySQL chỉ được hỏi để lấy các sản phẩm của trang.
+    - lean=true: chế độ thẻ sản phẩm - chỉ trả MaSP, TenSP, GiaSP, SoLuongTonKho,
+      HinhAnh, MaDanhMuc, TenDanhMuc (không MoTa / attributes), serialize bằng orjson.
+    - Hỗ trợ ETag / If-None-Match: trả 304 khi SanPham/DanhMuc chưa thay đổi.
 
     Ví dụ:
     /api/sanpham/?madanhmuc=1
     /api/sanpham/?min_price=0&max_price=2000000
     /api/sanpham/?search=tu&madanhmuc=1
+    /api/sanpham/?attr=brand:Samsung&attr=dung tích:1.8L
     """
-    try:
-        # Base query (chỉ lấy sản phẩm chưa xóa)
-        query = db.query(SanPham).filter(SanPham.IsDelete == False)
+    not_modified = conditional_get(request, response, "sanpham_list", PRODUCT_LIST_TABLES)
+    if not_modified is not None:
+        return not_modified
 
-        # Áp dụng bộ lọc danh mục nếu có
-        if madanhmuc is not None:
-            query = query.filter(SanPham.MaDanhMuc == madanhmuc)
+    try:
+        offset = (page - 1) * limit
 
-        # Áp dụng bộ lọc giá nếu có
-        if min_price is not None:
-            query = query.filter(SanPham.GiaSP >= min_price)
-        if max_price is not None:
-            query = query.filter(SanPham.GiaSP <= max_price)
+        if facets:
+            catalog_snapshot.ensure_fresh(db)
+            result = catalog_snapshot.search(
+                madanhmuc=madanhmuc,
+                min_price=min_price,
+                max_price=max_price,
+                search=search,
+                attr_filters=parse_attribute_filters(attr),
+                offset=offset,
+                limit=limit,
+            )
+            page_ids = result["page_ids"]
+            by_id = {}
+            if page_ids:
+                by_id = {sp.MaSP: sp for sp in db.query(SanPham).filter(SanPham.MaSP.in_(page_ids)).all()}
+            products = [
+                ProductResponse(**format_product_response(by_id[masp], include_attributes=include_attributes))
+                for masp in page_ids if masp in by_id
+            ]
+            return ProductListResponse(products=products, total=result["total"], facets=result["facets"])
+
+        if lean:
+            lean_response = _lean_product_list(db, offset, limit, madanhmuc, min_price, max_price, search, attr)
+            for header in ("ETag", "Cache-Control"):
+                lean_response.headers[header] = response.headers[header]
+            return lean_response
 
-        # Áp dụng bộ lọc tìm kiếm theo tên sản phẩm nếu có
-        if search:
-            like_pattern = f"%{search}%"
-            query = query.filter(SanPham.TenSP.ilike(like_pattern))
+        # Base query (chỉ lấy sản phẩm chưa xóa)
+        query = db.query(SanPham).filter(SanPham.IsDelete == False)
+        query = apply_product_filters(db, query, madanhmuc, min_price, max_price, search, attr)
 
         # Đếm tổng sau khi áp dụng filter
         total = query.count()
 
         # Apply pagination
-        offset = (page - 1) * limit
         sps = query.offset(offset).limit(limit).all()
 
         # Format products with optional attributes decoding
@@ -212,19 +336,207 @@ def get_all_sanpham(
             detail=f"Lỗi lấy danh sách sản phẩm: {str(e)}",
         )
 
+# Rebuild attribute index
+
+
+@router.post("/attributes/reindex", response_model=dict, summary="Đồng bộ lại bảng thuộc tính sản phẩm (Admin)")
+def reindex_product_attributes(
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Dựng lại SanPham_ThuocTinh từ cột MoTa của toàn bộ sản phẩm.
+    Chạy một lần sau migration 2026-10-19_create_sanpham_thuoctinh.sql.
+    """
+    if current_user.get("role") != "Admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied"
+        )
+    try:
+        processed = rebuild_attribute_index(db)
+        return {"message": "Đã đồng bộ thuộc tính sản phẩm", "products": processed}
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi đồng bộ thuộc tính: {str(e)}"
+        )
+
+def availability_entry(masp: int, sp: Optional[dict], quantity: int) -> dict:
+    """
+    Kết quả kiểm tra một sản phẩm cho giỏ hàng.
+    `sp` là dict từ InventoryManager.get_products_by_ids (None nếu không tồn tại).
+    """
+    if not sp:
+        return {
+            "available": False,
+            "reason": "Sản phẩm không tồn tại",
+            "MaSP": masp
+        }
+    
+    if sp["IsDelete"]:
+        return {
+            "available": False,
+            "reason": "Sản phẩm đã ngừng kinh doanh",
+            "MaSP": masp,
+            "TenSP": sp["TenSP"]
+        }
+    
+    entry = {
+        "available": True,
+        "MaSP": sp["MaSP"],
+        "TenSP": sp["TenSP"],
+        "GiaSP": float(sp["GiaSP"]) if sp["GiaSP"] else 0.0,
+        "SoLuongTonKho": sp["SoLuongTonKho"],
+        "HinhAnh": sp["HinhAnh"]
+    }
+    if sp["SoLuongTonKho"] < quantity:
+        entry["available"] = False
+        entry["reason"] = f"Không đủ hàng. Chỉ còn {sp['SoLuongTonKho']} sản phẩm"
+    return entry
+
+
+@router.post("/batch", response_model=dict, summary="Kiểm tra giá / tồn kho nhiều sản phẩm (giỏ hàng, checkout)")
+def get_sanpham_batch(
+    request: ProductBatchRequest,
+    db: Session = Depends(get_db),
+    current_user: Optional[dict] = Depends(get_current_user_optional)
+):
+    """
+    Trả về giá, tồn kho và trạng thái còn hàng cho tối đa PRODUCT_BATCH_MAX_ITEMS
+    sản phẩm bằng một truy vấn IN (thay cho gọi /{masp}/check-availability từng món).
+    Public access - dùng để hydrate giỏ hàng.
+    Đọc trực tiếp từ CSDL (không dùng catalog snapshot) để tồn kho luôn mới nhất.
+    """
+    try:
+        products = InventoryManager.get_products_by_ids(db, [item.MaSP for item in request.items])
+        items = [availability_entry(item.MaSP, products.get(item.MaSP), item.SoLuong) for item in request.items]
+        return {
+            "available": all(item["available"] for item in items),
+            "items": items
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi kiểm tra sản phẩm: {str(e)}"
+        )
+
+# =====================================================
+# 📦 Import / Export hàng loạt
+# =====================================================
+
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+@router.post("/import", response_model=dict, summary="Import sản phẩm hàng loạt (CSV / NDJSON)")
+def import_sanpham(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, description="csv | ndjson (mặc định đoán theo tên file)"),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Import sản phẩm từ file CSV (có header) hoặc NDJSON (mỗi dòng một object).
+    - Cột: MaSP (tùy chọn - có thì cập nhật), TenSP, GiaSP, SoLuongTonKho,
+      MaDanhMuc, HinhAnh, MoTa hoặc attributes (JSON object).
+    - File được đọc theo từng dòng, ghi theo lô bằng bulk insert / update.
+    - Dòng lỗi không chặn cả file; trả về danh sách lỗi theo số dòng.
+    """
+    if current_user.get("role") not in ["Admin", "Manager"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied"
+        )
+
+    fmt = detect_format(file.filename, file.content_type, format)
+    if fmt not in SUPPORTED_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Định dạng không hỗ trợ: {fmt} (chỉ csv, ndjson)"
+        )
+
+    try:
+        report = import_products(db, file.file, fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi import sản phẩm: {str(e)}"
+        )
+
+    if report.inserted or report.updated:
+        # bulk_*_mappings không phát ORM event -> tự tăng version cho ETag / snapshot
+        bump_table_version("SanPham")
+        bump_table_version("SanPham_ThuocTinh")
+        catalog_snapshot.invalidate()
+        try:
+            log_activity(
+                db,
+                current_user,
+                action="IMPORT",
+                entity="SanPham",
+                entity_id=None,
+                details=f"Imported products from '{file.filename}': "
+                        f"{report.inserted} inserted, {report.updated} updated, {report.failed} failed",
+            )
+        except Exception:
+            pass
+
+    return report.to_dict()
+
+
+@router.get("/export", summary="Export sản phẩm (CSV / NDJSON, streaming)")
+def export_sanpham(
+    format: str = Query("csv", description="csv | ndjson"),
+    madanhmuc: Optional[int] = None,
+    include_deleted: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Export toàn bộ sản phẩm dạng stream (server-side cursor, không nạp hết vào RAM).
+    Generator tự mở session riêng (chạy sau khi route đã trả về).
+    """
+    if current_user.get("role") not in ["Admin", "Manager", "Employee", "NhanVien"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied"
+        )
+    fmt = format.lower()
+    if fmt not in SUPPORTED_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Định dạng không hỗ trợ: {fmt} (chỉ csv, ndjson)"
+        )
+
+    return StreamingResponse(
+        stream_export(fmt, madanhmuc, include_deleted),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="sanpham.{fmt}"'},
+    )
+
 # Read one
 
 
 @router.get("/{masp}", response_model=ProductResponse, summary="Xem chi tiết sản phẩm")
 def get_sanpham(
     masp: int, 
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db), 
     current_user: Optional[dict] = Depends(get_current_user_optional)
 ):
     """
     Xem chi tiết sản phẩm với thuộc tính đã giải mã.
     Public access - không yêu cầu đăng nhập.
+    Hỗ trợ ETag / If-None-Match (304 khi sản phẩm chưa thay đổi).
     """
+    not_modified = conditional_get(request, response, "sanpham_detail", PRODUCT_DETAIL_TABLES)
+    if not_modified is not None:
+        return not_modified
+
     try:
         sp = db.query(SanPham).filter(
             SanPham.MaSP == masp, 
@@ -262,42 +574,8 @@ def check_product_availability(
     Dùng để validate giỏ hàng.
     """
     try:
-        sp = db.query(SanPham).filter(SanPham.MaSP == masp).first()
-        
-        if not sp:
-            return {
-                "available": False,
-                "reason": "Sản phẩm không tồn tại",
-                "MaSP": masp
-            }
-        
-        if sp.IsDelete:
-            return {
-                "available": False,
-                "reason": "Sản phẩm đã ngừng kinh doanh",
-                "MaSP": masp,
-                "TenSP": sp.TenSP
-            }
-        
-        if sp.SoLuongTonKho < quantity:
-            return {
-                "available": False,
-                "reason": f"Không đủ hàng. Chỉ còn {sp.SoLuongTonKho} sản phẩm",
-                "MaSP": masp,
-                "TenSP": sp.TenSP,
-                "GiaSP": float(sp.GiaSP) if sp.GiaSP else 0.0,
-                "SoLuongTonKho": sp.SoLuongTonKho,
-                "HinhAnh": sp.HinhAnh
-            }
-        
-        return {
-            "available": True,
-            "MaSP": sp.MaSP,
-            "TenSP": sp.TenSP,
-            "GiaSP": float(sp.GiaSP) if sp.GiaSP else 0.0,
-            "SoLuongTonKho": sp.SoLuongTonKho,
-            "HinhAnh": sp.HinhAnh
-        }
+        sp = InventoryManager.get_products_by_ids(db, [masp]).get(masp)
+        return availability_entry(masp, sp, quantity)
         
     except Exception as e:
         raise HTTPException(
@@ -328,10 +606,15 @@ def update_sanpham(
         )
     
     try:
-        sp = db.query(SanPham).filter(
+        query = db.query(SanPham).filter(
             SanPham.MaSP == masp, 
             SanPham.IsDelete == False
-        ).first()
+        )
+        if product_data.SoLuongTonKho is not None:
+            # Row locked until commit: the ledger difference below must be taken
+            # against the stock this write replaces, not a concurrent order's
+            query = query.with_for_update()
+        sp = query.first()
         
         if not sp:
             raise HTTPException(
@@ -345,6 +628,11 @@ def update_sanpham(
         if product_data.GiaSP is not None:
             sp.GiaSP = product_data.GiaSP
         if product_data.SoLuongTonKho is not None:
+            # Setting stock directly is recorded as an adjustment by the difference
+            record_movements(db, [movement(
+                sp.MaSP, product_data.SoLuongTonKho - (sp.SoLuongTonKho or 0), REASON_ADJUST, "SanPham", sp.MaSP,
+                current_user.get("user_id"),
+            )])
             sp.SoLuongTonKho = product_data.SoLuongTonKho
         if product_data.MaDanhMuc is not None:
             sp.MaDanhMuc = product_data.MaDanhMuc
@@ -356,12 +644,17 @@ def update_sanpham(
             # Encode new attributes to JSON string
             mota_json = encode_attributes_to_mota(product_data.attributes)
             sp.MoTa = mota_json
+            sync_product_attributes(db, sp.MaSP, sp.MoTa)
         elif product_data.MoTa is not None:
             # If MoTa is provided directly, use it
             sp.MoTa = product_data.MoTa
+            sync_product_attributes(db, sp.MaSP, sp.MoTa)
         
         db.commit()
         db.refresh(sp)
+        catalog_snapshot.upsert_product(sp)
+        # Name changes do not go through the stock ledger
+        low_stock_tracker.mark_changed([sp.MaSP])
 
         # Activity log
         try:
@@ -422,6 +715,8 @@ def delete_sanpham(
         
         sp.IsDelete = True
         db.commit()
+        catalog_snapshot.remove_product(sp.MaSP)
+        low_stock_tracker.mark_changed([sp.MaSP])
 
         # Activity log
         try:
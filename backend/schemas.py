@@ -1,5 +1,5 @@
 from typing import Optional, Dict, List, Any
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime, date
 import json
 
@@ -153,6 +153,17 @@ class ProductResponse(BaseModel):
 class ProductListResponse(BaseModel):
     products: List[ProductResponse]
     total: int
+    facets: Optional[Dict[str, Any]] = None  # Facet counts (only when facets=true)
+
+# Max products per POST /api/sanpham/batch request
+PRODUCT_BATCH_MAX_ITEMS = 100
+
+class ProductBatchItem(BaseModel):
+    MaSP: int
+    SoLuong: int = Field(1, ge=1)
+
+class ProductBatchRequest(BaseModel):
+    items: List[ProductBatchItem] = Field(..., min_length=1, max_length=PRODUCT_BATCH_MAX_ITEMS)
 
 # =====================================================
 # 📋 Contact (LienHe) Schemas
@@ -12,8 +12,13 @@ def log_activity(
     details: Optional[str] = None,
     ip: Optional[str] = None,
     user_agent: Optional[str] = None,
+    commit: bool = True,
 ):
-    """Create an ActivityLog record (fire-and-forget, caller handles tx)."""
+    """
+    Create an ActivityLog record (fire-and-forget, caller handles tx).
+    commit=False only adds the row to the caller's transaction, so the log is
+    written atomically with the change it describes.
+    """
     try:
         user_id = None
         username = None
@@ -35,9 +40,11 @@ def log_activity(
             UserAgent=user_agent,
         )
         db.add(log)
-        db.commit()
+        if commit:
+            db.commit()
     except Exception:
-        db.rollback()
+        if commit:
+            db.rollback()
         # swallow logging exceptions
         return
 
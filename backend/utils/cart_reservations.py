@@ -0,0 +1,201 @@
+# backend/utils/cart_reservations.py
+"""
+Server-side cart with time-limited soft stock reservations (GioHang table).
+
+A cart row holds its SoLuong until GiuHangDen; the quantity another customer
+can put in a cart (or order) is SoLuongTonKho minus every other customer's
+unexpired reservation. Reservations expire on their own - nothing has to
+run to release them - and are renewed whenever the customer touches the
+cart or validates it at checkout.
+
+Writes lock the affected SanPham rows (InventoryManager.lock_products)
+so two concurrent add-to-cart calls cannot both take the last unit.
+Functions here never commit; routes own the transaction.
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from backend.models import GioHang, SanPham
+from backend.utils.inventory_manager import InventoryManager
+
+CART_RESERVATION_MINUTES = int(os.getenv("CART_RESERVATION_MINUTES", "15"))
+CART_MAX_ITEMS = int(os.getenv("CART_MAX_ITEMS", "50"))
+
+
+class CartError(Exception):
+    """Cart operation rejected; status_code is the HTTP status to return."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def reservation_expiry(now: Optional[datetime] = None) -> datetime:
+    return (now or datetime.utcnow()) + timedelta(minutes=CART_RESERVATION_MINUTES)
+
+
+def reserved_quantities(
+    db: Session,
+    product_ids: Iterable[int],
+    exclude_makh: Optional[int] = None,
+    now: Optional[datetime] = None,
+) -> Dict[int, int]:
+    """MaSP -> quantity held by unexpired reservations (one grouped query)."""
+    product_ids = list(set(product_ids))
+    if not product_ids:
+        return {}
+    query = db.query(GioHang.MaSP, func.sum(GioHang.SoLuong)).filter(
+        GioHang.MaSP.in_(product_ids),
+        GioHang.GiuHangDen > (now or datetime.utcnow()),
+    )
+    if exclude_makh is not None:
+        query = query.filter(GioHang.MaKH != exclude_makh)
+    return {masp: int(total or 0) for masp, total in query.group_by(GioHang.MaSP).all()}
+
+
+def _cart_item_dict(row: GioHang, sp: Optional[SanPham], now: datetime) -> Dict[str, Any]:
+    gia = float(sp.GiaSP) if sp is not None and sp.GiaSP else 0.0
+    return {
+        "sanPhamId": row.MaSP,
+        "tenSP": sp.TenSP if sp is not None else None,
+        "giaSP": gia,
+        "soLuong": row.SoLuong,
+        "thanhTien": gia * row.SoLuong,
+        "hinhAnh": sp.HinhAnh if sp is not None else None,
+        "giuHangDen": row.GiuHangDen.isoformat() if row.GiuHangDen else None,
+        "dangGiuHang": bool(row.GiuHangDen and row.GiuHangDen > now),
+    }
+
+
+def set_cart_item(db: Session, makh: int, masp: int, soluong: int, add: bool = False) -> Dict[str, Any]:
+    """
+    Add (add=True) or set the quantity of one product and (re)reserve it.
+    Raises CartError when the product is unavailable or stock is insufficient.
+    """
+    if soluong <= 0:
+        raise CartError("Số lượng phải lớn hơn 0")
+    now = datetime.utcnow()
+    sp = InventoryManager.lock_products(db, [masp]).get(masp)
+    if sp is None or sp.IsDelete:
+        raise CartError("Sản phẩm không tồn tại", status_code=404)
+
+    row = db.query(GioHang).filter(GioHang.MaKH == makh, GioHang.MaSP == masp).first()
+    if row is None:
+        cart_size = db.query(func.count(GioHang.MaSP)).filter(GioHang.MaKH == makh).scalar() or 0
+        if cart_size >= CART_MAX_ITEMS:
+            raise CartError(f"Giỏ hàng tối đa {CART_MAX_ITEMS} sản phẩm")
+    new_quantity = (row.SoLuong if row is not None and add else 0) + soluong
+
+    available = (sp.SoLuongTonKho or 0) - reserved_quantities(db, [masp], exclude_makh=makh, now=now).get(masp, 0)
+    if new_quantity > available:
+        raise CartError(f"Không đủ hàng trong kho. Chỉ còn {max(available, 0)} sản phẩm")
+
+    if row is None:
+        row = GioHang(MaKH=makh, MaSP=masp)
+        db.add(row)
+    row.SoLuong = new_quantity
+    row.GiuHangDen = reservation_expiry(now)
+    db.flush()
+    return _cart_item_dict(row, sp, now)
+
+
+def remove_cart_items(db: Session, makh: int, product_ids: Optional[Iterable[int]] = None) -> int:
+    """Delete cart rows (all of them when product_ids is None); releases their reservations."""
+    query = db.query(GioHang).filter(GioHang.MaKH == makh)
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return 0
+        query = query.filter(GioHang.MaSP.in_(product_ids))
+    return query.delete(synchronize_session=False)
+
+
+def get_cart(db: Session, makh: int) -> Dict[str, Any]:
+    now = datetime.utcnow()
+    rows = (
+        db.query(GioHang, SanPham)
+        .outerjoin(SanPham, SanPham.MaSP == GioHang.MaSP)
+        .filter(GioHang.MaKH == makh)
+        .order_by(GioHang.NgayCapNhat)
+        .all()
+    )
+    items = [_cart_item_dict(row, sp, now) for row, sp in rows]
+    return {"items": items, "tongTien": sum(item["thanhTien"] for item in items)}
+
+
+def validate_cart(db: Session, makh: int, extend: bool = True) -> Dict[str, Any]:
+    """
+    One-call checkout validation: every item is checked against current stock
+    minus other customers' reservations, with all products locked and loaded
+    in one query. Valid items get their reservation renewed (extend=True) so
+    the order can be placed within CART_RESERVATION_MINUTES.
+    """
+    now = datetime.utcnow()
+    rows = db.query(GioHang).filter(GioHang.MaKH == makh).all()
+    product_ids = [row.MaSP for row in rows]
+    products = InventoryManager.lock_products(db, product_ids)
+    reserved = reserved_quantities(db, product_ids, exclude_makh=makh, now=now)
+
+    items: List[Dict[str, Any]] = []
+    for row in rows:
+        sp = products.get(row.MaSP)
+        item = _cart_item_dict(row, sp, now)
+        if sp is None or sp.IsDelete:
+            item.update(hopLe=False, lyDo="Sản phẩm đã ngừng kinh doanh")
+        else:
+            available = (sp.SoLuongTonKho or 0) - reserved.get(row.MaSP, 0)
+            item["conLai"] = max(available, 0)
+            if row.SoLuong > available:
+                item.update(hopLe=False, lyDo=f"Không đủ hàng. Chỉ còn {max(available, 0)} sản phẩm")
+            else:
+                item["hopLe"] = True
+                if extend:
+                    row.GiuHangDen = reservation_expiry(now)
+                    item["giuHangDen"] = row.GiuHangDen.isoformat()
+                    item["dangGiuHang"] = True
+        items.append(item)
+
+    return {
+        "valid": bool(items) and all(item["hopLe"] for item in items),
+        "items": items,
+        "tongTien": sum(item["thanhTien"] for item in items if item["hopLe"]),
+    }
+
+
+def find_reservation_conflicts(
+    db: Session,
+    makh: Optional[int],
+    order_items: List[Dict],
+    products: Optional[Dict[int, SanPham]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Items of a new order whose quantity exceeds stock minus other customers'
+    active reservations. The customer's own cart reservation counts as theirs.
+    Pass `products` when the caller already holds the locked SanPham rows.
+    """
+    quantities: Dict[int, int] = {}
+    for item in order_items:
+        quantities[item["MaSP"]] = quantities.get(item["MaSP"], 0) + int(item.get("SoLuong", 1))
+    if products is None:
+        products = InventoryManager.lock_products(db, quantities.keys())
+    reserved = reserved_quantities(db, quantities.keys(), exclude_makh=makh)
+
+    conflicts = []
+    for masp, required in quantities.items():
+        sp = products.get(masp)
+        if sp is None:
+            continue
+        available = (sp.SoLuongTonKho or 0) - reserved.get(masp, 0)
+        if required > available:
+            conflicts.append({
+                "MaSP": masp,
+                "TenSP": sp.TenSP,
+                "Available": max(available, 0),
+                "Required": required,
+            })
+    return conflicts
@@ -0,0 +1,254 @@
+# backend/utils/catalog_snapshot.py
+"""
+In-memory columnar snapshot of the product catalog for faceted search.
+
+Price, category and stock of every active product are held in NumPy arrays
+(one row per product); facet counts for /api/sanpham/?facets=true are
+computed with vectorized masks over these arrays, so facet queries never
+touch MySQL. The snapshot is loaded once, patched incrementally by product
+writes (upsert_product / remove_product) and fully rebuilt after
+CATALOG_SNAPSHOT_TTL_SECONDS as a safety net for stock changes made
+elsewhere (order status, inventory adjustments).
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from backend.models import SanPham
+from backend.utils.product_attributes import decode_attributes_cached, extract_indexed_attributes, fold_attribute_value
+
+CATALOG_SNAPSHOT_TTL_SECONDS = int(os.getenv("CATALOG_SNAPSHOT_TTL_SECONDS", "300"))
+
+# Upper bounds (VND) of the price buckets; the last bucket is open-ended
+PRICE_BUCKET_EDGES = [1_000_000, 2_000_000, 5_000_000, 10_000_000, 20_000_000]
+# Normalized attribute keys exposed as facets (see product_attributes.normalize_attribute_key)
+FACET_ATTRIBUTE_KEYS = ("brand", "capacity", "power", "color")
+# Max values returned per attribute facet
+FACET_ATTRIBUTE_TOP_N = 20
+
+_NO_CATEGORY = -1
+
+
+def _price_bucket_labels() -> List[str]:
+    labels = []
+    lower = 0
+    for upper in PRICE_BUCKET_EDGES:
+        labels.append(f"{lower}-{upper}")
+        lower = upper
+    labels.append(f"{lower}+")
+    return labels
+
+
+PRICE_BUCKET_LABELS = _price_bucket_labels()
+
+
+class CatalogSnapshot:
+    """Columnar product arrays + MaSP -> row position map."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded_at = 0.0
+        self._size = 0
+        self._pos: Dict[int, int] = {}
+        self._allocate(0)
+
+    # ---------- storage ----------
+
+    def _allocate(self, capacity: int) -> None:
+        capacity = max(capacity, 64)
+        self.masp = np.zeros(capacity, dtype=np.int64)
+        self.price = np.zeros(capacity, dtype=np.float64)
+        self.category = np.full(capacity, _NO_CATEGORY, dtype=np.int64)
+        self.stock = np.zeros(capacity, dtype=np.int64)
+        self.name = np.empty(capacity, dtype=object)
+        self.attrs = {key: np.empty(capacity, dtype=object) for key in FACET_ATTRIBUTE_KEYS}
+        self.all_attrs = np.empty(capacity, dtype=object)
+
+    def _grow(self) -> None:
+        capacity = len(self.masp) * 2
+        old = (self.masp, self.price, self.category, self.stock, self.name, self.attrs, self.all_attrs)
+        self._allocate(capacity)
+        n = self._size
+        self.masp[:n], self.price[:n], self.category[:n], self.stock[:n], self.name[:n] = (
+            old[0][:n], old[1][:n], old[2][:n], old[3][:n], old[4][:n]
+        )
+        for key in FACET_ATTRIBUTE_KEYS:
+            self.attrs[key][:n] = old[5][key][:n]
+        self.all_attrs[:n] = old[6][:n]
+
+    def _write_row(self, i: int, masp: int, price, category, stock, name, mota) -> None:
+        indexed = extract_indexed_attributes(decode_attributes_cached(masp, mota))
+        self.masp[i] = masp
+        self.price[i] = float(price) if price is not None else 0.0
+        self.category[i] = category if category is not None else _NO_CATEGORY
+        self.stock[i] = stock or 0
+        self.name[i] = (name or "").lower()
+        for key in FACET_ATTRIBUTE_KEYS:
+            self.attrs[key][i] = indexed.get(key)
+        # Folded for filtering (parse_attribute_filters folds the query side);
+        # self.attrs keeps the original values for facet labels
+        self.all_attrs[i] = {key: fold_attribute_value(value) for key, value in indexed.items()}
+
+    # ---------- loading / incremental updates ----------
+
+    def rebuild(self, db: Session) -> None:
+        rows = (
+            db.query(SanPham.MaSP, SanPham.GiaSP, SanPham.MaDanhMuc, SanPham.SoLuongTonKho, SanPham.TenSP, SanPham.MoTa)
+            .filter(SanPham.IsDelete == False)
+            .order_by(SanPham.MaSP)
+            .all()
+        )
+        with self._lock:
+            self._allocate(len(rows) * 2)
+            self._pos = {}
+            for i, row in enumerate(rows):
+                self._write_row(i, *row)
+                self._pos[row[0]] = i
+            self._size = len(rows)
+            self._loaded_at = time.monotonic()
+
+    def ensure_fresh(self, db: Session) -> None:
+        if not self._loaded_at or time.monotonic() - self._loaded_at > CATALOG_SNAPSHOT_TTL_SECONDS:
+            self.rebuild(db)
+
+    def invalidate(self) -> None:
+        """Force a full rebuild on the next facet request (after bulk writes)."""
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def upsert_product(self, sp: SanPham) -> None:
+        """Apply one product write; soft-deleted products are removed."""
+        if sp.IsDelete:
+            self.remove_product(sp.MaSP)
+            return
+        with self._lock:
+            if not self._loaded_at:
+                return  # not loaded yet - first facet request will load everything
+            i = self._pos.get(sp.MaSP)
+            if i is None:
+                if self._size == len(self.masp):
+                    self._grow()
+                i = self._size
+                self._size += 1
+                self._pos[sp.MaSP] = i
+            self._write_row(i, sp.MaSP, sp.GiaSP, sp.MaDanhMuc, sp.SoLuongTonKho, sp.TenSP, sp.MoTa)
+            self._resort_if_needed(i)
+
+    def update_stock(self, masp: int, stock: int) -> None:
+        with self._lock:
+            i = self._pos.get(masp)
+            if i is not None:
+                self.stock[i] = stock
+
+    def remove_product(self, masp: int) -> None:
+        with self._lock:
+            i = self._pos.pop(masp, None)
+            if i is None:
+                return
+            last = self._size - 1
+            # Keep rows ordered by MaSP: shift the tail left by one
+            for arr in self._columns():
+                arr[i:last] = arr[i + 1:last + 1]
+            self._size = last
+            for j in range(i, last):
+                self._pos[int(self.masp[j])] = j
+
+    def _columns(self):
+        return [self.masp, self.price, self.category, self.stock, self.name, self.all_attrs, *self.attrs.values()]
+
+    def _resort_if_needed(self, i: int) -> None:
+        # New products get the largest MaSP, so appends normally stay sorted
+        if i > 0 and self.masp[i] < self.masp[i - 1]:
+            order = np.argsort(self.masp[:self._size], kind="stable")
+            for arr in self._columns():
+                arr[:self._size] = arr[:self._size][order]
+            self._pos = {int(m): j for j, m in enumerate(self.masp[:self._size])}
+
+    # ---------- queries ----------
+
+    def search(
+        self,
+        madanhmuc: Optional[int] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        search: Optional[str] = None,
+        attr_filters: Sequence[Tuple[str, str]] = (),
+        offset: int = 0,
+        limit: int = 10,
+    ) -> Dict[str, Any]:
+        """
+        Filter + paginate + facet counts. Each facet is counted with every
+        filter applied except its own (disjunctive faceting), so the UI can
+        show alternatives for the active dimension.
+        """
+        with self._lock:
+            n = self._size
+            full = np.ones(n, dtype=bool)
+
+            category_mask = full if madanhmuc is None else self.category[:n] == madanhmuc
+            price_mask = full.copy()
+            if min_price is not None:
+                price_mask &= self.price[:n] >= min_price
+            if max_price is not None:
+                price_mask &= self.price[:n] <= max_price
+            search_mask = full
+            if search:
+                needle = search.lower()
+                search_mask = np.fromiter((needle in name for name in self.name[:n]), dtype=bool, count=n)
+            attr_masks: Dict[str, np.ndarray] = {}
+            for key, value in attr_filters:
+                mask = np.fromiter((a.get(key) == value for a in self.all_attrs[:n]), dtype=bool, count=n)
+                attr_masks[key] = attr_masks[key] & mask if key in attr_masks else mask
+
+            attr_all = full.copy()
+            for mask in attr_masks.values():
+                attr_all &= mask
+            base = search_mask & attr_all
+            match = base & category_mask & price_mask
+
+            matched_ids = self.masp[:n][match]
+            page_ids = [int(m) for m in matched_ids[offset:offset + limit]]
+
+            # Category facet: all filters except category
+            cat_values, cat_counts = np.unique(self.category[:n][base & price_mask], return_counts=True)
+            categories = {
+                ("none" if int(c) == _NO_CATEGORY else str(int(c))): int(cnt)
+                for c, cnt in zip(cat_values, cat_counts)
+            }
+
+            # Price facet: all filters except price
+            bucket_idx = np.searchsorted(PRICE_BUCKET_EDGES, self.price[:n][base & category_mask], side="right")
+            bucket_counts = np.bincount(bucket_idx, minlength=len(PRICE_BUCKET_LABELS))
+            price_buckets = {label: int(c) for label, c in zip(PRICE_BUCKET_LABELS, bucket_counts)}
+
+            # Attribute facets: all filters except the same attribute key
+            attributes: Dict[str, Dict[str, int]] = {}
+            for key in FACET_ATTRIBUTE_KEYS:
+                mask = search_mask & category_mask & price_mask
+                for other_key, other_mask in attr_masks.items():
+                    if other_key != key:
+                        mask &= other_mask
+                counter = Counter(v for v in self.attrs[key][:n][mask] if v is not None)
+                if counter:
+                    attributes[key] = dict(counter.most_common(FACET_ATTRIBUTE_TOP_N))
+
+            stock = self.stock[:n][match]
+            return {
+                "total": int(match.sum()),
+                "page_ids": page_ids,
+                "facets": {
+                    "categories": categories,
+                    "price_buckets": price_buckets,
+                    "attributes": attributes,
+                    "stock": {"in_stock": int((stock > 0).sum()), "out_of_stock": int((stock <= 0).sum())},
+                },
+            }
+
+
+catalog_snapshot = CatalogSnapshot()
@@ -0,0 +1,153 @@
+# backend/utils/dispatch_planner.py
+"""
+Batch shipper assignment for Processing orders.
+
+Orders are clustered by the district parsed from KhachHang.DiaChiKH, so one
+shipper covers as few districts as possible. Targets come from water-filling
+(shippers below the common load level, counting what they already carry, are
+filled up to it); districts are handed out largest first, each piece to the
+shipper with the most room left (max-heap), and a district is only split
+when it does not fit that room. A run is O(n + (d + m) log m) for n orders,
+d districts and m shippers; `python -m backend.utils.dispatch_planner`
+benchmarks it.
+"""
+
+import heapq
+import re
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+UNKNOWN_DISTRICT = "khac"
+
+# Full prefixes, dotted abbreviations ("Q.1", "H. Củ Chi") and "Q 10" / "TP Thủ Đức"
+_DISTRICT_PATTERNS = [
+    re.compile(r"^(quan|huyen|thi xa|thanh pho)\b\.?\s*(.+)$"),
+    re.compile(r"^(q|h|tx|tp)\.\s*(.+)$"),
+    re.compile(r"^(q|tx|tp)\s+(.+)$"),
+    re.compile(r"^(q)(\d+)$"),
+]
+_DISTRICT_PREFIX = {"q": "quan", "h": "huyen", "tx": "thi xa", "tp": "thanh pho"}
+# Province-level cities; "TP Thu Duc" style district cities are kept
+_PROVINCE_CITIES = {"hcm", "ho chi minh", "ha noi", "hn", "da nang", "hai phong", "can tho"}
+
+
+def _fold(text: str) -> str:
+    """Lowercase, strip Vietnamese diacritics and collapse whitespace."""
+    text = unicodedata.normalize("NFD", text.lower().replace("đ", "d"))
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+@lru_cache(maxsize=50_000)
+def parse_district(address: Optional[str]) -> str:
+    """
+    District key of a free-text address, e.g. "12 Lê Lợi, P. Bến Nghé, Q.1, TP.HCM"
+    and "Quận 1, Hồ Chí Minh" both give "quan 1". Unparseable addresses give
+    UNKNOWN_DISTRICT.
+    """
+    if not address:
+        return UNKNOWN_DISTRICT
+    segments = [part.strip() for part in _fold(address).split(",") if part.strip()]
+    for segment in reversed(segments):
+        for pattern in _DISTRICT_PATTERNS:
+            match = pattern.match(segment)
+            if match:
+                break
+        else:
+            continue
+        prefix = _DISTRICT_PREFIX.get(match.group(1), match.group(1))
+        name = match.group(2).strip(" .")
+        if prefix == "thanh pho" and name in _PROVINCE_CITIES:
+            continue
+        return f"{prefix} {name}"
+    # No explicit district: the segment before the province is the best guess
+    if len(segments) >= 3:
+        return segments[-2]
+    return UNKNOWN_DISTRICT
+
+
+def plan_assignments(
+    orders: Iterable[Tuple[int, Optional[str]]],
+    shipper_ids: Sequence[int],
+    current_load: Optional[Dict[int, int]] = None,
+) -> Dict[int, List[Tuple[str, List[int]]]]:
+    """
+    Assign (MaDonHang, DiaChiKH) pairs to shippers.
+
+    current_load holds orders each shipper already carries and is counted
+    when balancing. Returns MaShipper -> [(district, [MaDonHang, ...]), ...];
+    every shipper appears, possibly with an empty list.
+    """
+    plan: Dict[int, List[Tuple[str, List[int]]]] = {shipper_id: [] for shipper_id in shipper_ids}
+    if not shipper_ids:
+        return plan
+    current_load = current_load or {}
+
+    clusters: Dict[str, List[int]] = defaultdict(list)
+    total = 0
+    for order_id, address in orders:
+        clusters[parse_district(address)].append(order_id)
+        total += 1
+    if not total:
+        return plan
+
+    # Water-filling: shippers below the common level are filled up to it (the
+    # remainder goes one each to the least loaded); busier shippers get nothing
+    by_load = sorted(shipper_ids, key=lambda shipper_id: (current_load.get(shipper_id, 0), shipper_id))
+    loads = [current_load.get(shipper_id, 0) for shipper_id in by_load]
+    filled = len(by_load)
+    while filled > 1 and (total + sum(loads[:filled])) // filled < loads[filled - 1]:
+        filled -= 1
+    level, remainder = divmod(total + sum(loads[:filled]), filled)
+    targets = {shipper_id: level + (1 if i < remainder else 0) for i, shipper_id in enumerate(by_load[:filled])}
+    # Max-heap on remaining room; MaShipper breaks ties deterministically
+    heap = [
+        (-max(0, targets.get(shipper_id, 0) - current_load.get(shipper_id, 0)), shipper_id)
+        for shipper_id in shipper_ids
+    ]
+    heapq.heapify(heap)
+
+    # Largest district first; each piece goes to the shipper with the most room,
+    # so a district is split only when it exceeds that room
+    for district, order_ids in sorted(clusters.items(), key=lambda item: (-len(item[1]), item[0])):
+        order_ids.sort()
+        taken = 0
+        while taken < len(order_ids):
+            room, shipper_id = heapq.heappop(heap)
+            # Rooms add up to the order count; the guard only protects against a stall
+            size = min(-room, len(order_ids) - taken) if room < 0 else 1
+            plan[shipper_id].append((district, order_ids[taken:taken + size]))
+            taken += size
+            heapq.heappush(heap, (room + size, shipper_id))
+    return plan
+
+
+def _benchmark(order_counts: Sequence[int] = (1_000, 5_000, 20_000), shippers: int = 50) -> None:
+    import random
+    import time
+
+    districts = [f"Quận {i}" for i in range(1, 13)] + ["Huyện Bình Chánh", "TP Thủ Đức", "Q. Gò Vấp"]
+    rng = random.Random(42)
+    for count in order_counts:
+        orders = [
+            (order_id, f"{rng.randint(1, 999)} Đường {rng.randint(1, 50)}, Phường {rng.randint(1, 20)}, "
+                       f"{rng.choice(districts)}, TP.HCM")
+            for order_id in range(1, count + 1)
+        ]
+        shipper_ids = list(range(1, shippers + 1))
+        load = {shipper_id: rng.randint(0, 5) for shipper_id in shipper_ids}
+        started = time.perf_counter()
+        plan = plan_assignments(orders, shipper_ids, load)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        loads = [load[s] + sum(len(c) for _, c in plan[s]) for s in shipper_ids]
+        print(
+            f"{count:>6} orders / {shippers} shippers: {elapsed_ms:8.2f} ms, "
+            f"load min/max {min(loads)}/{max(loads)}, "
+            f"max districts per shipper {max(len(plan[s]) for s in shipper_ids)}"
+        )
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,127 @@
+# backend/utils/http_cache.py
+"""
+ETag / conditional GET support for read-heavy catalog endpoints.
+
+Every cached table has an in-process version counter that is bumped
+whenever rows of that table are inserted, updated or deleted (including ORM
+bulk UPDATE/DELETE). SQLAlchemy events collect the touched tables on the
+session and the versions are bumped after that session commits, so a GET
+running between flush and commit cannot pair the new ETag with old data.
+Core UPDATEs fire no ORM events: callers report them with mark_table_changed().
+A strong ETag is derived from
+the versions of the tables a route reads plus the request path and query
+string, so an If-None-Match hit can be answered with 304 before any
+query or serialization runs.
+
+Counters live in process memory (with a per-boot id in the ETag), which
+matches the single uvicorn worker this backend runs with.
+"""
+
+import hashlib
+import os
+import threading
+import uuid
+from typing import Dict, Iterable, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend.models import DanhMuc, SanPham, SanPham_ThuocTinh
+
+# Cache-Control per route; override with env CACHE_CONTROL_<ROUTE> (e.g. CACHE_CONTROL_SANPHAM_LIST)
+ROUTE_CACHE_CONTROL: Dict[str, str] = {
+    "danhmuc_list": "public, max-age=60",
+    "sanpham_list": "public, no-cache",
+    "sanpham_detail": "public, no-cache",
+}
+
+_BOOT_ID = uuid.uuid4().hex[:8]
+_versions_lock = threading.Lock()
+_TABLE_VERSIONS: Dict[str, int] = {}
+
+
+def bump_table_version(table: str) -> None:
+    with _versions_lock:
+        _TABLE_VERSIONS[table] = _TABLE_VERSIONS.get(table, 0) + 1
+
+
+def get_table_version(table: str) -> int:
+    return _TABLE_VERSIONS.get(table, 0)
+
+
+def get_cache_control(route: str) -> str:
+    return os.getenv(f"CACHE_CONTROL_{route.upper()}", ROUTE_CACHE_CONTROL.get(route, "no-cache"))
+
+
+def build_etag(request: Request, tables: Iterable[str]) -> str:
+    versions = "-".join(f"{get_table_version(t)}" for t in tables)
+    resource = hashlib.blake2b(
+        f"{request.url.path}?{request.url.query}".encode("utf-8"), digest_size=6
+    ).hexdigest()
+    return f'"{_BOOT_ID}-{versions}-{resource}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def conditional_get(request: Request, response: Response, route: str, tables: Iterable[str]) -> Optional[Response]:
+    """
+    Set ETag + Cache-Control on `response`; return a 304 Response when the
+    client's If-None-Match already matches (the route should return it as-is).
+    """
+    etag = build_etag(request, tables)
+    headers = {"ETag": etag, "Cache-Control": get_cache_control(route)}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+# =====================================================
+# Version bumps from ORM writes (applied on commit)
+# =====================================================
+
+# Session.info key: cached tables written in the current transaction
+CHANGED_TABLES_KEY = "http_cache.changed_tables"
+
+
+def mark_table_changed(session: Session, table: str) -> None:
+    """Bump `table`'s version when `session` commits (for Core writes that fire no ORM events)."""
+    session.info.setdefault(CHANGED_TABLES_KEY, set()).add(table)
+
+
+def _bump_for_target(mapper, connection, target) -> None:
+    session = Session.object_session(target)
+    if session is None:
+        bump_table_version(mapper.local_table.name)
+    else:
+        mark_table_changed(session, mapper.local_table.name)
+
+
+for _model in (SanPham, DanhMuc, SanPham_ThuocTinh):
+    for _evt in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _evt, _bump_for_target)
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def _bump_for_bulk(context) -> None:
+    mapper = getattr(context, "mapper", None)
+    if mapper is not None:
+        mark_table_changed(context.session, mapper.local_table.name)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_committed_tables(session: Session) -> None:
+    for table in session.info.pop(CHANGED_TABLES_KEY, ()):
+        bump_table_version(table)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_tables(session: Session) -> None:
+    session.info.pop(CHANGED_TABLES_KEY, None)
@@ -0,0 +1,128 @@
+# backend/utils/idempotency.py
+"""
+Idempotency-Key support for non-idempotent POST endpoints (order and
+payment creation).
+
+The first request with a given (scope, user, key) runs the handler and
+stores its successful result for IDEMPOTENCY_TTL_SECONDS; retries with the
+same key get the stored result back without re-running the handler. A
+retry that arrives while the first request is still running waits for it
+(up to IDEMPOTENCY_WAIT_SECONDS). Reusing a key with a different payload is
+rejected with 422. Failed requests are not stored, so they can be retried.
+
+The store is in process memory (bounded to IDEMPOTENCY_MAX_KEYS entries),
+matching the single uvicorn worker this backend runs with.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+IDEMPOTENCY_KEY_MAX_LEN = 255
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "expires_at", "done", "result")
+
+    def __init__(self, fingerprint: str, expires_at: float):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.done = threading.Event()
+        self.result: Any = None
+
+
+_store_lock = threading.Lock()
+_STORE: "OrderedDict[Tuple[str, str, str], _Entry]" = OrderedDict()
+
+
+def request_fingerprint(payload: Any) -> str:
+    encoded = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _evict(now: float) -> None:
+    """Drop expired entries (oldest first) and keep the store bounded. Caller holds the lock."""
+    while _STORE:
+        key, entry = next(iter(_STORE.items()))
+        if entry.expires_at > now and len(_STORE) <= IDEMPOTENCY_MAX_KEYS:
+            break
+        if not entry.done.is_set() and entry.expires_at > now:
+            break  # never evict a request that is still running
+        _STORE.popitem(last=False)
+
+
+def run_idempotent(
+    scope: str,
+    key: Optional[str],
+    current_user: Optional[Dict],
+    payload: Any,
+    handler: Callable[[], Any],
+) -> Tuple[Any, bool]:
+    """
+    Run `handler` at most once per (scope, user, key).
+    Returns (result, replayed). Without a key the handler simply runs.
+    """
+    if not key:
+        return handler(), False
+    if len(key) > IDEMPOTENCY_KEY_MAX_LEN:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{IDEMPOTENCY_HEADER} dài tối đa {IDEMPOTENCY_KEY_MAX_LEN} ký tự"
+        )
+
+    owner = str((current_user or {}).get("user_id") or (current_user or {}).get("username") or "anonymous")
+    store_key = (scope, owner, key)
+    fingerprint = request_fingerprint(payload)
+
+    with _store_lock:
+        now = time.monotonic()
+        _evict(now)
+        entry = _STORE.get(store_key)
+        if entry is not None and entry.expires_at <= now:
+            del _STORE[store_key]
+            entry = None
+        is_owner = entry is None
+        if is_owner:
+            entry = _STORE[store_key] = _Entry(fingerprint, now + IDEMPOTENCY_TTL_SECONDS)
+
+    if not is_owner:
+        if entry.fingerprint != fingerprint:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"{IDEMPOTENCY_HEADER} đã được dùng cho một yêu cầu khác"
+            )
+        if not entry.done.wait(IDEMPOTENCY_WAIT_SECONDS):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Yêu cầu với cùng Idempotency-Key đang được xử lý"
+            )
+        with _store_lock:
+            stored = _STORE.get(store_key) is entry
+        if not stored:
+            # First attempt failed and was discarded - run this one instead
+            return run_idempotent(scope, key, current_user, payload, handler)
+        return entry.result, True
+
+    try:
+        result = handler()
+    except BaseException:
+        with _store_lock:
+            if _STORE.get(store_key) is entry:
+                del _STORE[store_key]
+        entry.done.set()
+        raise
+    entry.result = result
+    entry.done.set()
+    return result, False
@@ -11,8 +11,11 @@
 # =====================================================
 
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 from backend.models import DonHang, DonHang_SanPham, SanPham
+from backend.utils.http_cache import mark_table_changed
+from backend.utils.low_stock import low_stock_tracker
+from backend.utils.stock_ledger import REASON_ADJUST, movement, record_movements
 from typing import List, Dict, Tuple, Optional
 import logging
 
@@ -125,54 +128,42 @@ class InventoryManager:
             
             # ORDER FLOW STEP 6.1.3: Process inventory changes for each order item
             # Loop through all items in the order and update their stock
+            sign = InventoryManager.STOCK_SIGN[action]
+            movements = []
             for item in order_items:
                 product = db.query(SanPham).filter(SanPham.MaSP == item.MaSP).first()
                 if not product:
                     raise InventoryError(f"Product {item.MaSP} not found")
                 
-                if action == "reserve":
-                    # ORDER FLOW STEP 6.1.4: Reserve stock (subtract from available)
-                    # Used when order moves from Pending to Confirmed/Processing
-                    # Stock is reserved but not yet deducted (can be released if order cancelled)
+                if action in ("reserve", "confirm"):
+                    # ORDER FLOW STEP 6.1.4: Reserve / confirm stock (subtract from available)
+                    # reserve: order moves from Pending to Confirmed/Processing
+                    # confirm: order created with "Chờ thanh toán" status and
+                    # inventory wasn't reserved initially
                     if product.SoLuongTonKho < item.SoLuong:
                         raise InventoryError(
                             f"Insufficient stock for product {product.TenSP}. "
                             f"Available: {product.SoLuongTonKho}, Required: {item.SoLuong}"
                         )
-                    product.SoLuongTonKho -= item.SoLuong
-                    
-                elif action == "release":
-                    # ORDER FLOW STEP 6.1.5: Release stock (add back to available)
-                    # Used when order is cancelled or returned
-                    # Restores stock that was previously reserved/deducted
-                    product.SoLuongTonKho += item.SoLuong
-                    
-                elif action == "confirm":
-                    # ORDER FLOW STEP 6.1.6: Deduct stock when order is confirmed
-                    # This handles cases where order was created with "Chờ thanh toán" status
-                    # and inventory wasn't reserved initially
-                    # Check if stock was already deducted (in case order was created with Pending status)
-                    # We need to deduct stock if it hasn't been deducted yet
-                    if product.SoLuongTonKho < item.SoLuong:
-                        raise InventoryError(
-                            f"Insufficient stock for product {product.TenSP}. "
-                            f"Available: {product.SoLuongTonKho}, Required: {item.SoLuong}"
-                        )
-                    product.SoLuongTonKho -= item.SoLuong
-                    
-                elif action == "cancel":
-                    # ORDER FLOW STEP 6.1.7: Cancel order (restore stock)
-                    # Only restore if stock was actually deducted
-                    # This releases reserved/deducted stock back to available inventory
-                    product.SoLuongTonKho += item.SoLuong
+                # ORDER FLOW STEP 6.1.5: release / cancel add the quantity back
+                # (order cancelled or returned after stock was deducted)
+                
+                # Delta applied in SQL (no read-modify-write); the guard re-checks
+                # stock at write time in case another order took it meanwhile
+                InventoryManager.apply_stock_delta(db, product, sign * item.SoLuong)
+                movements.append(movement(item.MaSP, sign * item.SoLuong, action, "DonHang", order_id))
                 
-                # Log the inventory change
+                # Log the inventory change (the delta: SoLuongTonKho was expired by
+                # apply_stock_delta and reading it would cost a SELECT per item)
                 logging.info(
                     f"Inventory change for product {product.TenSP} (ID: {product.MaSP}): "
                     f"Action: {action}, Quantity: {item.SoLuong}, "
-                    f"New stock: {product.SoLuongTonKho}"
+                    f"Delta: {sign * item.SoLuong:+d}"
                 )
             
+            # History of every stock change (append-only, same transaction)
+            record_movements(db, movements)
+            
             # Note: Don't update order.TrangThai here - the calling function handles it
             # Note: Don't commit here - the calling function will commit after all operations
             
@@ -237,6 +228,263 @@ class InventoryManager:
         else:
             return "none"
     
+    # Direction of the stock change for each inventory action
+    STOCK_SIGN = {"reserve": -1, "confirm": -1, "release": 1, "cancel": 1}
+
+    @staticmethod
+    def handle_bulk_inventory_change(
+        db: Session,
+        old_statuses: Dict[int, str],
+        new_status: str
+    ) -> Dict[int, Tuple[bool, str, str]]:
+        """
+        Set-based version of handle_inventory_change for many orders moving to
+        the same status.
+        
+        Items of all orders are loaded with one query, the affected products are
+        locked with one SELECT ... FOR UPDATE, stock is checked order by order
+        against the running balance (an order that does not fit fails on its own
+        without blocking the others), and the net change per product is written
+        with one executemany UPDATE.
+        
+        Args:
+            db: Database session (transaction context; caller commits)
+            old_statuses: MaDonHang -> current status
+            new_status: Target status
+            
+        Returns:
+            Dict[int, Tuple[bool, str, str]]: MaDonHang -> (success, message, action)
+        """
+        normalized_new_status = InventoryManager._normalize_status(new_status)
+        actions = {
+            order_id: InventoryManager._determine_inventory_action(
+                InventoryManager._normalize_status(old_status) if old_status else None,
+                normalized_new_status,
+            )
+            for order_id, old_status in old_statuses.items()
+        }
+        
+        items_by_order: Dict[int, Dict[int, int]] = {order_id: {} for order_id in old_statuses}
+        if old_statuses:
+            rows = db.query(
+                DonHang_SanPham.MaDonHang, DonHang_SanPham.MaSP, DonHang_SanPham.SoLuong
+            ).filter(DonHang_SanPham.MaDonHang.in_(list(old_statuses))).all()
+            for order_id, masp, soluong in rows:
+                items = items_by_order[order_id]
+                items[masp] = items.get(masp, 0) + (soluong or 0)
+        
+        moving = [order_id for order_id, action in actions.items() if action != "none" and items_by_order[order_id]]
+        products = InventoryManager.lock_products(
+            db, [masp for order_id in moving for masp in items_by_order[order_id]]
+        )
+        stock = {masp: product.SoLuongTonKho or 0 for masp, product in products.items()}
+        deltas: Dict[int, int] = {}
+        movements = []
+        
+        results: Dict[int, Tuple[bool, str, str]] = {}
+        for order_id in sorted(old_statuses):
+            action = actions[order_id]
+            items = items_by_order[order_id]
+            if not items:
+                results[order_id] = (False, f"No items found for order {order_id}", action)
+                continue
+            if action == "none":
+                results[order_id] = (True, "No inventory change required", action)
+                continue
+            
+            sign = InventoryManager.STOCK_SIGN[action]
+            error = None
+            for masp, quantity in items.items():
+                if masp not in stock:
+                    error = f"Product {masp} not found"
+                    break
+                if sign < 0 and stock[masp] < quantity:
+                    error = (
+                        f"Insufficient stock for product {products[masp].TenSP}. "
+                        f"Available: {stock[masp]}, Required: {quantity}"
+                    )
+                    break
+            if error:
+                results[order_id] = (False, error, action)
+                continue
+            
+            for masp, quantity in items.items():
+                stock[masp] += sign * quantity
+                deltas[masp] = deltas.get(masp, 0) + sign * quantity
+                movements.append(movement(masp, sign * quantity, action, "DonHang", order_id))
+            results[order_id] = (True, f"Inventory updated successfully for order {order_id}", action)
+        
+        changes = [{"b_masp": masp, "b_delta": delta} for masp, delta in deltas.items() if delta]
+        if changes:
+            table = SanPham.__table__
+            db.execute(
+                table.update()
+                .where(table.c.MaSP == bindparam("b_masp"))
+                .values(SoLuongTonKho=table.c.SoLuongTonKho + bindparam("b_delta")),
+                changes,
+            )
+            # Locked ORM rows still hold the old stock
+            for change in changes:
+                db.expire(products[change["b_masp"]], ["SoLuongTonKho"])
+            # Core UPDATE fires no ORM events: catalog ETag bumps on commit
+            mark_table_changed(db, "SanPham")
+            record_movements(db, movements)
+            logging.info(f"Bulk inventory change to {new_status}: {len(changes)} products updated")
+        
+        return results
+    
+    @staticmethod
+    def apply_stock_delta(db: Session, product: SanPham, delta: int) -> None:
+        """
+        Add `delta` to a product's stock with one UPDATE computed in SQL.
+        A negative delta only applies while stock stays >= 0, otherwise
+        InventoryError is raised. The ORM attribute is refreshed afterwards and
+        the catalog ETag (http_cache) is bumped when the transaction commits.
+        """
+        table = SanPham.__table__
+        stmt = table.update().where(table.c.MaSP == product.MaSP)
+        if delta < 0:
+            stmt = stmt.where(table.c.SoLuongTonKho >= -delta)
+        result = db.execute(stmt.values(SoLuongTonKho=table.c.SoLuongTonKho + delta))
+        mark_table_changed(db, "SanPham")
+        if result.rowcount == 0:
+            db.expire(product, ["SoLuongTonKho"])
+            raise InventoryError(
+                f"Insufficient stock for product {product.TenSP}. "
+                f"Available: {product.SoLuongTonKho}, Required: {-delta}"
+            )
+        db.expire(product, ["SoLuongTonKho"])
+
+    @staticmethod
+    def bulk_adjust_stock(
+        db: Session,
+        adjustments: List[Dict],
+        user_id: Optional[int] = None,
+        ref_id: Optional[str] = None
+    ) -> Tuple[Dict[int, int], int, List[Tuple[int, int, str]]]:
+        """
+        Stock-take: set or shift the stock of many products in one transaction.
+
+        The products are locked with one SELECT ... FOR UPDATE, each row's delta
+        is computed against the locked stock (absolute rows become
+        counted - current), the changes are written with one executemany UPDATE
+        and the ledger rows with one executemany INSERT (Reason "adjust",
+        RefType "StockTake"). The catalog ETag is bumped when the caller commits.
+
+        Args:
+            db: Database session (transaction context; caller commits)
+            adjustments: [{row, MaSP, delta}] or [{row, MaSP, absolute}], one row per MaSP
+            user_id: Account making the stock-take (ledger UserId)
+            ref_id: Stock-take reference (ledger RefId)
+
+        Returns:
+            Tuple[Dict[int, int], int, List[Tuple[int, int, str]]]:
+            (MaSP -> new stock of changed products, unchanged row count,
+            [(row, MaSP, error)] of rows that were not applied)
+        """
+        products = InventoryManager.lock_products(db, [item["MaSP"] for item in adjustments])
+        new_stock: Dict[int, int] = {}
+        changes = []
+        movements = []
+        unchanged = 0
+        errors: List[Tuple[int, int, str]] = []
+
+        for item in adjustments:
+            masp = item["MaSP"]
+            product = products.get(masp)
+            if product is None or product.IsDelete:
+                errors.append((item["row"], masp, f"Product {masp} not found"))
+                continue
+            current = product.SoLuongTonKho or 0
+            delta = item["absolute"] - current if "absolute" in item else item["delta"]
+            if current + delta < 0:
+                errors.append((
+                    item["row"], masp,
+                    f"Insufficient stock for product {product.TenSP}. Available: {current}, Required: {-delta}"
+                ))
+                continue
+            if delta == 0:
+                unchanged += 1
+                continue
+            new_stock[masp] = current + delta
+            changes.append({"b_masp": masp, "b_delta": delta})
+            movements.append(movement(masp, delta, REASON_ADJUST, "StockTake", ref_id, user_id))
+
+        if changes:
+            table = SanPham.__table__
+            db.execute(
+                table.update()
+                .where(table.c.MaSP == bindparam("b_masp"))
+                .values(SoLuongTonKho=table.c.SoLuongTonKho + bindparam("b_delta")),
+                changes,
+            )
+            # Locked ORM rows still hold the old stock
+            for change in changes:
+                db.expire(products[change["b_masp"]], ["SoLuongTonKho"])
+            # Core UPDATE fires no ORM events: catalog ETag bumps on commit
+            mark_table_changed(db, "SanPham")
+            record_movements(db, movements)
+            logging.info(f"Stock-take {ref_id}: {len(changes)} products adjusted")
+
+        return new_stock, unchanged, errors
+
+    @staticmethod
+    def get_products_by_ids(
+        db: Session,
+        product_ids: List[int]
+    ) -> Dict[int, Dict]:
+        """
+        Fetch price / stock fields for many products with a single IN query.
+        
+        Args:
+            db: Database session
+            product_ids: Product IDs (duplicates allowed)
+            
+        Returns:
+            Dict[int, Dict]: MaSP -> {MaSP, TenSP, GiaSP, SoLuongTonKho, HinhAnh, IsDelete};
+            missing products are absent from the dict
+        """
+        unique_ids = list(dict.fromkeys(product_ids))
+        if not unique_ids:
+            return {}
+        rows = db.query(
+            SanPham.MaSP,
+            SanPham.TenSP,
+            SanPham.GiaSP,
+            SanPham.SoLuongTonKho,
+            SanPham.HinhAnh,
+            SanPham.IsDelete,
+        ).filter(SanPham.MaSP.in_(unique_ids)).all()
+        return {row.MaSP: row._asdict() for row in rows}
+    
+    @staticmethod
+    def lock_products(
+        db: Session,
+        product_ids: List[int]
+    ) -> Dict[int, SanPham]:
+        """
+        Load many products with one SELECT ... FOR UPDATE.
+        Rows are locked in MaSP order so concurrent callers cannot deadlock.
+        
+        Args:
+            db: Database session (locks are held until the caller commits)
+            product_ids: Product IDs (duplicates allowed)
+            
+        Returns:
+            Dict[int, SanPham]: MaSP -> locked product; missing products are absent
+        """
+        ids = sorted(set(product_ids))
+        if not ids:
+            return {}
+        rows = (
+            db.query(SanPham)
+            .filter(SanPham.MaSP.in_(ids))
+            .order_by(SanPham.MaSP)
+            .with_for_update()
+            .all()
+        )
+        return {product.MaSP: product for product in rows}
+    
     @staticmethod
     def check_stock_availability(
         db: Session, 
@@ -244,6 +492,7 @@ class InventoryManager:
     ) -> Tuple[bool, str, List[Dict]]:
         """
         Check if sufficient stock is available for all items in an order.
+        All products are loaded with one query (get_products_by_ids).
         
         Args:
             db: Database session
@@ -253,19 +502,20 @@ class InventoryManager:
             Tuple[bool, str, List[Dict]]: (is_available, message, insufficient_items)
         """
         insufficient_items = []
+        products = InventoryManager.get_products_by_ids(db, [item["MaSP"] for item in order_items])
         
         for item in order_items:
-            product = db.query(SanPham).filter(SanPham.MaSP == item["MaSP"]).first()
+            product = products.get(item["MaSP"])
             if not product:
                 return False, f"Product {item['MaSP']} not found", []
             
-            if product.SoLuongTonKho < item["SoLuong"]:
+            if product["SoLuongTonKho"] < item["SoLuong"]:
                 insufficient_items.append({
-                    "MaSP": product.MaSP,
-                    "TenSP": product.TenSP,
-                    "Available": product.SoLuongTonKho,
+                    "MaSP": product["MaSP"],
+                    "TenSP": product["TenSP"],
+                    "Available": product["SoLuongTonKho"],
                     "Required": item["SoLuong"],
-                    "Shortage": item["SoLuong"] - product.SoLuongTonKho
+                    "Shortage": item["SoLuong"] - product["SoLuongTonKho"]
                 })
         
         if insufficient_items:
@@ -279,28 +529,24 @@ class InventoryManager:
         threshold: int = 10
     ) -> List[Dict]:
         """
-        Get products with low stock levels.
+        Get products with low stock levels (served from the in-memory low-stock tracker).
         
         Args:
-            db: Database session
+            db: Database session (used only to bring the tracker up to date)
             threshold: Stock threshold for low stock alert
             
         Returns:
-            List[Dict]: List of products with low stock
+            List[Dict]: List of products with low stock, lowest stock first
         """
-        low_stock_products = db.query(SanPham).filter(
-            SanPham.SoLuongTonKho <= threshold,
-            SanPham.IsDelete == False
-        ).all()
-        
+        low_stock_tracker.ensure_fresh(db)
         return [
             {
-                "MaSP": product.MaSP,
-                "TenSP": product.TenSP,
-                "SoLuongTonKho": product.SoLuongTonKho,
-                "GiaSP": float(product.GiaSP) if product.GiaSP else 0
+                "MaSP": item["MaSP"],
+                "TenSP": item["TenSP"],
+                "SoLuongTonKho": item["SoLuongTonKho"],
+                "GiaSP": item["GiaSP"]
             }
-            for product in low_stock_products
+            for item in low_stock_tracker.low_stock(threshold)
         ]
     
     @staticmethod
@@ -308,16 +554,18 @@ class InventoryManager:
         db: Session, 
         product_id: int, 
         quantity_change: int, 
-        operation: str = "add"
+        operation: str = "add",
+        user_id: Optional[int] = None
     ) -> Tuple[bool, str]:
         """
-        Update product stock quantity.
+        Update product stock quantity (manual adjustment, recorded in the stock ledger).
         
         Args:
             db: Database session
             product_id: Product ID
             quantity_change: Amount to change
             operation: "add" or "subtract"
+            user_id: Account making the adjustment (ledger UserId)
             
         Returns:
             Tuple[bool, str]: (success, message)
@@ -331,21 +579,25 @@ class InventoryManager:
                 return False, f"Product {product_id} not found"
             
             if operation == "add":
-                product.SoLuongTonKho += quantity_change
+                delta = quantity_change
             elif operation == "subtract":
                 if product.SoLuongTonKho < quantity_change:
                     return False, f"Insufficient stock. Available: {product.SoLuongTonKho}, Required: {quantity_change}"
-                product.SoLuongTonKho -= quantity_change
+                delta = -quantity_change
             else:
                 return False, "Invalid operation. Use 'add' or 'subtract'"
             
             # Ensure stock doesn't go negative
-            if product.SoLuongTonKho < 0:
-                product.SoLuongTonKho = 0
+            delta = max(delta, -(product.SoLuongTonKho or 0))
             
+            InventoryManager.apply_stock_delta(db, product, delta)
+            record_movements(db, [movement(product_id, delta, REASON_ADJUST, user_id=user_id)])
             db.commit()
             return True, f"Stock updated successfully. New quantity: {product.SoLuongTonKho}"
             
+        except InventoryError as e:
+            db.rollback()
+            return False, str(e)
         except Exception as e:
             db.rollback()
             return False, f"Error updating stock: {str(e)}"
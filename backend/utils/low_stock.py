@@ -0,0 +1,259 @@
+# backend/utils/low_stock.py
+"""
+In-memory low-stock tracker with push notifications.
+
+Stock of every active product is held in memory with a (stock, MaSP) sorted
+index, so "products at or below N" is a bisect and a slice for any N. The
+configured threshold (SystemConfig LOW_STOCK_THRESHOLD) is cached with it.
+
+Every stock mutation goes through stock_ledger.record_movements(), which
+remembers the touched MaSP on the session; after that session commits, the
+products are marked changed and a background thread reloads just those rows
+(one IN query). Products crossing the configured threshold, or changing
+while below it, are pushed to subscribers (SSE on /api/alerts/low-stock/stream).
+A full reload every LOW_STOCK_RESYNC_SECONDS catches writes made by other
+workers.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from bisect import bisect_right, insort
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend.database import SessionLocal
+from backend.models import SanPham, SystemConfig
+from backend.utils.stock_ledger import TOUCHED_PRODUCTS_KEY
+
+LOW_STOCK_THRESHOLD_KEY = "LOW_STOCK_THRESHOLD"
+LOW_STOCK_DEFAULT_THRESHOLD = 5
+LOW_STOCK_RESYNC_SECONDS = int(os.getenv("LOW_STOCK_RESYNC_SECONDS", "300"))
+# Events buffered per subscriber; a subscriber that falls this far behind is dropped
+LOW_STOCK_SUBSCRIBER_QUEUE_SIZE = 1000
+# Last item put on a dropped subscriber's queue: the SSE stream ends so the
+# client reconnects and starts again from a fresh snapshot
+SUBSCRIPTION_CLOSED = None
+
+EVENT_ENTERED = "low_stock.entered"
+EVENT_UPDATED = "low_stock.updated"
+EVENT_CLEARED = "low_stock.cleared"
+
+_tracker_started = False
+
+
+def _load_threshold(db: Session) -> int:
+    cfg = db.query(SystemConfig).filter(SystemConfig.ConfigKey == LOW_STOCK_THRESHOLD_KEY).first()
+    try:
+        return int(cfg.ConfigValue) if cfg and cfg.ConfigValue is not None else LOW_STOCK_DEFAULT_THRESHOLD
+    except ValueError:
+        return LOW_STOCK_DEFAULT_THRESHOLD
+
+
+class LowStockTracker:
+    """MaSP -> (TenSP, stock, GiaSP) of active products + (stock, MaSP) sorted index."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Held across read + apply + publish so an older read can't overwrite a newer one
+        self._refresh_lock = threading.RLock()
+        self._loaded_at = 0.0
+        self._stale = False
+        self._threshold = LOW_STOCK_DEFAULT_THRESHOLD
+        self._products: Dict[int, Tuple[Optional[str], int, float]] = {}
+        self._by_stock: List[Tuple[int, int]] = []
+        self._pending: Set[int] = set()
+        self._wake = threading.Event()
+        self._subscribers: Dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}
+
+    # ---------- loading / incremental updates ----------
+
+    def rebuild(self, db: Session) -> None:
+        with self._refresh_lock:
+            threshold = _load_threshold(db)
+            rows = (
+                db.query(SanPham.MaSP, SanPham.TenSP, SanPham.SoLuongTonKho, SanPham.GiaSP)
+                .filter(SanPham.IsDelete == False)
+                .all()
+            )
+            products = {masp: (name, stock or 0, float(price or 0)) for masp, name, stock, price in rows}
+            with self._lock:
+                old_products, old_threshold = self._products, self._threshold
+                self._products = products
+                self._by_stock = sorted((entry[1], masp) for masp, entry in products.items())
+                self._threshold = threshold
+                self._pending.clear()
+                self._stale = False
+                first_load = not self._loaded_at
+                self._loaded_at = time.monotonic()
+            if not first_load:
+                self._publish_changes(set(old_products) | set(products), old_products, old_threshold)
+
+    def refresh(self, db: Session, product_ids: Iterable[int]) -> None:
+        """Reload a few products (after a stock mutation) and publish threshold crossings."""
+        ids = set(product_ids)
+        if not ids:
+            return
+        with self._refresh_lock:
+            rows = (
+                db.query(SanPham.MaSP, SanPham.TenSP, SanPham.SoLuongTonKho, SanPham.GiaSP)
+                .filter(SanPham.MaSP.in_(ids), SanPham.IsDelete == False)
+                .all()
+            )
+            fresh = {masp: (name, stock or 0, float(price or 0)) for masp, name, stock, price in rows}
+            with self._lock:
+                old_products = {masp: self._products[masp] for masp in ids if masp in self._products}
+                for masp in ids:
+                    old = self._products.pop(masp, None)
+                    if old is not None:
+                        self._by_stock.remove((old[1], masp))
+                    entry = fresh.get(masp)
+                    if entry is not None:
+                        self._products[masp] = entry
+                        insort(self._by_stock, (entry[1], masp))
+            self._publish_changes(ids, old_products, self._threshold)
+
+    def mark_changed(self, product_ids: Iterable[int]) -> None:
+        """Queue products for reload by the tracker thread (call after commit)."""
+        with self._lock:
+            self._pending.update(product_ids)
+        self._wake.set()
+
+    def invalidate(self) -> None:
+        """Full reload by the tracker thread (threshold changed)."""
+        self._stale = True
+        self._wake.set()
+
+    def ensure_fresh(self, db: Session) -> None:
+        with self._refresh_lock:
+            if self._stale or not self._loaded_at or time.monotonic() - self._loaded_at > LOW_STOCK_RESYNC_SECONDS:
+                self.rebuild(db)
+                return
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            self.refresh(db, pending)
+
+    # ---------- queries ----------
+
+    @property
+    def threshold(self) -> int:
+        return self._threshold
+
+    def _item(self, masp: int, entry, threshold: int) -> Dict[str, Any]:
+        name, stock, price = entry
+        return {"MaSP": masp, "TenSP": name, "SoLuongTonKho": stock, "GiaSP": price, "Threshold": threshold}
+
+    def low_stock(self, threshold: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Active products with stock <= threshold (default: configured), lowest stock first."""
+        threshold = self._threshold if threshold is None else threshold
+        with self._lock:
+            end = bisect_right(self._by_stock, (threshold, float("inf")))
+            return [self._item(masp, self._products[masp], threshold) for _, masp in self._by_stock[:end]]
+
+    # ---------- push ----------
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue of events for the calling event loop (an SSE connection)."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=LOW_STOCK_SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def _publish_changes(self, ids: Iterable[int], old_products: Dict, old_threshold: int) -> None:
+        events = []
+        with self._lock:
+            threshold = self._threshold
+            for masp in sorted(ids):
+                old = old_products.get(masp)
+                new = self._products.get(masp)
+                was_low = old is not None and old[1] <= old_threshold
+                is_low = new is not None and new[1] <= threshold
+                if is_low and not was_low:
+                    events.append({"type": EVENT_ENTERED, **self._item(masp, new, threshold)})
+                elif was_low and not is_low:
+                    entry = new or old
+                    events.append({"type": EVENT_CLEARED, **self._item(masp, entry, threshold)})
+                elif is_low and (old[1] != new[1] or old_threshold != threshold):
+                    events.append({"type": EVENT_UPDATED, **self._item(masp, new, threshold)})
+            subscribers = list(self._subscribers.items())
+        for event_data in events:
+            for queue, loop in subscribers:
+                loop.call_soon_threadsafe(self._deliver, queue, event_data)
+
+    def _deliver(self, queue: asyncio.Queue, event_data: Dict[str, Any]) -> None:
+        with self._lock:
+            if queue not in self._subscribers:
+                return
+        try:
+            queue.put_nowait(event_data)
+        except asyncio.QueueFull:
+            logging.warning("Low-stock subscriber is not reading events; dropping it")
+            self.unsubscribe(queue)
+            # Buffered events are stale once one is lost; make room for the close marker
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(SUBSCRIPTION_CLOSED)
+
+
+low_stock_tracker = LowStockTracker()
+
+
+# =====================================================
+# Session hooks
+# =====================================================
+
+@event.listens_for(Session, "after_commit")
+def _mark_committed_stock_changes(session: Session) -> None:
+    touched = session.info.pop(TOUCHED_PRODUCTS_KEY, None)
+    if touched:
+        low_stock_tracker.mark_changed(touched)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_stock_changes(session: Session) -> None:
+    session.info.pop(TOUCHED_PRODUCTS_KEY, None)
+
+
+# =====================================================
+# Tracker thread
+# =====================================================
+
+def _tracker_loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        low_stock_tracker._wake.wait(LOW_STOCK_RESYNC_SECONDS)
+        low_stock_tracker._wake.clear()
+        if stop.is_set():
+            break
+        db = SessionLocal()
+        try:
+            low_stock_tracker.ensure_fresh(db)
+        except Exception as e:
+            db.rollback()
+            logging.error(f"Low-stock tracker refresh failed: {str(e)}")
+        finally:
+            db.close()
+
+
+def start_low_stock_tracker() -> Optional[threading.Event]:
+    """Start the tracker thread once; returns its stop event."""
+    global _tracker_started
+    if _tracker_started:
+        return None
+    _tracker_started = True
+    stop = threading.Event()
+    threading.Thread(target=_tracker_loop, args=(stop,), name="low-stock-tracker", daemon=True).start()
+    return stop
+
+
+def stop_low_stock_tracker(stop: Optional[threading.Event]) -> None:
+    if stop is not None:
+        stop.set()
+        low_stock_tracker._wake.set()
@@ -0,0 +1,239 @@
+# backend/utils/order_archive.py
+"""
+Archival of closed orders.
+
+Delivered/Cancelled orders older than ORDER_ARCHIVE_MONTHS are moved, with
+their lines and payments, from DonHang / DonHang_SanPham / ThanhToan /
+PaymentTransaction into the matching *_Archive tables (INSERT ... SELECT then
+DELETE, one transaction per ORDER_ARCHIVE_BATCH_SIZE orders). The cutoff
+date is stored in SystemConfig (ORDER_ARCHIVE_CUTOFF): archived orders were
+all placed before it.
+
+Readers use order_headers() / order_lines(): they return the hot table alone
+and only UNION ALL the archive when the requested range starts before the
+cutoff, so day-to-day queries never touch archived data.
+
+Archive tables are used instead of MySQL range partitions on NgayDat because
+InnoDB does not allow foreign keys on partitioned tables.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+from typing import Dict, Optional, Union
+
+from sqlalchemy import insert, literal, select, union_all
+from sqlalchemy.orm import Session
+
+from backend.database import SessionLocal
+from backend.models import (
+    DonHang,
+    DonHang_Archive,
+    DonHang_SanPham,
+    DonHang_SanPham_Archive,
+    PaymentTransaction,
+    PaymentTransaction_Archive,
+    SystemConfig,
+    ThanhToan,
+    ThanhToan_Archive,
+)
+
+ORDER_ARCHIVE_MONTHS = int(os.getenv("ORDER_ARCHIVE_MONTHS", "12"))
+ORDER_ARCHIVE_BATCH_SIZE = int(os.getenv("ORDER_ARCHIVE_BATCH_SIZE", "1000"))
+# 0 disables the scheduled run (archive on demand via PUT /api/donhang/archive)
+ORDER_ARCHIVE_INTERVAL_HOURS = float(os.getenv("ORDER_ARCHIVE_INTERVAL_HOURS", "0"))
+ARCHIVE_CUTOFF_KEY = "ORDER_ARCHIVE_CUTOFF"
+ARCHIVE_STATUSES = ["Delivered", "Cancelled", "Đã giao", "Đã hủy"]
+# Statuses of archived orders that count as a completed purchase
+ARCHIVED_PURCHASE_STATUSES = ["Delivered", "Đã giao"]
+
+# Child tables moved with their order (copied before the DonHang row is deleted)
+_ARCHIVED_CHILDREN = [
+    (DonHang_SanPham, DonHang_SanPham_Archive),
+    (ThanhToan, ThanhToan_Archive),
+    (PaymentTransaction, PaymentTransaction_Archive),
+]
+
+_CUTOFF_CACHE_SECONDS = 60
+_cutoff_lock = threading.Lock()
+_cutoff_cache = {"value": None, "loaded_at": 0.0}
+_archiver_started = False
+
+
+def archive_cutoff_date(months: int, today: Optional[date] = None) -> date:
+    """First day of the month `months` months before today."""
+    today = today or date.today()
+    month_index = today.year * 12 + today.month - 1 - months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def get_archive_cutoff(db: Session) -> Optional[date]:
+    """Cutoff of the archive (None when nothing was ever archived); cached briefly."""
+    with _cutoff_lock:
+        if time.monotonic() - _cutoff_cache["loaded_at"] < _CUTOFF_CACHE_SECONDS:
+            return _cutoff_cache["value"]
+    cfg = db.query(SystemConfig).filter(SystemConfig.ConfigKey == ARCHIVE_CUTOFF_KEY).first()
+    value = None
+    if cfg and cfg.ConfigValue:
+        try:
+            value = date.fromisoformat(cfg.ConfigValue)
+        except ValueError:
+            logging.warning(f"Invalid {ARCHIVE_CUTOFF_KEY} value: {cfg.ConfigValue}")
+    with _cutoff_lock:
+        _cutoff_cache.update(value=value, loaded_at=time.monotonic())
+    return value
+
+
+def _as_date(value: Union[None, str, date, datetime]) -> Optional[date]:
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def needs_archive(db: Session, start_date: Union[None, str, date, datetime] = None) -> bool:
+    """True when a range starting at start_date (None = unbounded) reaches archived orders."""
+    cutoff = get_archive_cutoff(db)
+    if cutoff is None:
+        return False
+    start = _as_date(start_date)
+    return start is None or start < cutoff
+
+
+# =====================================================
+# Readers
+# =====================================================
+
+_HEADER_COLUMNS = ("MaDonHang", "NgayDat", "TongTien", "TrangThai", "MaKH")
+
+
+def order_headers(db: Session, start_date=None, end_date=None):
+    """
+    Subquery "donhang_all" (MaDonHang, NgayDat, TongTien, TrangThai, MaKH) over
+    DonHang, plus DonHang_Archive only when the range needs it. Date filters
+    are applied inside each branch so both use their NgayDat index.
+    """
+    def branch(model):
+        table = model.__table__
+        stmt = select(*[table.c[name] for name in _HEADER_COLUMNS])
+        if start_date is not None:
+            stmt = stmt.where(table.c.NgayDat >= start_date)
+        if end_date is not None:
+            stmt = stmt.where(table.c.NgayDat <= end_date)
+        return stmt
+
+    if not needs_archive(db, start_date):
+        return branch(DonHang).subquery("donhang_all")
+    return union_all(branch(DonHang), branch(DonHang_Archive)).subquery("donhang_all")
+
+
+def order_lines(db: Session):
+    """Subquery "donhang_sanpham_all" (MaDonHang, MaSP, SoLuong, DonGia, GiamGia) over all orders."""
+    def branch(model):
+        table = model.__table__
+        return select(table.c.MaDonHang, table.c.MaSP, table.c.SoLuong, table.c.DonGia, table.c.GiamGia)
+
+    if not needs_archive(db):
+        return branch(DonHang_SanPham).subquery("donhang_sanpham_all")
+    return union_all(branch(DonHang_SanPham), branch(DonHang_SanPham_Archive)).subquery("donhang_sanpham_all")
+
+
+# =====================================================
+# Archiver
+# =====================================================
+
+def _copy_rows(db: Session, source, target, order_ids, extra: Optional[Dict] = None) -> None:
+    source_table = source.__table__
+    names = [column.name for column in source_table.columns]
+    columns = [source_table.c[name] for name in names]
+    for name, value in (extra or {}).items():
+        names.append(name)
+        columns.append(literal(value, type_=target.__table__.c[name].type))
+    db.execute(
+        insert(target.__table__).from_select(
+            names, select(*columns).where(source_table.c.MaDonHang.in_(order_ids))
+        )
+    )
+
+
+def archive_closed_orders(
+    db: Session,
+    months: int = ORDER_ARCHIVE_MONTHS,
+    batch_size: int = ORDER_ARCHIVE_BATCH_SIZE,
+) -> Dict:
+    """Move closed orders older than `months` to the archive; returns counts and the cutoff."""
+    cutoff = archive_cutoff_date(months)
+    # Publish the cutoff before moving rows so readers union the archive as
+    # soon as any order may be there; it only moves forward
+    previous = get_archive_cutoff(db)
+    if previous is None or cutoff > previous:
+        cfg = db.query(SystemConfig).filter(SystemConfig.ConfigKey == ARCHIVE_CUTOFF_KEY).first()
+        if cfg is None:
+            cfg = SystemConfig(
+                ConfigKey=ARCHIVE_CUTOFF_KEY,
+                Description="Closed orders placed before this date are in the *_Archive tables",
+            )
+            db.add(cfg)
+        cfg.ConfigValue = cutoff.isoformat()
+        cfg.UpdatedAt = datetime.utcnow()
+        db.commit()
+        with _cutoff_lock:
+            _cutoff_cache.update(value=cutoff, loaded_at=time.monotonic())
+
+    archived = 0
+    while True:
+        order_ids = [
+            order_id for (order_id,) in db.query(DonHang.MaDonHang)
+            .filter(DonHang.TrangThai.in_(ARCHIVE_STATUSES), DonHang.NgayDat < cutoff)
+            .order_by(DonHang.MaDonHang)
+            .limit(batch_size)
+            .with_for_update()
+            .all()
+        ]
+        if not order_ids:
+            db.rollback()
+            break
+        try:
+            _copy_rows(db, DonHang, DonHang_Archive, order_ids, {"NgayLuuTru": datetime.utcnow()})
+            for source, target in _ARCHIVED_CHILDREN:
+                _copy_rows(db, source, target, order_ids)
+                db.query(source).filter(source.MaDonHang.in_(order_ids)).delete(synchronize_session=False)
+            db.query(DonHang).filter(DonHang.MaDonHang.in_(order_ids)).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        archived += len(order_ids)
+
+    if archived:
+        logging.info(f"Archived {archived} closed orders placed before {cutoff.isoformat()}")
+    return {"archived_orders": archived, "cutoff": max(cutoff, previous or cutoff).isoformat()}
+
+
+def _archiver_loop(stop: threading.Event) -> None:
+    while not stop.wait(ORDER_ARCHIVE_INTERVAL_HOURS * 3600):
+        db = SessionLocal()
+        try:
+            archive_closed_orders(db)
+        except Exception as e:
+            db.rollback()
+            logging.error(f"Order archiver failed: {str(e)}")
+        finally:
+            db.close()
+
+
+def start_order_archiver() -> Optional[threading.Event]:
+    """Start the scheduled archiver once (when ORDER_ARCHIVE_INTERVAL_HOURS > 0); returns its stop event."""
+    global _archiver_started
+    if _archiver_started or ORDER_ARCHIVE_INTERVAL_HOURS <= 0:
+        return None
+    _archiver_started = True
+    stop = threading.Event()
+    threading.Thread(target=_archiver_loop, args=(stop,), name="order-archiver", daemon=True).start()
+    return stop
@@ -0,0 +1,159 @@
+# backend/utils/order_export.py
+"""
+Streaming order export (CSV / NDJSON) for accounting.
+
+One SELECT joins orders, customers, lines and products, ordered by
+MaDonHang, and is read from a server-side cursor (stream_results +
+yield_per). CSV gets one row per order line; NDJSON gets one object per
+order with its lines nested, grouped on the fly from consecutive rows.
+Archived orders are unioned in only when the date range reaches the
+archive cutoff (see order_archive.py). Memory stays flat regardless of
+export size.
+"""
+
+import csv
+import io
+import json
+from datetime import date
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import select, union_all
+from sqlalchemy.orm import Session
+
+from backend.database import SessionLocal
+from backend.models import (
+    DonHang,
+    DonHang_Archive,
+    DonHang_SanPham,
+    DonHang_SanPham_Archive,
+    KhachHang,
+    SanPham,
+)
+from backend.utils.order_archive import needs_archive
+
+EXPORT_YIELD_PER = 1000
+# Rows serialized per yielded chunk
+EXPORT_CHUNK_ROWS = 200
+SUPPORTED_FORMATS = ("csv", "ndjson")
+
+ORDER_EXPORT_FIELDS = [
+    "MaDonHang", "NgayDat", "TrangThai", "TongTien", "PhiShip", "KhuyenMai",
+    "MaKH", "TenKH", "SdtKH", "MaSP", "TenSP", "SoLuong", "DonGia", "GiamGia",
+]
+
+
+def _branch(order_model, line_model, from_date, to_date, statuses):
+    order = order_model.__table__
+    line = line_model.__table__
+    stmt = (
+        select(
+            order.c.MaDonHang, order.c.NgayDat, order.c.TrangThai, order.c.TongTien,
+            order.c.PhiShip, order.c.KhuyenMai, order.c.MaKH,
+            KhachHang.TenKH, KhachHang.SdtKH,
+            line.c.MaSP, SanPham.TenSP, line.c.SoLuong, line.c.DonGia, line.c.GiamGia,
+        )
+        .select_from(order)
+        .outerjoin(KhachHang.__table__, KhachHang.MaKH == order.c.MaKH)
+        .outerjoin(line, line.c.MaDonHang == order.c.MaDonHang)
+        .outerjoin(SanPham.__table__, SanPham.MaSP == line.c.MaSP)
+    )
+    if from_date is not None:
+        stmt = stmt.where(order.c.NgayDat >= from_date)
+    if to_date is not None:
+        stmt = stmt.where(order.c.NgayDat <= to_date)
+    if statuses:
+        stmt = stmt.where(order.c.TrangThai.in_(statuses))
+    return stmt
+
+
+def _export_rows(
+    db: Session,
+    from_date: Optional[date],
+    to_date: Optional[date],
+    statuses: Optional[List[str]],
+) -> Iterator[Any]:
+    stmt = _branch(DonHang, DonHang_SanPham, from_date, to_date, statuses)
+    if needs_archive(db, from_date):
+        archived = _branch(DonHang_Archive, DonHang_SanPham_Archive, from_date, to_date, statuses)
+        combined = union_all(stmt, archived).subquery("orders_export")
+        stmt = select(combined).order_by(combined.c.MaDonHang, combined.c.MaSP)
+    else:
+        stmt = stmt.order_by(DonHang.MaDonHang, DonHang_SanPham.MaSP)
+    result = db.execute(stmt.execution_options(stream_results=True, yield_per=EXPORT_YIELD_PER))
+    yield from result
+
+
+def _number(value) -> Optional[float]:
+    return float(value) if value is not None else None
+
+
+def _order_dict(row) -> Dict[str, Any]:
+    return {
+        "MaDonHang": row.MaDonHang,
+        "NgayDat": row.NgayDat.isoformat() if row.NgayDat else None,
+        "TrangThai": row.TrangThai,
+        "TongTien": _number(row.TongTien),
+        "PhiShip": _number(row.PhiShip),
+        "KhuyenMai": row.KhuyenMai,
+        "MaKH": row.MaKH,
+        "TenKH": row.TenKH,
+        "SdtKH": row.SdtKH.strip() if row.SdtKH else row.SdtKH,
+    }
+
+
+def _line_dict(row) -> Dict[str, Any]:
+    return {
+        "MaSP": row.MaSP,
+        "TenSP": row.TenSP,
+        "SoLuong": row.SoLuong,
+        "DonGia": _number(row.DonGia),
+        "GiamGia": _number(row.GiamGia),
+    }
+
+
+def stream_order_export(
+    fmt: str,
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    statuses: Optional[List[str]] = None,
+) -> Iterator[bytes]:
+    """
+    Yield CSV / NDJSON chunks of about EXPORT_CHUNK_ROWS rows. The session is
+    opened on first iteration, so a response that is never iterated holds no connection.
+    """
+    db = SessionLocal()
+    try:
+        buffer = io.StringIO()
+        writer = None
+        if fmt == "csv":
+            writer = csv.DictWriter(buffer, fieldnames=ORDER_EXPORT_FIELDS)
+            writer.writeheader()
+        pending = 0
+        current: Optional[Dict[str, Any]] = None
+        for row in _export_rows(db, from_date, to_date, statuses):
+            if writer is not None:
+                line = _line_dict(row) if row.MaSP is not None else {}
+                writer.writerow({**_order_dict(row), **line})
+                pending += 1
+            else:
+                # Rows arrive ordered by MaDonHang: an order is complete when the id changes
+                if current is None or current["MaDonHang"] != row.MaDonHang:
+                    if current is not None:
+                        buffer.write(json.dumps(current, ensure_ascii=False))
+                        buffer.write("\n")
+                        pending += 1
+                    current = {**_order_dict(row), "items": []}
+                if row.MaSP is not None:
+                    current["items"].append(_line_dict(row))
+            if pending >= EXPORT_CHUNK_ROWS:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+        if current is not None:
+            buffer.write(json.dumps(current, ensure_ascii=False))
+            buffer.write("\n")
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+    finally:
+        db.close()
@@ -0,0 +1,244 @@
+# backend/utils/order_search.py
+"""
+In-process customer index for staff order lookup (/api/donhang/search).
+
+Customers (MaKH, TenKH, SdtKH) are held in two sorted key lists: normalized
+phone numbers and diacritic-folded name tokens ("Nguyễn Văn Đức" -> "nguyen",
+"van", "duc"), each paired with MaKH. A prefix lookup is two bisects plus a
+walk over the matching slice, so it stays in the millisecond range no matter
+how many orders exist; the matched MaKH are then resolved to orders through
+idx_donhang_makh_ngaydat. "DH0042"-style codes are parsed to MaDonHang and
+need no index.
+
+The index is loaded on first use and patched by customer writes in this
+process (upsert_customer). Customers created by other workers are picked up
+by a cheap MaKH > last-seen poll every CUSTOMER_SEARCH_POLL_SECONDS, and a
+full rebuild after CUSTOMER_SEARCH_TTL_SECONDS catches edits made elsewhere.
+"""
+
+import os
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from backend.models import KhachHang
+
+CUSTOMER_SEARCH_TTL_SECONDS = int(os.getenv("CUSTOMER_SEARCH_TTL_SECONDS", "1800"))
+CUSTOMER_SEARCH_POLL_SECONDS = float(os.getenv("CUSTOMER_SEARCH_POLL_SECONDS", "5"))
+# Shortest query accepted per kind, so a lookup never walks half the index
+MIN_PHONE_PREFIX_DIGITS = 3
+MIN_NAME_PREFIX_CHARS = 2
+
+_ORDER_CODE = re.compile(r"^\s*dh\s*-?\s*0*(\d{1,10})\s*$", re.IGNORECASE)
+_PHONE_QUERY = re.compile(r"^\s*\+?[\d\s.\-()]+$")
+_KEY_END = "\uffff"
+
+
+def fold_text(text: Optional[str]) -> str:
+    """Lowercase, strip Vietnamese diacritics (đ -> d) and collapse whitespace."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFD", text.lower().replace("đ", "d"))
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def normalize_phone(phone: Optional[str]) -> str:
+    """Digits only; "+84 90..." / "8490..." become "090..."."""
+    if not phone:
+        return ""
+    digits = re.sub(r"\D", "", phone)
+    if phone.strip().startswith("+84") or (digits.startswith("84") and len(digits) >= 11):
+        digits = "0" + digits[2:]
+    return digits
+
+
+def parse_order_code(query: str) -> Optional[int]:
+    """MaDonHang of "DH0042" / "dh-42" / "DH 42", else None."""
+    match = _ORDER_CODE.match(query or "")
+    return int(match.group(1)) if match else None
+
+
+def is_phone_query(query: str) -> bool:
+    return bool(_PHONE_QUERY.match(query or "")) and bool(re.search(r"\d", query))
+
+
+def _name_tokens(name: Optional[str]) -> Tuple[str, ...]:
+    return tuple(dict.fromkeys(re.findall(r"\w+", fold_text(name))))
+
+
+def _entry(name: Optional[str], phone: Optional[str]):
+    # " nguyen van an" contains " van" iff one of its words starts with "van"
+    return (name, phone.strip() if phone else phone, normalize_phone(phone), " " + " ".join(_name_tokens(name)))
+
+
+class CustomerSearchIndex:
+    """Sorted (key, MaKH) lists for phone-prefix and name-token-prefix lookups."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded_at = 0.0
+        self._polled_at = 0.0
+        self._max_makh = 0
+        # MaKH -> (TenKH, SdtKH, phone key, " "-prefixed folded name words)
+        self._customers: Dict[int, Tuple[Optional[str], Optional[str], str, str]] = {}
+        self._phone_keys: List[Tuple[str, int]] = []
+        self._name_keys: List[Tuple[str, int]] = []
+
+    # ---------- loading / incremental updates ----------
+
+    def rebuild(self, db: Session) -> None:
+        rows = db.query(KhachHang.MaKH, KhachHang.TenKH, KhachHang.SdtKH).all()
+        customers = {}
+        phone_keys = []
+        name_keys = []
+        for makh, name, phone in rows:
+            entry = _entry(name, phone)
+            customers[makh] = entry
+            if entry[2]:
+                phone_keys.append((entry[2], makh))
+            name_keys.extend((token, makh) for token in entry[3].split())
+        phone_keys.sort()
+        name_keys.sort()
+        with self._lock:
+            self._customers = customers
+            self._phone_keys = phone_keys
+            self._name_keys = name_keys
+            self._max_makh = max(customers, default=0)
+            self._loaded_at = self._polled_at = time.monotonic()
+
+    def ensure_fresh(self, db: Session) -> None:
+        now = time.monotonic()
+        if not self._loaded_at or now - self._loaded_at > CUSTOMER_SEARCH_TTL_SECONDS:
+            self.rebuild(db)
+            return
+        if now - self._polled_at > CUSTOMER_SEARCH_POLL_SECONDS:
+            rows = (
+                db.query(KhachHang.MaKH, KhachHang.TenKH, KhachHang.SdtKH)
+                .filter(KhachHang.MaKH > self._max_makh)
+                .all()
+            )
+            with self._lock:
+                for makh, name, phone in rows:
+                    self._upsert(makh, name, phone)
+                self._polled_at = now
+
+    def upsert_customer(self, kh: KhachHang) -> None:
+        """Apply one customer create/update (call after commit)."""
+        with self._lock:
+            if not self._loaded_at:
+                return  # not loaded yet - first search loads everything
+            self._upsert(kh.MaKH, kh.TenKH, kh.SdtKH)
+
+    def _upsert(self, makh: int, name: Optional[str], phone: Optional[str]) -> None:
+        old = self._customers.get(makh)
+        entry = _entry(name, phone)
+        if old is not None:
+            if old[2]:
+                _remove_key(self._phone_keys, (old[2], makh))
+            for token in old[3].split():
+                _remove_key(self._name_keys, (token, makh))
+        self._customers[makh] = entry
+        if entry[2]:
+            insort(self._phone_keys, (entry[2], makh))
+        for token in entry[3].split():
+            insort(self._name_keys, (token, makh))
+        self._max_makh = max(self._max_makh, makh)
+
+    # ---------- queries ----------
+
+    def customer(self, makh: Optional[int]) -> Tuple[Optional[str], Optional[str]]:
+        """(TenKH, SdtKH) of a customer, (None, None) when unknown."""
+        with self._lock:
+            entry = self._customers.get(makh)
+        return (entry[0], entry[1]) if entry else (None, None)
+
+    def match_phone(self, prefix: str, limit: int) -> Tuple[List[int], bool]:
+        """MaKH whose phone starts with `prefix`; second value is True when truncated."""
+        key = normalize_phone(prefix)
+        if len(key) < MIN_PHONE_PREFIX_DIGITS:
+            return [], False
+        with self._lock:
+            lo, hi = _prefix_range(self._phone_keys, key)
+            matched = [makh for _, makh in self._phone_keys[lo:min(hi, lo + limit)]]
+        return matched, hi - lo > limit
+
+    def match_name(self, query: str, limit: int) -> Tuple[List[int], bool]:
+        """
+        MaKH whose folded name has, for every query word, a word starting with
+        it ("tran thi" matches "Trần Thị Bích"); True second value when truncated.
+        """
+        words = _name_tokens(query)
+        if not words or len("".join(words)) < MIN_NAME_PREFIX_CHARS:
+            return [], False
+        matched: Dict[int, None] = {}
+        with self._lock:
+            ranges = {word: _prefix_range(self._name_keys, word) for word in words}
+            # Walk the most selective word; check the others against each candidate's name
+            rarest = min(words, key=lambda word: ranges[word][1] - ranges[word][0])
+            others = [" " + word for word in words if word != rarest]
+            customers = self._customers
+            lo, hi = ranges[rarest]
+            for _, makh in self._name_keys[lo:hi]:
+                folded = customers[makh][3]
+                for word in others:
+                    if word not in folded:
+                        break
+                else:
+                    # A prefix can hit two words of one name ("th" -> "thi", "thanh")
+                    matched[makh] = None
+                    if len(matched) > limit:
+                        return list(matched)[:limit], True
+        return list(matched), False
+
+
+def _prefix_range(keys: List[Tuple[str, int]], prefix: str) -> Tuple[int, int]:
+    return bisect_left(keys, (prefix,)), bisect_left(keys, (prefix + _KEY_END,))
+
+
+def _remove_key(keys: List[Tuple[str, int]], key: Tuple[str, int]) -> None:
+    i = bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        del keys[i]
+
+
+customer_search_index = CustomerSearchIndex()
+
+
+def _benchmark(customers: int = 300_000, queries: int = 1_000) -> None:
+    import random
+
+    rng = random.Random(42)
+    families = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng", "Bùi", "Đỗ"]
+    middles = ["Văn", "Thị", "Hữu", "Đức", "Minh", "Ngọc", "Thanh", "Quốc"]
+    givens = ["An", "Bình", "Cường", "Dũng", "Hà", "Hải", "Hạnh", "Hiếu", "Hoa", "Hùng", "Khánh", "Lan",
+              "Linh", "Long", "Mai", "Nam", "Phúc", "Quân", "Sơn", "Tâm", "Thảo", "Trang", "Tuấn", "Vy"]
+    index = CustomerSearchIndex()
+    started = time.perf_counter()
+    with index._lock:
+        for makh in range(1, customers + 1):
+            name = f"{rng.choice(families)} {rng.choice(middles)} {rng.choice(givens)}"
+            index._customers[makh] = (name, None, f"09{rng.randint(0, 99_999_999):08d}", _entry(name, None)[3])
+        index._phone_keys = sorted((entry[2], makh) for makh, entry in index._customers.items())
+        index._name_keys = sorted((token, makh) for makh, entry in index._customers.items() for token in entry[3].split())
+        index._loaded_at = time.monotonic()
+    print(f"build {customers} customers: {(time.perf_counter() - started) * 1000:.0f} ms")
+    for label, run in (
+        ("phone prefix", lambda: index.match_phone(f"09{rng.randint(0, 9999):04d}", 50)),
+        ("name (2 words)", lambda: index.match_name(f"{rng.choice(givens)} {rng.choice(families)}", 50)),
+        ("name (3 words)", lambda: index.match_name(
+            f"{rng.choice(families)} {rng.choice(middles)} {rng.choice(givens)}", 50)),
+    ):
+        started = time.perf_counter()
+        for _ in range(queries):
+            run()
+        print(f"{label:>15}: {(time.perf_counter() - started) * 1000 / queries:.3f} ms/query")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,184 @@
+# backend/utils/order_totals.py
+"""
+Incremental maintenance of DonHang.TongTien for order line edits.
+
+Line changes apply a difference to the order in SQL (TongTien = TongTien +
+delta) inside the caller's transaction: the order row is locked, the line
+sum is read with one aggregate query and the delta is
+order_total(new sum) - order_total(old sum). No order or line objects are
+loaded and TongTien is never recomputed from scratch.
+
+The invariant is the rule order creation uses (order_total()):
+TongTien == SUM((DonGia - GiamGia) * SoLuong) less the order's KhuyenMai
+percentage, rounded to 0.01.
+PhiShip is kept in its own column and is not part of TongTien. Orders
+touched by a delta are remembered, and a background verifier periodically
+checks just those with one grouped query, logs any drift and (by default)
+repairs it.
+"""
+
+import logging
+import os
+import threading
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from backend.database import SessionLocal
+from backend.models import DonHang, DonHang_SanPham
+
+ORDER_TOTAL_VERIFY_INTERVAL_SECONDS = int(os.getenv("ORDER_TOTAL_VERIFY_INTERVAL_SECONDS", "300"))
+ORDER_TOTAL_VERIFY_REPAIR = os.getenv("ORDER_TOTAL_VERIFY_REPAIR", "true").lower() in ("1", "true", "yes")
+# Differences below this are rounding, not drift
+ORDER_TOTAL_TOLERANCE = Decimal("0.01")
+CENT = Decimal("0.01")
+
+# SUM of line totals of an order (DonHang_SanPham rows joined / filtered by the caller)
+LINE_SUM = func.coalesce(
+    func.sum((DonHang_SanPham.DonGia - DonHang_SanPham.GiamGia) * DonHang_SanPham.SoLuong), 0
+)
+
+_dirty_lock = threading.Lock()
+_DIRTY_ORDERS: Set[int] = set()
+_verifier_started = False
+
+
+def line_total(dongia, giamgia, soluong) -> Decimal:
+    return (Decimal(str(dongia or 0)) - Decimal(str(giamgia or 0))) * int(soluong or 0)
+
+
+def discount_factor(khuyenmai: Optional[str]) -> Decimal:
+    """1 - X/100 for DonHang.KhuyenMai "X%" (as stored by order creation); 1 otherwise."""
+    if not khuyenmai:
+        return Decimal(1)
+    try:
+        percentage = Decimal(str(khuyenmai).strip().rstrip("%"))
+    except InvalidOperation:
+        return Decimal(1)
+    if percentage < 0 or percentage > 100:
+        return Decimal(1)
+    return (100 - percentage) / 100
+
+
+def order_total(line_sum, khuyenmai: Optional[str]) -> Decimal:
+    """TongTien for a line sum: less the KhuyenMai percentage, rounded to 0.01."""
+    return (Decimal(str(line_sum or 0)) * discount_factor(khuyenmai)).quantize(CENT)
+
+
+def apply_total_delta(db: Session, madonhang: int, line_delta: Decimal) -> None:
+    """
+    Apply a change of the order's line sum (already flushed) to TongTien, in
+    SQL and in the caller's transaction (no commit). The order row is locked
+    first, so edits of one order (and the verifier's repair) are serialized;
+    the delta is the difference of the discounted, rounded totals, so repeated
+    edits never drift from order_total().
+    """
+    khuyenmai = (
+        db.query(DonHang.KhuyenMai)
+        .filter(DonHang.MaDonHang == madonhang)
+        .with_for_update()
+        .scalar()
+    )
+    # Locking read: sees lines committed by other edits of this order
+    new_sum = Decimal(str(
+        db.query(LINE_SUM).filter(DonHang_SanPham.MaDonHang == madonhang).with_for_update().scalar() or 0
+    ))
+    old_sum = new_sum - Decimal(str(line_delta))
+    delta = order_total(new_sum, khuyenmai) - order_total(old_sum, khuyenmai)
+    if delta:
+        db.query(DonHang).filter(DonHang.MaDonHang == madonhang).update(
+            {DonHang.TongTien: func.coalesce(DonHang.TongTien, 0) + delta},
+            synchronize_session=False,
+        )
+    with _dirty_lock:
+        _DIRTY_ORDERS.add(madonhang)
+
+
+def verify_order_totals(
+    db: Session,
+    order_ids: Optional[Iterable[int]] = None,
+    repair: bool = ORDER_TOTAL_VERIFY_REPAIR,
+) -> List[Dict]:
+    """
+    Compare TongTien with order_total() of its lines for `order_ids` (default:
+    every order changed by a delta since the last run). Returns the drifted
+    orders; with repair=True their TongTien is reset to that value and committed.
+    Repair locks the order rows (FOR UPDATE, MaDonHang order) before reading the
+    lines, so a concurrent line edit (apply_total_delta locks the same row)
+    either commits before the check or waits for the repair.
+    """
+    if order_ids is None:
+        with _dirty_lock:
+            ids = list(_DIRTY_ORDERS)
+            _DIRTY_ORDERS.clear()
+    else:
+        ids = list(order_ids)
+    if not ids:
+        return []
+
+    if repair:
+        (
+            db.query(DonHang.MaDonHang)
+            .filter(DonHang.MaDonHang.in_(ids))
+            .order_by(DonHang.MaDonHang)
+            .with_for_update()
+            .all()
+        )
+
+    rows = (
+        db.query(DonHang.MaDonHang, DonHang.TongTien, DonHang.KhuyenMai, LINE_SUM)
+        .outerjoin(DonHang_SanPham, DonHang_SanPham.MaDonHang == DonHang.MaDonHang)
+        .filter(DonHang.MaDonHang.in_(ids))
+        .group_by(DonHang.MaDonHang, DonHang.TongTien, DonHang.KhuyenMai)
+        .all()
+    )
+
+    drifted = []
+    repairs: Dict[int, Decimal] = {}
+    for madonhang, tongtien, khuyenmai, lines in rows:
+        stored = Decimal(str(tongtien or 0))
+        expected = order_total(lines, khuyenmai)
+        if abs(stored - expected) > ORDER_TOTAL_TOLERANCE:
+            repairs[madonhang] = expected
+            drifted.append({
+                "MaDonHang": madonhang,
+                "TongTien": float(stored),
+                "expected": float(expected),
+                "drift": float(stored - expected),
+            })
+
+    if drifted:
+        logging.warning(f"Order total drift detected for {len(drifted)} order(s): {drifted[:20]}")
+    if repair:
+        for madonhang, expected in repairs.items():
+            db.query(DonHang).filter(DonHang.MaDonHang == madonhang).update(
+                {DonHang.TongTien: expected}, synchronize_session=False
+            )
+        # Also releases the row locks when nothing drifted
+        db.commit()
+    return drifted
+
+
+def _verifier_loop(stop: threading.Event) -> None:
+    while not stop.wait(ORDER_TOTAL_VERIFY_INTERVAL_SECONDS):
+        db = SessionLocal()
+        try:
+            verify_order_totals(db)
+        except Exception as e:
+            db.rollback()
+            logging.error(f"Order total verifier failed: {str(e)}")
+        finally:
+            db.close()
+
+
+def start_order_total_verifier() -> Optional[threading.Event]:
+    """Start the periodic verifier thread once; returns its stop event."""
+    global _verifier_started
+    if _verifier_started or ORDER_TOTAL_VERIFY_INTERVAL_SECONDS <= 0:
+        return None
+    _verifier_started = True
+    stop = threading.Event()
+    threading.Thread(target=_verifier_loop, args=(stop,), name="order-total-verifier", daemon=True).start()
+    return stop
@@ -0,0 +1,252 @@
+# backend/utils/outbox.py
+"""
+Transactional outbox for order side effects.
+
+Routes call enqueue_event() inside the transaction that changes the order,
+so the event is committed if and only if the change is. A background
+dispatcher thread picks up PENDING OutboxEvent rows in batches of
+OUTBOX_BATCH_SIZE, runs the handlers registered for each event type with all
+payloads of that type at once, and marks the rows DONE in the same
+transaction as the handlers' own writes. A failing batch is retried event by
+event; an event is marked FAILED after OUTBOX_MAX_ATTEMPTS.
+
+notify_dispatcher() wakes the thread right after a commit, so side effects
+usually run within milliseconds while staying out of request latency.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from backend.database import SessionLocal
+from backend.models import ActivityLog, DonHang_SanPham, OutboxEvent, SanPham
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+OUTBOX_DISPATCH_INTERVAL_SECONDS = float(os.getenv("OUTBOX_DISPATCH_INTERVAL_SECONDS", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+OUTBOX_PURGE_INTERVAL_SECONDS = 3600
+
+EVENT_ORDER_STATUS_CHANGED = "order.status_changed"
+EVENT_ORDER_DELIVERY_UPDATED = "order.delivery_updated"
+
+Handler = Callable[[Session, List[Dict[str, Any]]], None]
+_HANDLERS: Dict[str, List[Handler]] = defaultdict(list)
+
+_wake = threading.Event()
+_dispatcher_started = False
+
+
+def register_handler(*event_types: str):
+    """Decorator: run `handler(db, payloads)` for batches of these event types."""
+    def decorator(handler: Handler) -> Handler:
+        for event_type in event_types:
+            _HANDLERS[event_type].append(handler)
+        return handler
+    return decorator
+
+
+def actor_payload(current_user: Optional[Dict]) -> Dict[str, Any]:
+    """The user fields ActivityLog needs, captured at request time."""
+    current_user = current_user or {}
+    return {
+        "user_id": current_user.get("user_id") or current_user.get("MaTK"),
+        "username": current_user.get("username"),
+        "role": current_user.get("role"),
+    }
+
+
+def enqueue_event(
+    db: Session,
+    event_type: str,
+    payload: Dict[str, Any],
+    entity: Optional[str] = None,
+    entity_id: Any = None,
+) -> None:
+    """Add an outbox row to the caller's transaction (no commit)."""
+    db.add(OutboxEvent(
+        EventType=event_type,
+        Entity=entity,
+        EntityId=str(entity_id) if entity_id is not None else None,
+        Payload=json.dumps(payload, ensure_ascii=False, default=str),
+        Status="PENDING",
+        Attempts=0,
+    ))
+
+
+def notify_dispatcher() -> None:
+    """Call after committing events so the dispatcher runs without waiting for its interval."""
+    _wake.set()
+
+
+# =====================================================
+# Handlers
+# =====================================================
+
+@register_handler(EVENT_ORDER_STATUS_CHANGED, EVENT_ORDER_DELIVERY_UPDATED)
+def _write_activity_logs(db: Session, payloads: List[Dict[str, Any]]) -> None:
+    logs = []
+    for payload in payloads:
+        activity = payload.get("activity")
+        if not activity:
+            continue
+        user = payload.get("user") or {}
+        logs.append(ActivityLog(
+            UserId=user.get("user_id"),
+            Username=user.get("username"),
+            Role=user.get("role"),
+            Action=activity.get("action"),
+            Entity=activity.get("entity"),
+            EntityId=str(activity["entity_id"]) if activity.get("entity_id") is not None else None,
+            Details=activity.get("details"),
+            CreatedAt=_parse_time(payload.get("occurred_at")),
+        ))
+    if logs:
+        db.add_all(logs)
+
+
+@register_handler(EVENT_ORDER_STATUS_CHANGED)
+def _refresh_catalog_stock(db: Session, payloads: List[Dict[str, Any]]) -> None:
+    """Push new stock levels of the affected orders' products into the catalog snapshot."""
+    from backend.utils.catalog_snapshot import catalog_snapshot
+
+    order_ids = {p["MaDonHang"] for p in payloads if p.get("inventory_action", "none") != "none"}
+    if not order_ids:
+        return
+    rows = (
+        db.query(SanPham.MaSP, SanPham.SoLuongTonKho)
+        .join(DonHang_SanPham, DonHang_SanPham.MaSP == SanPham.MaSP)
+        .filter(DonHang_SanPham.MaDonHang.in_(order_ids))
+        .distinct()
+        .all()
+    )
+    for masp, stock in rows:
+        catalog_snapshot.update_stock(masp, stock or 0)
+
+
+def _parse_time(value: Optional[str]) -> datetime:
+    try:
+        return datetime.fromisoformat(value) if value else datetime.utcnow()
+    except ValueError:
+        return datetime.utcnow()
+
+
+# =====================================================
+# Dispatcher
+# =====================================================
+
+def _run_handlers(db: Session, events: List[OutboxEvent]) -> None:
+    by_type: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for event in events:
+        by_type[event.EventType].append(json.loads(event.Payload or "{}"))
+    for event_type, payloads in by_type.items():
+        for handler in _HANDLERS.get(event_type, []):
+            handler(db, payloads)
+
+
+def dispatch_pending(db: Session, batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """Process one batch of PENDING events; returns how many were picked up."""
+    ids = [
+        event_id for (event_id,) in db.query(OutboxEvent.Id)
+        .filter(OutboxEvent.Status == "PENDING")
+        .order_by(OutboxEvent.Id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    ]
+    if not ids:
+        db.rollback()
+        return 0
+    events = db.query(OutboxEvent).filter(OutboxEvent.Id.in_(ids)).order_by(OutboxEvent.Id).all()
+
+    try:
+        _run_handlers(db, events)
+        now = datetime.utcnow()
+        for event in events:
+            event.Status = "DONE"
+            event.Attempts = (event.Attempts or 0) + 1
+            event.ProcessedAt = now
+        db.commit()
+        return len(ids)
+    except Exception as e:
+        db.rollback()
+        logging.warning(f"Outbox batch of {len(ids)} failed, retrying one by one: {str(e)}")
+
+    # Isolate the failing event(s) so the rest of the batch still goes through
+    for event_id in ids:
+        event = db.query(OutboxEvent).filter(OutboxEvent.Id == event_id).with_for_update().first()
+        if event is None or event.Status != "PENDING":
+            db.rollback()
+            continue
+        try:
+            _run_handlers(db, [event])
+            event.Status = "DONE"
+            event.ProcessedAt = datetime.utcnow()
+            event.Attempts = (event.Attempts or 0) + 1
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            event = db.query(OutboxEvent).filter(OutboxEvent.Id == event_id).first()
+            event.Attempts = (event.Attempts or 0) + 1
+            event.LastError = str(e)[:2000]
+            if event.Attempts >= OUTBOX_MAX_ATTEMPTS:
+                event.Status = "FAILED"
+                logging.error(f"Outbox event {event_id} ({event.EventType}) failed permanently: {str(e)}")
+            db.commit()
+    return len(ids)
+
+
+def purge_processed(db: Session, older_than_days: int = OUTBOX_RETENTION_DAYS) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    deleted = db.query(OutboxEvent).filter(
+        OutboxEvent.Status == "DONE",
+        OutboxEvent.ProcessedAt < cutoff,
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+def _dispatcher_loop(stop: threading.Event) -> None:
+    last_purge = 0.0
+    while not stop.is_set():
+        _wake.wait(OUTBOX_DISPATCH_INTERVAL_SECONDS)
+        _wake.clear()
+        if stop.is_set():
+            break
+        db = SessionLocal()
+        try:
+            # Drain the backlog before sleeping again
+            while dispatch_pending(db) >= OUTBOX_BATCH_SIZE and not stop.is_set():
+                pass
+            if time.monotonic() - last_purge > OUTBOX_PURGE_INTERVAL_SECONDS:
+                purge_processed(db)
+                last_purge = time.monotonic()
+        except Exception as e:
+            db.rollback()
+            logging.error(f"Outbox dispatcher failed: {str(e)}")
+        finally:
+            db.close()
+
+
+def start_outbox_dispatcher() -> Optional[threading.Event]:
+    """Start the dispatcher thread once; returns its stop event."""
+    global _dispatcher_started
+    if _dispatcher_started or OUTBOX_DISPATCH_INTERVAL_SECONDS <= 0:
+        return None
+    _dispatcher_started = True
+    stop = threading.Event()
+    threading.Thread(target=_dispatcher_loop, args=(stop,), name="outbox-dispatcher", daemon=True).start()
+    return stop
+
+
+def stop_outbox_dispatcher(stop: Optional[threading.Event]) -> None:
+    if stop is not None:
+        stop.set()
+        _wake.set()
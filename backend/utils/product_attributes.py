@@ -0,0 +1,185 @@
+# backend/utils/product_attributes.py
+"""
+Product attributes stored as JSON in SanPham.MoTa.
+
+- decode_attributes_cached(): memoized json.loads keyed on (MaSP, hash(MoTa)),
+  so list responses / dashboard never re-parse unchanged JSON.
+- sync_product_attributes(): keeps the SanPham_ThuocTinh side table (one
+  indexed row per scalar attribute) in step with MoTa, which makes filtering
+  by brand / capacity / ... an index lookup instead of loading every product.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from backend.models import SanPham, SanPham_ThuocTinh
+
+# Max decoded entries kept in memory
+ATTRIBUTE_CACHE_SIZE = 4096
+# Max length of an indexed attribute value (matches SanPham_ThuocTinh.GiaTri)
+ATTRIBUTE_VALUE_MAX_LEN = 255
+
+# Vietnamese / English synonyms mapped to one canonical attribute key
+ATTRIBUTE_KEY_ALIASES = {
+    "thuong hieu": "brand",
+    "hang": "brand",
+    "hang san xuat": "brand",
+    "dung tich": "capacity",
+    "cong suat": "power",
+    "mau": "color",
+    "mau sac": "color",
+    "chat lieu": "material",
+    "loai": "type",
+    "cong nghe": "technology",
+    "bao hanh": "warranty",
+}
+
+_cache_lock = threading.Lock()
+_decode_cache: "OrderedDict[Tuple[Optional[int], str], Optional[dict]]" = OrderedDict()
+
+
+def decode_attributes_from_mota(mota: Optional[str]) -> Optional[dict]:
+    """
+    Decode JSON string from MoTa column to attributes dictionary.
+    """
+    if not mota or mota.strip() == "":
+        return None
+    try:
+        return json.loads(mota)
+    except (json.JSONDecodeError, TypeError):
+        # If MoTa is not valid JSON, return it as a simple string
+        return {"description": mota}
+
+
+def decode_attributes_cached(masp: Optional[int], mota: Optional[str]) -> Optional[dict]:
+    """
+    Memoized decode_attributes_from_mota keyed on (MaSP, hash of MoTa).
+    The returned dict is shared between callers - treat it as read-only.
+    """
+    if not mota:
+        return None
+    key = (masp, hashlib.blake2b(mota.encode("utf-8"), digest_size=16).hexdigest())
+    with _cache_lock:
+        if key in _decode_cache:
+            _decode_cache.move_to_end(key)
+            return _decode_cache[key]
+
+    attributes = decode_attributes_from_mota(mota)
+    with _cache_lock:
+        _decode_cache[key] = attributes
+        if len(_decode_cache) > ATTRIBUTE_CACHE_SIZE:
+            _decode_cache.popitem(last=False)
+    return attributes
+
+
+def clear_attribute_cache() -> None:
+    with _cache_lock:
+        _decode_cache.clear()
+
+
+def normalize_attribute_key(key: str) -> str:
+    """'Dung tích' / 'dung tich' / 'capacity' -> 'capacity' (lowercase, no diacritics, aliases)."""
+    folded = unicodedata.normalize("NFD", str(key).strip().lower()).replace("đ", "d")
+    folded = "".join(ch for ch in folded if unicodedata.category(ch) != "Mn")
+    folded = re.sub(r"[\s_\-]+", " ", folded)
+    return ATTRIBUTE_KEY_ALIASES.get(folded, folded)[:50]
+
+
+def fold_attribute_value(value: str) -> str:
+    """
+    'Đen ' / 'den' -> 'den': the comparison key of utf8mb4_unicode_ci (case- and
+    accent-insensitive) that SanPham_ThuocTinh.GiaTri is matched with in SQL.
+    """
+    folded = unicodedata.normalize("NFD", str(value).strip().casefold()).replace("đ", "d")
+    return "".join(ch for ch in folded if unicodedata.category(ch) != "Mn")
+
+
+def extract_indexed_attributes(attributes: Optional[Any]) -> Dict[str, str]:
+    """Scalar attributes only (lists / nested objects such as images are not indexed)."""
+    if not isinstance(attributes, dict):
+        return {}
+    indexed: Dict[str, str] = {}
+    for key, value in attributes.items():
+        if key == "description" or isinstance(value, (dict, list)) or value is None:
+            continue
+        indexed[normalize_attribute_key(key)] = str(value).strip()[:ATTRIBUTE_VALUE_MAX_LEN]
+    return indexed
+
+
+def sync_product_attributes(db: Session, masp: int, mota: Optional[str]) -> None:
+    """
+    Rewrite SanPham_ThuocTinh rows of one product from its MoTa.
+    Does not commit - runs in the caller's transaction.
+    """
+    db.query(SanPham_ThuocTinh).filter(SanPham_ThuocTinh.MaSP == masp).delete(synchronize_session=False)
+    rows = [
+        {"MaSP": masp, "TenThuocTinh": key, "GiaTri": value}
+        for key, value in extract_indexed_attributes(decode_attributes_cached(masp, mota)).items()
+    ]
+    if rows:
+        db.bulk_insert_mappings(SanPham_ThuocTinh, rows)
+
+
+def sync_product_attributes_bulk(db: Session, products: Iterable[Tuple[int, Optional[str]]]) -> None:
+    """
+    sync_product_attributes for many products with one DELETE ... IN and one
+    bulk INSERT. Does not commit.
+    """
+    products = list(products)
+    if not products:
+        return
+    db.query(SanPham_ThuocTinh).filter(
+        SanPham_ThuocTinh.MaSP.in_([masp for masp, _ in products])
+    ).delete(synchronize_session=False)
+    rows = [
+        {"MaSP": masp, "TenThuocTinh": key, "GiaTri": value}
+        for masp, mota in products
+        for key, value in extract_indexed_attributes(decode_attributes_cached(masp, mota)).items()
+    ]
+    if rows:
+        db.bulk_insert_mappings(SanPham_ThuocTinh, rows)
+
+
+def rebuild_attribute_index(db: Session, batch_size: int = 500) -> int:
+    """Backfill SanPham_ThuocTinh for every product; returns number of products processed."""
+    processed = 0
+    last_id = 0
+    while True:
+        batch: List[Tuple[int, Optional[str]]] = (
+            db.query(SanPham.MaSP, SanPham.MoTa)
+            .filter(SanPham.MaSP > last_id)
+            .order_by(SanPham.MaSP)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for masp, mota in batch:
+            sync_product_attributes(db, masp, mota)
+        db.commit()
+        processed += len(batch)
+        last_id = batch[-1][0]
+    return processed
+
+
+def parse_attribute_filters(filters: Optional[Iterable[str]]) -> List[Tuple[str, str]]:
+    """
+    ['brand:Samsung', 'Dung tích:1.8L'] -> [('brand', 'samsung'), ('capacity', '1.8l')].
+    Values are folded (fold_attribute_value) so the in-memory facet path matches
+    like the SQL path does under the table collation.
+    """
+    parsed: List[Tuple[str, str]] = []
+    for raw in filters or []:
+        if ":" not in raw:
+            continue
+        key, value = raw.split(":", 1)
+        if key.strip() and value.strip():
+            parsed.append((normalize_attribute_key(key), fold_attribute_value(value)))
+    return parsed
@@ -0,0 +1,285 @@
+# backend/utils/product_io.py
+"""
+Bulk product import / export.
+
+Import reads a CSV or NDJSON upload lazily (line by line from the spooled
+upload file), validates rows in batches of IMPORT_BATCH_SIZE and writes each
+batch with one batched INSERT flush / bulk UPDATE (by MaSP) plus one bulk attribute-index
+sync. Category ids are validated against a set loaded with one query.
+
+Export streams rows from a server-side cursor (stream_results + yield_per),
+so memory stays flat regardless of catalog size.
+"""
+
+import csv
+import io
+import json
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from backend.database import SessionLocal
+from backend.models import DanhMuc, SanPham
+from backend.utils.product_attributes import sync_product_attributes_bulk
+from backend.utils.stock_ledger import REASON_IMPORT, movement, record_movements
+from backend.utils.upload_rows import is_blank, iter_raw_rows
+
+IMPORT_BATCH_SIZE = 500
+# Max row errors returned in the import report
+IMPORT_MAX_ERRORS = 1000
+EXPORT_YIELD_PER = 1000
+# Rows serialized per yielded chunk
+EXPORT_CHUNK_ROWS = 200
+
+# CSV columns; MoTa round-trips verbatim (JSON attributes or free text).
+# Import also accepts an "attributes" column / key holding a JSON object.
+PRODUCT_IO_FIELDS = ["MaSP", "TenSP", "GiaSP", "SoLuongTonKho", "MaDanhMuc", "HinhAnh", "MoTa"]
+SUPPORTED_FORMATS = ("csv", "ndjson")
+OPTIONAL_COLUMNS = ("SoLuongTonKho", "MaDanhMuc", "HinhAnh")
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str], requested: Optional[str]) -> str:
+    if requested:
+        return requested.lower()
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in (content_type or ""):
+        return "ndjson"
+    return "csv"
+
+
+# =====================================================
+# Import
+# =====================================================
+
+def validate_import_row(raw: Dict[str, Any], category_ids: Set[int]) -> Dict[str, Any]:
+    """Return a SanPham mapping (MaSP only when updating); raise ValueError on invalid data."""
+    ten_sp = str(raw.get("TenSP") or "").strip()
+    if not ten_sp:
+        raise ValueError("Thiếu TenSP")
+    if len(ten_sp) > 100:
+        raise ValueError("TenSP dài quá 100 ký tự")
+
+    try:
+        gia_sp = float(raw.get("GiaSP"))
+    except (TypeError, ValueError):
+        raise ValueError("GiaSP không hợp lệ")
+    if gia_sp < 0:
+        raise ValueError("GiaSP phải >= 0")
+
+    try:
+        ton_kho = 0 if is_blank(raw.get("SoLuongTonKho")) else int(raw.get("SoLuongTonKho"))
+    except (TypeError, ValueError):
+        raise ValueError("SoLuongTonKho không hợp lệ")
+    if ton_kho < 0:
+        raise ValueError("SoLuongTonKho phải >= 0")
+
+    ma_danh_muc = None
+    if not is_blank(raw.get("MaDanhMuc")):
+        try:
+            ma_danh_muc = int(raw.get("MaDanhMuc"))
+        except (TypeError, ValueError):
+            raise ValueError("MaDanhMuc không hợp lệ")
+        if ma_danh_muc not in category_ids:
+            raise ValueError(f"Danh mục {ma_danh_muc} không tồn tại")
+
+    attributes = raw.get("attributes")
+    if isinstance(attributes, str) and attributes.strip():
+        try:
+            attributes = json.loads(attributes)
+        except ValueError:
+            raise ValueError("attributes phải là JSON object")
+    if attributes and not isinstance(attributes, dict):
+        raise ValueError("attributes phải là JSON object")
+    if attributes:
+        mota = json.dumps(attributes, ensure_ascii=False)
+    else:
+        mota = None if is_blank(raw.get("MoTa")) else str(raw.get("MoTa"))
+
+    mapping = {
+        "TenSP": ten_sp,
+        "GiaSP": gia_sp,
+        "SoLuongTonKho": ton_kho,
+        "MaDanhMuc": ma_danh_muc,
+        "HinhAnh": None if is_blank(raw.get("HinhAnh")) else str(raw.get("HinhAnh")).strip()[:500],
+        "MoTa": mota,
+        "IsDelete": False,
+    }
+    if not is_blank(raw.get("MaSP")):
+        try:
+            mapping["MaSP"] = int(raw.get("MaSP"))
+        except (TypeError, ValueError):
+            raise ValueError("MaSP không hợp lệ")
+        # Updates only touch the optional columns the file actually provides
+        for column in OPTIONAL_COLUMNS:
+            if column not in raw:
+                mapping.pop(column)
+        if "attributes" not in raw and "MoTa" not in raw:
+            mapping.pop("MoTa")
+    return mapping
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def add_error(self, row_number: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"row": row_number, "error": message})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def _write_batch(db: Session, batch: List[Tuple[int, Dict[str, Any]]], report: ImportReport) -> None:
+    """Upsert one validated batch in a single transaction."""
+    update_ids = [m["MaSP"] for _, m in batch if "MaSP" in m]
+    existing: Dict[int, int] = {}
+    if update_ids:
+        # Locked (in MaSP order, like InventoryManager.lock_products) until the
+        # batch commits, so an order cannot change stock between this read and
+        # the write and the ledger difference stays exact
+        existing = {
+            masp: stock or 0 for masp, stock in
+            db.query(SanPham.MaSP, SanPham.SoLuongTonKho)
+            .filter(SanPham.MaSP.in_(update_ids))
+            .order_by(SanPham.MaSP)
+            .with_for_update()
+            .all()
+        }
+
+    inserts: List[Dict[str, Any]] = []
+    updates: List[Dict[str, Any]] = []
+    written_rows: List[int] = []
+    for row_number, mapping in batch:
+        if "MaSP" not in mapping:
+            inserts.append(mapping)
+        elif mapping["MaSP"] in existing:
+            updates.append(mapping)
+        else:
+            report.add_error(row_number, f"Sản phẩm {mapping['MaSP']} không tồn tại")
+            continue
+        written_rows.append(row_number)
+
+    try:
+        # New rows go through one flush (batched INSERT) so their MaSP is known
+        # for the attribute index; existing rows use one executemany UPDATE.
+        new_products = [SanPham(**m) for m in inserts]
+        db.add_all(new_products)
+        db.flush()
+        if updates:
+            db.bulk_update_mappings(SanPham, updates)
+        # Stock set by the file goes into the ledger as the difference
+        movements = [movement(sp.MaSP, sp.SoLuongTonKho or 0, REASON_IMPORT, "SanPham", sp.MaSP) for sp in new_products]
+        for m in updates:
+            if "SoLuongTonKho" in m:
+                delta = m["SoLuongTonKho"] - existing[m["MaSP"]]
+                movements.append(movement(m["MaSP"], delta, REASON_IMPORT, "SanPham", m["MaSP"]))
+                existing[m["MaSP"]] = m["SoLuongTonKho"]
+        record_movements(db, movements)
+        sync_product_attributes_bulk(
+            db,
+            [(sp.MaSP, sp.MoTa) for sp in new_products] + [(m["MaSP"], m["MoTa"]) for m in updates if "MoTa" in m],
+        )
+        db.commit()
+        db.expunge_all()
+    except Exception as e:
+        db.rollback()
+        for row_number in written_rows:
+            report.add_error(row_number, f"Lỗi ghi CSDL: {e}")
+        return
+    report.inserted += len(inserts)
+    report.updated += len(updates)
+
+
+def import_products(db: Session, stream: BinaryIO, fmt: str, batch_size: int = IMPORT_BATCH_SIZE) -> ImportReport:
+    category_ids = {
+        ma for (ma,) in db.query(DanhMuc.MaDanhMuc).filter(DanhMuc.IsDelete == False).all()
+    }
+    report = ImportReport()
+    batch: List[Tuple[int, Dict[str, Any]]] = []
+    try:
+        for row_number, raw in iter_raw_rows(stream, fmt):
+            if isinstance(raw, str):
+                report.add_error(row_number, raw)
+                continue
+            try:
+                batch.append((row_number, validate_import_row(raw, category_ids)))
+            except ValueError as e:
+                report.add_error(row_number, str(e))
+                continue
+            if len(batch) >= batch_size:
+                _write_batch(db, batch, report)
+                batch = []
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ValueError(f"Không đọc được file: {e}")
+    if batch:
+        _write_batch(db, batch, report)
+    return report
+
+
+# =====================================================
+# Export
+# =====================================================
+
+def _export_rows(db: Session, madanhmuc: Optional[int], include_deleted: bool) -> Iterator[Dict[str, Any]]:
+    stmt = select(
+        SanPham.MaSP, SanPham.TenSP, SanPham.GiaSP, SanPham.SoLuongTonKho,
+        SanPham.MaDanhMuc, SanPham.HinhAnh, SanPham.MoTa,
+    ).order_by(SanPham.MaSP)
+    if not include_deleted:
+        stmt = stmt.where(SanPham.IsDelete == False)
+    if madanhmuc is not None:
+        stmt = stmt.where(SanPham.MaDanhMuc == madanhmuc)
+    result = db.execute(stmt.execution_options(stream_results=True, yield_per=EXPORT_YIELD_PER))
+    for row in result:
+        yield {
+            "MaSP": row.MaSP,
+            "TenSP": row.TenSP,
+            "GiaSP": float(row.GiaSP) if row.GiaSP is not None else None,
+            "SoLuongTonKho": row.SoLuongTonKho,
+            "MaDanhMuc": row.MaDanhMuc,
+            "HinhAnh": row.HinhAnh,
+            "MoTa": row.MoTa,
+        }
+
+
+def stream_export(fmt: str, madanhmuc: Optional[int] = None, include_deleted: bool = False) -> Iterator[bytes]:
+    """
+    Yield CSV / NDJSON chunks of EXPORT_CHUNK_ROWS rows. The session is opened
+    on first iteration, so a response that is never iterated holds no connection.
+    """
+    db = SessionLocal()
+    try:
+        buffer = io.StringIO()
+        writer = None
+        if fmt == "csv":
+            writer = csv.DictWriter(buffer, fieldnames=PRODUCT_IO_FIELDS)
+            writer.writeheader()
+        pending = 0
+        for row in _export_rows(db, madanhmuc, include_deleted):
+            if writer is not None:
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(row, ensure_ascii=False))
+                buffer.write("\n")
+            pending += 1
+            if pending >= EXPORT_CHUNK_ROWS:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+    finally:
+        db.close()
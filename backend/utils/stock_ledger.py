@@ -0,0 +1,160 @@
+# backend/utils/stock_ledger.py
+"""
+Append-only stock movement ledger.
+
+Every change of SanPham.SoLuongTonKho is also written as a StockLedger row
+(Delta, Reason, reference) in the same transaction, so the ledger sums to the
+current stock and keeps the full history. Rows are only ever inserted:
+recording a movement takes no lock on the product row.
+
+A scheduled job folds the ledger into StockSnapshot (one row per product per
+run). Stock at a point in time is the latest snapshot taken at or before it
+plus the ledger deltas after that snapshot, so history queries read at most
+one snapshot run and STOCK_SNAPSHOT_INTERVAL_HOURS worth of movements.
+Times are UTC, like the rest of the audit tables.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from backend.database import SessionLocal
+from backend.models import StockLedger, StockSnapshot
+
+# 0 disables the scheduled snapshot (run on demand via PUT /api/inventory/snapshot)
+STOCK_SNAPSHOT_INTERVAL_HOURS = float(os.getenv("STOCK_SNAPSHOT_INTERVAL_HOURS", "24"))
+# Movements newer than this are left to the next snapshot so transactions
+# still in flight (CreatedAt is set before commit) are never skipped
+STOCK_SNAPSHOT_LAG_SECONDS = int(os.getenv("STOCK_SNAPSHOT_LAG_SECONDS", "300"))
+
+# Reasons besides the InventoryManager order actions (reserve, release, confirm, cancel)
+REASON_OPENING = "opening"
+REASON_ADJUST = "adjust"
+REASON_IMPORT = "import"
+
+# Session.info key: MaSP touched by record_movements() in the current
+# transaction (read after commit by low_stock.py)
+TOUCHED_PRODUCTS_KEY = "stock_ledger.touched_products"
+
+_snapshotter_started = False
+
+
+def movement(
+    masp: int,
+    delta: int,
+    reason: str,
+    ref_type: Optional[str] = None,
+    ref_id: Any = None,
+    user_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    return {
+        "MaSP": masp,
+        "Delta": int(delta),
+        "Reason": reason,
+        "RefType": ref_type,
+        "RefId": str(ref_id) if ref_id is not None else None,
+        "UserId": user_id,
+    }
+
+
+def record_movements(db: Session, movements: Iterable[Dict[str, Any]]) -> int:
+    """Append movements (see movement()) to the caller's transaction with one executemany INSERT."""
+    now = datetime.utcnow()
+    movements = list(movements)
+    rows = [{**m, "CreatedAt": now} for m in movements if m["Delta"]]
+    if rows:
+        db.execute(insert(StockLedger.__table__), rows)
+    # Zero-delta movements (a new product with no stock) still count as touched
+    db.info.setdefault(TOUCHED_PRODUCTS_KEY, set()).update(m["MaSP"] for m in movements)
+    return len(rows)
+
+
+# =====================================================
+# Snapshots / history
+# =====================================================
+
+def _latest_run(db: Session, at: Optional[datetime] = None) -> Optional[datetime]:
+    query = db.query(func.max(StockSnapshot.TakenAt))
+    if at is not None:
+        query = query.filter(StockSnapshot.TakenAt <= at)
+    return query.scalar()
+
+
+def _ledger_sums(db: Session, after: Optional[datetime], until: datetime, product_ids=None) -> Dict[int, int]:
+    query = db.query(StockLedger.MaSP, func.sum(StockLedger.Delta)).filter(StockLedger.CreatedAt <= until)
+    if after is not None:
+        query = query.filter(StockLedger.CreatedAt > after)
+    if product_ids is not None:
+        query = query.filter(StockLedger.MaSP.in_(product_ids))
+    return {masp: int(total or 0) for masp, total in query.group_by(StockLedger.MaSP).all()}
+
+
+def take_snapshot(db: Session, taken_at: Optional[datetime] = None) -> Dict[str, Any]:
+    """Fold movements since the previous run into a new StockSnapshot run; commits."""
+    taken_at = (taken_at or datetime.utcnow() - timedelta(seconds=STOCK_SNAPSHOT_LAG_SECONDS)).replace(microsecond=0)
+    previous = _latest_run(db)
+    if previous is not None and taken_at <= previous:
+        return {"taken_at": previous.isoformat(), "products": 0}
+
+    balances: Dict[int, int] = {}
+    if previous is not None:
+        balances = {
+            masp: quantity for masp, quantity in
+            db.query(StockSnapshot.MaSP, StockSnapshot.SoLuong).filter(StockSnapshot.TakenAt == previous).all()
+        }
+    for masp, delta in _ledger_sums(db, previous, taken_at).items():
+        balances[masp] = balances.get(masp, 0) + delta
+    if balances:
+        db.execute(
+            insert(StockSnapshot.__table__),
+            [{"TakenAt": taken_at, "MaSP": masp, "SoLuong": quantity} for masp, quantity in balances.items()],
+        )
+    db.commit()
+    logging.info(f"Stock snapshot at {taken_at.isoformat()}: {len(balances)} products")
+    return {"taken_at": taken_at.isoformat(), "products": len(balances)}
+
+
+def stock_at(db: Session, product_ids: List[int], at: datetime) -> Dict[int, int]:
+    """Stock of each product at `at`: latest snapshot at or before it + ledger deltas since."""
+    ids = sorted(set(product_ids))
+    if not ids:
+        return {}
+    run = _latest_run(db, at)
+    result = {masp: 0 for masp in ids}
+    if run is not None:
+        result.update(
+            db.query(StockSnapshot.MaSP, StockSnapshot.SoLuong)
+            .filter(StockSnapshot.TakenAt == run, StockSnapshot.MaSP.in_(ids))
+            .all()
+        )
+    for masp, delta in _ledger_sums(db, run, at, ids).items():
+        result[masp] += delta
+    return result
+
+
+def _snapshot_loop(stop: threading.Event) -> None:
+    while not stop.wait(STOCK_SNAPSHOT_INTERVAL_HOURS * 3600):
+        db = SessionLocal()
+        try:
+            take_snapshot(db)
+        except Exception as e:
+            db.rollback()
+            logging.error(f"Stock snapshot failed: {str(e)}")
+        finally:
+            db.close()
+
+
+def start_stock_snapshotter() -> Optional[threading.Event]:
+    """Start the scheduled snapshot once (when STOCK_SNAPSHOT_INTERVAL_HOURS > 0); returns its stop event."""
+    global _snapshotter_started
+    if _snapshotter_started or STOCK_SNAPSHOT_INTERVAL_HOURS <= 0:
+        return None
+    _snapshotter_started = True
+    stop = threading.Event()
+    threading.Thread(target=_snapshot_loop, args=(stop,), name="stock-snapshot", daemon=True).start()
+    return stop
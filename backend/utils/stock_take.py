@@ -0,0 +1,115 @@
+# backend/utils/stock_take.py
+"""
+Parsing for bulk stock adjustments (stock-takes): PUT /api/inventory/bulk-adjust.
+
+Each row is {MaSP, delta} (add / subtract) or {MaSP, absolute} (counted stock).
+Rows come from a JSON list, a CSV file with header MaSP,delta,absolute or
+NDJSON (one object per line). Invalid rows are reported by row number and left
+out; InventoryManager.bulk_adjust_stock() applies the rest in one transaction.
+"""
+
+import io
+import os
+from typing import Any, Dict, Iterable, List, Tuple
+
+from backend.utils.upload_rows import is_blank, iter_raw_rows
+
+BULK_ADJUST_MAX_ROWS = int(os.getenv("BULK_ADJUST_MAX_ROWS", "20000"))
+BULK_ADJUST_MAX_ERRORS = 1000
+
+
+class StockTakeReport:
+    def __init__(self):
+        self.total = 0
+        self.applied = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def add_error(self, row_number: int, message: str, masp: Any = None) -> None:
+        self.failed += 1
+        if len(self.errors) < BULK_ADJUST_MAX_ERRORS:
+            self.errors.append({"row": row_number, "MaSP": masp, "error": message})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "applied": self.applied,
+            "unchanged": self.unchanged,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda error: error["row"]),
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def _to_int(value: Any, field: str) -> int:
+    if isinstance(value, bool):
+        raise ValueError(f"{field} phải là số nguyên")
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(f"{field} phải là số nguyên")
+        return int(value)
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{field} phải là số nguyên")
+
+
+def _parse_row(raw: Dict[str, Any]) -> Dict[str, Any]:
+    if is_blank(raw.get("MaSP")):
+        raise ValueError("Thiếu MaSP")
+    masp = _to_int(raw["MaSP"], "MaSP")
+    has_delta = not is_blank(raw.get("delta"))
+    has_absolute = not is_blank(raw.get("absolute"))
+    if has_delta == has_absolute:
+        raise ValueError("Cần đúng một trong hai cột delta hoặc absolute")
+    if has_delta:
+        return {"MaSP": masp, "delta": _to_int(raw["delta"], "delta")}
+    absolute = _to_int(raw["absolute"], "absolute")
+    if absolute < 0:
+        raise ValueError("absolute không được âm")
+    return {"MaSP": masp, "absolute": absolute}
+
+
+def parse_adjustments(raw_rows: Iterable[Tuple[int, Any]], report: StockTakeReport) -> List[Dict[str, Any]]:
+    """
+    Validate (row_number, raw_row) pairs. Returns [{row, MaSP, delta | absolute}];
+    bad rows and repeated MaSP (a product may appear once per batch) go to the report.
+    Raises ValueError when the batch has more than BULK_ADJUST_MAX_ROWS rows.
+    """
+    adjustments: List[Dict[str, Any]] = []
+    seen: Dict[int, int] = {}
+    for row_number, raw in raw_rows:
+        report.total += 1
+        if report.total > BULK_ADJUST_MAX_ROWS:
+            raise ValueError(f"Tối đa {BULK_ADJUST_MAX_ROWS} dòng mỗi lần điều chỉnh")
+        if isinstance(raw, str):
+            report.add_error(row_number, raw)
+            continue
+        if not isinstance(raw, dict):
+            report.add_error(row_number, "Mỗi dòng phải là một object")
+            continue
+        try:
+            row = _parse_row(raw)
+        except ValueError as e:
+            report.add_error(row_number, str(e), raw.get("MaSP"))
+            continue
+        if row["MaSP"] in seen:
+            report.add_error(row_number, f"MaSP trùng với dòng {seen[row['MaSP']]}", row["MaSP"])
+            continue
+        seen[row["MaSP"]] = row_number
+        adjustments.append({"row": row_number, **row})
+    return adjustments
+
+
+def iter_json_rows(payload: Any) -> Iterable[Tuple[int, Any]]:
+    """JSON body: a list of rows or {"items": [...]}; rows are numbered from 1."""
+    if isinstance(payload, dict):
+        payload = payload.get("items")
+    if not isinstance(payload, list):
+        raise ValueError("Body JSON phải là danh sách hoặc {\"items\": [...]}")
+    return enumerate(payload, start=1)
+
+
+def iter_file_rows(data: bytes, fmt: str) -> Iterable[Tuple[int, Any]]:
+    return iter_raw_rows(io.BytesIO(data), fmt)
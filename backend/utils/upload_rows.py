@@ -0,0 +1,33 @@
+# backend/utils/upload_rows.py
+"""
+Row reader shared by the CSV / NDJSON uploads (product import, stock-take).
+"""
+
+import csv
+import io
+import json
+from typing import Any, BinaryIO, Iterator, Tuple
+
+
+def iter_raw_rows(stream: BinaryIO, fmt: str) -> Iterator[Tuple[int, Any]]:
+    """Yield (row_number, raw_row); raw_row is a dict or an error string."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        # Row numbers count the header as line 1
+        for row_number, row in enumerate(reader, start=2):
+            yield row_number, row
+        return
+    for row_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield row_number, f"JSON không hợp lệ: {e}"
+            continue
+        yield row_number, row if isinstance(row, dict) else "Mỗi dòng phải là một object JSON"
+
+
+def is_blank(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and value.strip() == "")
@@ -0,0 +1,9 @@
+-- =====================================================
+-- Migration: Add customer order-history index on DonHang
+-- Date: 2026-10-19
+-- Description: Composite index (MaKH, NgayDat, MaDonHang) backing the keyset
+--              pagination of GET /api/donhang/my-orders, so every page is an
+--              index range scan regardless of how many orders a customer has.
+-- =====================================================
+
+CREATE INDEX idx_donhang_makh_ngaydat ON DonHang (MaKH, NgayDat, MaDonHang);
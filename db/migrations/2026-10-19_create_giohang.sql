@@ -0,0 +1,19 @@
+-- =====================================================
+-- Migration: Create GioHang table
+-- Date: 2026-10-19
+-- Description: Persistent server-side cart. Each row holds a time-limited
+--              soft reservation (GiuHangDen) so stock in an active cart is
+--              not sold to other customers before checkout.
+-- =====================================================
+
+CREATE TABLE IF NOT EXISTS GioHang (
+    MaKH INT NOT NULL,
+    MaSP INT NOT NULL,
+    SoLuong INT NOT NULL,
+    GiuHangDen DATETIME NULL,                -- Reservation expiry (UTC); expired rows no longer hold stock
+    NgayCapNhat DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (MaKH, MaSP),
+    FOREIGN KEY (MaKH) REFERENCES KhachHang(MaKH) ON UPDATE CASCADE ON DELETE CASCADE,
+    FOREIGN KEY (MaSP) REFERENCES SanPham(MaSP) ON UPDATE CASCADE ON DELETE CASCADE,
+    INDEX idx_giohang_giuhang (MaSP, GiuHangDen)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,54 @@
+-- =====================================================
+-- Migration: Create order archive tables
+-- Date: 2026-10-19
+-- Description: Closed orders (Delivered/Cancelled) older than
+--              ORDER_ARCHIVE_MONTHS are moved here with their lines and
+--              payments by PUT /api/donhang/archive (or the scheduled
+--              archiver). No foreign keys: archived rows are history.
+--              The cutoff is kept in SystemConfig (ORDER_ARCHIVE_CUTOFF).
+-- =====================================================
+
+CREATE TABLE IF NOT EXISTS DonHang_Archive (
+    MaDonHang INT PRIMARY KEY,
+    NgayDat DATE NULL,
+    TongTien DECIMAL(10,2) NULL,
+    TrangThai VARCHAR(50) NULL,
+    MaKH INT NULL,
+    MaNV INT NULL,
+    KhuyenMai VARCHAR(50) NULL,
+    PhiShip DECIMAL(10,2) NULL,
+    MaShipper INT NULL,
+    NgayLuuTru DATETIME DEFAULT CURRENT_TIMESTAMP,   -- Archived at
+    INDEX idx_donhang_archive_ngaydat (NgayDat),
+    INDEX idx_donhang_archive_makh_ngaydat (MaKH, NgayDat, MaDonHang)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS DonHang_SanPham_Archive (
+    MaDonHang INT NOT NULL,
+    MaSP INT NOT NULL,
+    SoLuong INT NULL,
+    DonGia DECIMAL(10,2) NULL,
+    GiamGia DECIMAL(10,2) NULL,
+    PRIMARY KEY (MaDonHang, MaSP),
+    INDEX idx_donhang_sanpham_archive_masp (MaSP)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS ThanhToan_Archive (
+    MaThanhToan INT PRIMARY KEY,
+    PhuongThuc VARCHAR(50) NULL,
+    NgayThanhToan DATE NULL,
+    SoTien DECIMAL(10,2) NULL,
+    MaDonHang INT NULL,
+    INDEX ix_ThanhToan_Archive_MaDonHang (MaDonHang)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS PaymentTransaction_Archive (
+    TransactionId VARCHAR(50) PRIMARY KEY,
+    MaDonHang INT UNSIGNED NULL,
+    Amount DECIMAL(12,2) NOT NULL,
+    Status VARCHAR(20) NULL,
+    Signature VARCHAR(255) NULL,
+    CreatedAt DATETIME NULL,
+    UpdatedAt DATETIME NULL,
+    INDEX ix_PaymentTransaction_Archive_MaDonHang (MaDonHang)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
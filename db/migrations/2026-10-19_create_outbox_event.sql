@@ -0,0 +1,22 @@
+-- =====================================================
+-- Migration: Create OutboxEvent table
+-- Date: 2026-10-19
+-- Description: Transactional outbox for order side effects. Order status and
+--              delivery updates insert an event in the same transaction as
+--              the order change; a background dispatcher processes pending
+--              events in batches (activity log, catalog stock refresh).
+-- =====================================================
+
+CREATE TABLE IF NOT EXISTS OutboxEvent (
+    Id INT AUTO_INCREMENT PRIMARY KEY,
+    EventType VARCHAR(50) NOT NULL,
+    Entity VARCHAR(100) NULL,
+    EntityId VARCHAR(100) NULL,
+    Payload TEXT NULL,                         -- JSON
+    Status VARCHAR(20) DEFAULT 'PENDING',      -- PENDING, DONE, FAILED
+    Attempts INT DEFAULT 0,
+    LastError TEXT NULL,
+    CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+    ProcessedAt DATETIME NULL,
+    INDEX idx_outbox_status (Status, Id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,19 @@
+-- =====================================================
+-- Migration: Create SanPham_ThuocTinh table
+-- Date: 2026-10-19
+-- Description: Indexed side table for product attributes stored as JSON in
+--              SanPham.MoTa, so products can be filtered by attribute
+--              (brand, capacity, ...) without loading and parsing every row.
+-- =====================================================
+
+CREATE TABLE IF NOT EXISTS SanPham_ThuocTinh (
+    MaSP INT NOT NULL,
+    TenThuocTinh VARCHAR(50) NOT NULL,       -- Normalized key: lowercase, no diacritics ("dung tich" -> "capacity")
+    GiaTri VARCHAR(255),                     -- Attribute value as text
+    PRIMARY KEY (MaSP, TenThuocTinh),
+    FOREIGN KEY (MaSP) REFERENCES SanPham(MaSP) ON UPDATE CASCADE ON DELETE CASCADE,
+    INDEX idx_thuoctinh_giatri (TenThuocTinh, GiaTri, MaSP)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Backfill existing products after running this migration:
+--   POST /api/sanpham/attributes/reindex   (Admin)
@@ -0,0 +1,36 @@
+-- =====================================================
+-- Migration: Create StockLedger / StockSnapshot tables
+-- Date: 2026-10-19
+-- Description: Append-only history of stock movements (reserve, release,
+--              confirm, cancel, manual adjustment, import) plus periodic
+--              per-product snapshots folded from it. Stock at a point in
+--              time = latest snapshot before it + ledger deltas since.
+--              Existing stock is recorded as one 'opening' movement per
+--              product so the ledger sums to SanPham.SoLuongTonKho.
+-- =====================================================
+
+CREATE TABLE IF NOT EXISTS StockLedger (
+    Id INT AUTO_INCREMENT PRIMARY KEY,
+    MaSP INT NOT NULL,
+    Delta INT NOT NULL,
+    Reason VARCHAR(20) NOT NULL,               -- opening, confirm, reserve, release, cancel, adjust, import
+    RefType VARCHAR(30) NULL,                  -- DonHang, SanPham, ...
+    RefId VARCHAR(50) NULL,
+    UserId INT NULL,
+    CreatedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_stockledger_masp_time (MaSP, CreatedAt),
+    INDEX idx_stockledger_time (CreatedAt)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS StockSnapshot (
+    TakenAt DATETIME NOT NULL,
+    MaSP INT NOT NULL,
+    SoLuong INT NOT NULL,
+    PRIMARY KEY (TakenAt, MaSP)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Opening balance (only for products that have no movement yet)
+INSERT INTO StockLedger (MaSP, Delta, Reason, RefType, RefId, CreatedAt)
+SELECT sp.MaSP, COALESCE(sp.SoLuongTonKho, 0), 'opening', 'SanPham', sp.MaSP, UTC_TIMESTAMP()
+FROM SanPham sp
+WHERE NOT EXISTS (SELECT 1 FROM StockLedger l WHERE l.MaSP = sp.MaSP);